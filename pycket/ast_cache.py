@@ -0,0 +1,845 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Binary cache for normalized module ASTs.
+#
+# Loading a module from its expanded `.rkt.json` requires parsing the JSON,
+# converting it to an AST and running A-normalization over the result. For
+# large module graphs this dominates startup. The cache stores the module AST
+# after `Context.normalize_term` in a compact binary format next to the JSON
+# file, so that a later run only has to decode it and run `assign_convert`,
+# which is cheap in comparison. Assignment conversion is not cached since it
+# depends on the configuration the executable was built with (prune_env).
+#
+# Layout (all integers are LEB128 encoded, signed ones zig-zag encoded):
+#
+#   magic "PYKAST" + version byte
+#   flags byte (bit 0: bytecode expansion)
+#   source mtime (8 bytes, the bits of the float)
+#   md5 digest of the source (16 bytes)
+#   string table: count, then length-prefixed byte strings
+#   symbol table: count, then (kind byte, string index) pairs
+#   the module AST
+#
+import os
+
+from pycket             import values, values_string, values_regex, vector
+from pycket.bytesource  import StringSource, open_mmap
+from pycket.env         import SymList
+from pycket.interpreter import (
+    App,
+    Begin,
+    Begin0,
+    BeginForSyntax,
+    CaseLambda,
+    CellRef,
+    DefineValues,
+    If,
+    Lambda,
+    Let,
+    Letrec,
+    LexicalVar,
+    Module,
+    ModuleVar,
+    Quote,
+    QuoteSyntax,
+    Require,
+    SetBang,
+    ToplevelVar,
+    VariableReference,
+    WithContinuationMark,
+)
+
+from rpython.rlib                import rmd5, streamio
+from rpython.rlib.longlong2float import float2longlong, longlong2float
+from rpython.rlib.rarithmetic    import r_uint, r_longlong, r_ulonglong, intmask
+from rpython.rlib.rbigint        import rbigint
+from rpython.rlib.rstring        import StringBuilder
+
+MAGIC   = "PYKAST"
+VERSION = 1
+
+# position of the source mtime in the header
+MTIME_OFFSET = len(MAGIC) + 2
+
+class ASTCacheError(Exception):
+    """ Raised when an AST cannot be written to or read from the cache. The
+    cache is an optimization only, so callers fall back to the JSON. """
+    def __init__(self, msg):
+        self.msg = msg
+
+def _cache_name(file_name):
+    return file_name + '.ast'
+
+# Node tags
+(T_MODULE, T_REQUIRE, T_QUOTE, T_QUOTE_SYNTAX, T_VARIABLE_REFERENCE, T_WCM,
+ T_APP, T_BEGIN0, T_BEGIN, T_BEGIN_FOR_SYNTAX, T_LEXICAL_VAR, T_CELL_REF,
+ T_MODULE_VAR, T_TOPLEVEL_VAR, T_SET_BANG, T_IF, T_CASE_LAMBDA, T_LAMBDA,
+ T_LETREC, T_LET, T_DEFINE_VALUES, T_NONE) = range(22)
+
+# Value tags
+(V_VOID, V_TRUE, V_FALSE, V_NULL, V_FIXNUM, V_FLONUM, V_BIGNUM, V_RATIONAL,
+ V_COMPLEX, V_CHAR, V_STRING, V_SYMBOL, V_KEYWORD, V_LIST, V_VECTOR, V_BYTES,
+ V_PATH, V_BOX, V_REGEXP, V_PREGEXP, V_BYTE_REGEXP, V_BYTE_PREGEXP) = range(22)
+
+# Symbol kinds
+SYM_INTERNED, SYM_UNREADABLE, SYM_UNINTERNED = range(3)
+
+def source_digest(file_name):
+    f = streamio.open_file_as_stream(file_name)
+    try:
+        data = f.readall()
+    finally:
+        f.close()
+    return rmd5.RMD5(data).digest()
+
+def source_mtime(file_name):
+    return os.stat(file_name).st_mtime
+
+class ASTWriter(object):
+
+    def __init__(self):
+        self.out = StringBuilder()
+        self.strings = []
+        self.string_index = {}
+        self.symbols = []
+        self.symbol_index = {}
+
+    # ____________________________________________________________
+    # primitive encoders
+
+    def write_byte(self, b):
+        self.out.append(chr(b & 0xff))
+
+    def write_uint(self, n):
+        n = r_uint(n)
+        while n >= 0x80:
+            self.out.append(chr(intmask(n & 0x7f) | 0x80))
+            n = n >> 7
+        self.out.append(chr(intmask(n)))
+
+    def write_int(self, n):
+        if n >= 0:
+            self.write_uint(r_uint(n) << 1)
+        else:
+            self.write_uint((r_uint(~n) << 1) | 1)
+
+    def write_bool(self, b):
+        self.write_byte(1 if b else 0)
+
+    def write_float(self, f):
+        bits = r_ulonglong(float2longlong(f))
+        for i in range(8):
+            self.write_byte(intmask(bits >> (8 * (7 - i))))
+
+    def string_ref(self, s):
+        assert s is not None
+        idx = self.string_index.get(s, -1)
+        if idx < 0:
+            idx = len(self.strings)
+            self.strings.append(s)
+            self.string_index[s] = idx
+        return idx
+
+    def write_string(self, s):
+        self.write_uint(self.string_ref(s))
+
+    def write_opt_string(self, s):
+        if s is None:
+            self.write_uint(0)
+        else:
+            self.write_uint(self.string_ref(s) + 1)
+
+    def write_string_list(self, lst):
+        if lst is None:
+            self.write_int(-1)
+            return
+        self.write_int(len(lst))
+        for s in lst:
+            self.write_string(s)
+
+    def write_symbol(self, w_sym):
+        assert isinstance(w_sym, values.W_Symbol)
+        idx = self.symbol_index.get(w_sym, -1)
+        if idx < 0:
+            idx = len(self.symbols)
+            self.symbols.append(w_sym)
+            self.symbol_index[w_sym] = idx
+            self.string_ref(w_sym.utf8value)
+        self.write_uint(idx)
+
+    def write_opt_symbol(self, w_sym):
+        if w_sym is None:
+            self.write_bool(False)
+        else:
+            self.write_bool(True)
+            self.write_symbol(w_sym)
+
+    def write_symbols(self, syms):
+        self.write_uint(len(syms))
+        for w_sym in syms:
+            self.write_symbol(w_sym)
+
+    # ____________________________________________________________
+    # values
+
+    def write_value(self, w_val):
+        if w_val is values.w_void:
+            self.write_byte(V_VOID)
+        elif w_val is values.w_true:
+            self.write_byte(V_TRUE)
+        elif w_val is values.w_false:
+            self.write_byte(V_FALSE)
+        elif w_val is values.w_null:
+            self.write_byte(V_NULL)
+        elif isinstance(w_val, values.W_Fixnum):
+            self.write_byte(V_FIXNUM)
+            self.write_int(w_val.value)
+        elif isinstance(w_val, values.W_Flonum):
+            self.write_byte(V_FLONUM)
+            self.write_float(w_val.value)
+        elif isinstance(w_val, values.W_Bignum):
+            self.write_byte(V_BIGNUM)
+            self.write_string(w_val.value.str())
+        elif isinstance(w_val, values.W_Rational):
+            self.write_byte(V_RATIONAL)
+            self.write_string(w_val._numerator.str())
+            self.write_string(w_val._denominator.str())
+        elif isinstance(w_val, values.W_Complex):
+            self.write_byte(V_COMPLEX)
+            self.write_value(w_val.real)
+            self.write_value(w_val.imag)
+        elif isinstance(w_val, values.W_Character):
+            self.write_byte(V_CHAR)
+            self.write_uint(ord(w_val.value))
+        elif isinstance(w_val, values_string.W_String):
+            if not w_val.immutable():
+                raise ASTCacheError("mutable string literal")
+            self.write_byte(V_STRING)
+            self.write_string(w_val.as_str_utf8())
+        elif isinstance(w_val, values.W_Symbol):
+            self.write_byte(V_SYMBOL)
+            self.write_symbol(w_val)
+        elif isinstance(w_val, values.W_Keyword):
+            self.write_byte(V_KEYWORD)
+            self.write_string(w_val.value)
+        elif isinstance(w_val, values.W_Cons):
+            # lists are written iteratively, literal lists can be long
+            elems = []
+            while isinstance(w_val, values.W_Cons):
+                elems.append(w_val.car())
+                w_val = w_val.cdr()
+            self.write_byte(V_LIST)
+            self.write_uint(len(elems))
+            for w_elem in elems:
+                self.write_value(w_elem)
+            self.write_value(w_val)
+        elif isinstance(w_val, vector.W_Vector):
+            if not w_val.immutable():
+                raise ASTCacheError("mutable vector literal")
+            self.write_byte(V_VECTOR)
+            length = w_val.length()
+            self.write_uint(length)
+            for i in range(length):
+                self.write_value(w_val.ref(i))
+        elif isinstance(w_val, values.W_ImmutableBytes):
+            self.write_byte(V_BYTES)
+            self.write_string("".join(w_val.value))
+        elif isinstance(w_val, values.W_Path):
+            self.write_byte(V_PATH)
+            self.write_string(w_val.path)
+        elif isinstance(w_val, values.W_IBox):
+            self.write_byte(V_BOX)
+            self.write_value(w_val.value)
+        elif isinstance(w_val, values_regex.W_AnyRegexp):
+            if isinstance(w_val, values_regex.W_Regexp):
+                self.write_byte(V_REGEXP)
+            elif isinstance(w_val, values_regex.W_PRegexp):
+                self.write_byte(V_PREGEXP)
+            elif isinstance(w_val, values_regex.W_ByteRegexp):
+                self.write_byte(V_BYTE_REGEXP)
+            else:
+                assert isinstance(w_val, values_regex.W_BytePRegexp)
+                self.write_byte(V_BYTE_PREGEXP)
+            self.write_string(w_val.source)
+        else:
+            raise ASTCacheError("cannot cache literal of type %s" % w_val.errorname)
+
+    # ____________________________________________________________
+    # AST nodes
+
+    def write_asts(self, asts):
+        self.write_uint(len(asts))
+        for ast in asts:
+            self.write_ast(ast)
+
+    def write_opt_ast(self, ast):
+        if ast is None:
+            self.write_byte(T_NONE)
+        else:
+            self.write_ast(ast)
+
+    def write_ast(self, ast):
+        if isinstance(ast, Module):
+            self.write_byte(T_MODULE)
+            self.write_string(ast.name)
+            self.write_opt_ast(ast.lang)
+            keys = ast.config.keys()
+            self.write_uint(len(keys))
+            for key in keys:
+                self.write_string(key)
+                self.write_string(ast.config[key])
+            self.write_asts(ast.rebuild_body())
+        elif isinstance(ast, Require):
+            self.write_byte(T_REQUIRE)
+            self.write_opt_string(ast.fname)
+            self.write_string_list(ast.path)
+            self.write_bool(ast.loader is not None)
+        elif isinstance(ast, Quote):
+            self.write_byte(T_QUOTE)
+            self.write_value(ast.w_val)
+        elif isinstance(ast, QuoteSyntax):
+            self.write_byte(T_QUOTE_SYNTAX)
+            self.write_value(ast.w_val)
+        elif isinstance(ast, VariableReference):
+            self.write_byte(T_VARIABLE_REFERENCE)
+            self.write_opt_ast(ast.var)
+            self.write_opt_string(ast.path)
+            self.write_bool(ast.is_mut)
+        elif isinstance(ast, WithContinuationMark):
+            self.write_byte(T_WCM)
+            self.write_ast(ast.key)
+            self.write_ast(ast.value)
+            self.write_ast(ast.body)
+        elif isinstance(ast, App):
+            self.write_byte(T_APP)
+            self.write_ast(ast.rator)
+            self.write_asts(ast.rands)
+        elif isinstance(ast, Begin0):
+            self.write_byte(T_BEGIN0)
+            self.write_ast(ast.first)
+            self.write_asts(ast.body)
+        elif isinstance(ast, Begin):
+            self.write_byte(T_BEGIN)
+            self.write_asts(ast.body)
+        elif isinstance(ast, BeginForSyntax):
+            self.write_byte(T_BEGIN_FOR_SYNTAX)
+            self.write_asts(ast.body)
+        elif isinstance(ast, LexicalVar):
+            self.write_byte(T_LEXICAL_VAR)
+            self.write_symbol(ast.sym)
+        elif isinstance(ast, CellRef):
+            self.write_byte(T_CELL_REF)
+            self.write_symbol(ast.sym)
+        elif isinstance(ast, ModuleVar):
+            self.write_byte(T_MODULE_VAR)
+            self.write_symbol(ast.sym)
+            self.write_opt_string(ast.srcmod)
+            self.write_symbol(ast.srcsym)
+            self.write_string_list(ast.path)
+        elif isinstance(ast, ToplevelVar):
+            self.write_byte(T_TOPLEVEL_VAR)
+            self.write_symbol(ast.sym)
+        elif isinstance(ast, SetBang):
+            self.write_byte(T_SET_BANG)
+            self.write_ast(ast.var)
+            self.write_ast(ast.rhs)
+        elif isinstance(ast, If):
+            self.write_byte(T_IF)
+            self.write_ast(ast.tst)
+            self.write_ast(ast.thn)
+            self.write_ast(ast.els)
+        elif isinstance(ast, CaseLambda):
+            self.write_byte(T_CASE_LAMBDA)
+            self.write_opt_symbol(ast.recursive_sym)
+            self.write_asts(ast.lams)
+        elif isinstance(ast, Lambda):
+            self.write_byte(T_LAMBDA)
+            self.write_symbols(ast.formals)
+            self.write_opt_symbol(ast.rest)
+            self.write_symbols(ast.frees.elems)
+            info = ast.sourceinfo
+            self.write_bool(info is not None)
+            if info is not None:
+                self.write_int(info.position)
+                self.write_int(info.line)
+                self.write_int(info.column)
+                self.write_int(info.span)
+                self.write_opt_string(info.sourcefile)
+            self.write_asts(ast.body)
+        elif isinstance(ast, Letrec):
+            self.write_byte(T_LETREC)
+            self.write_symbols(ast.args.elems)
+            self.write_uint(len(ast.counts))
+            for count in ast.counts:
+                self.write_uint(count)
+            self.write_asts(ast.rhss)
+            self.write_asts(ast.body)
+        elif isinstance(ast, Let):
+            self.write_byte(T_LET)
+            self.write_symbols(ast.args.elems)
+            self.write_uint(len(ast.counts))
+            for count in ast.counts:
+                self.write_uint(count)
+            self.write_asts(ast.rhss)
+            self.write_asts(ast.body)
+        elif isinstance(ast, DefineValues):
+            self.write_byte(T_DEFINE_VALUES)
+            self.write_symbols(ast.names)
+            self.write_symbols(ast.display_names)
+            self.write_ast(ast.rhs)
+        else:
+            raise ASTCacheError("cannot cache AST node %s" % ast.tostring())
+
+    # ____________________________________________________________
+
+    def build(self, module, mtime, digest, bytecode_expand):
+        self.write_ast(module)
+        tree = self.out.build()
+
+        self.out = StringBuilder()
+        self.out.append(MAGIC)
+        self.write_byte(VERSION)
+        self.write_byte(1 if bytecode_expand else 0)
+        self.write_float(mtime)
+        assert len(digest) == 16
+        self.out.append(digest)
+        self.write_tables()
+        self.out.append(tree)
+        return self.out.build()
+
+    def write_tables(self):
+        """ Writes the string and symbol tables collected so far. They have
+        to precede everything that refers to them. """
+        self.write_uint(len(self.strings))
+        for s in self.strings:
+            self.write_uint(len(s))
+            self.out.append(s)
+        self.write_uint(len(self.symbols))
+        for w_sym in self.symbols:
+            if w_sym.is_interned():
+                kind = SYM_UNREADABLE if w_sym.unreadable else SYM_INTERNED
+            else:
+                kind = SYM_UNINTERNED
+            self.write_byte(kind)
+            self.write_uint(self.string_ref(w_sym.utf8value))
+
+class ASTReader(object):
+
+    def __init__(self, source, loader):
+        self.source = source
+        self.pos = 0
+        self.loader = loader
+        self.strings = []
+        self.symbols = []
+
+    # ____________________________________________________________
+    # primitive decoders
+
+    def read_byte(self):
+        if self.pos >= self.source.getlength():
+            raise ASTCacheError("truncated AST cache")
+        ch = self.source.getitem(self.pos)
+        self.pos += 1
+        return ord(ch)
+
+    def read_bytes(self, length):
+        start = self.pos
+        if start + length > self.source.getlength():
+            raise ASTCacheError("truncated AST cache")
+        self.pos = start + length
+        return self.source.getslice(start, length)
+
+    def read_uint(self):
+        result = r_uint(0)
+        shift = 0
+        while True:
+            b = self.read_byte()
+            result |= r_uint(b & 0x7f) << shift
+            if b < 0x80:
+                return intmask(result)
+            shift += 7
+
+    def read_uint_raw(self):
+        result = r_uint(0)
+        shift = 0
+        while True:
+            b = self.read_byte()
+            result |= r_uint(b & 0x7f) << shift
+            if b < 0x80:
+                return result
+            shift += 7
+
+    def read_int(self):
+        n = self.read_uint_raw()
+        if n & 1:
+            return intmask(~(n >> 1))
+        return intmask(n >> 1)
+
+    def read_bool(self):
+        return self.read_byte() != 0
+
+    def read_float(self):
+        bits = r_ulonglong(0)
+        for i in range(8):
+            bits = (bits << 8) | r_ulonglong(self.read_byte())
+        return longlong2float(r_longlong(bits))
+
+    def read_string(self):
+        idx = self.read_uint()
+        if idx >= len(self.strings):
+            raise ASTCacheError("bad string index")
+        return self.strings[idx]
+
+    def read_opt_string(self):
+        idx = self.read_uint()
+        if idx == 0:
+            return None
+        idx -= 1
+        if idx >= len(self.strings):
+            raise ASTCacheError("bad string index")
+        return self.strings[idx]
+
+    def read_string_list(self):
+        n = self.read_int()
+        if n < 0:
+            return None
+        return [self.read_string() for i in range(n)]
+
+    def read_symbol(self):
+        idx = self.read_uint()
+        if idx >= len(self.symbols):
+            raise ASTCacheError("bad symbol index")
+        return self.symbols[idx]
+
+    def read_opt_symbol(self):
+        if self.read_bool():
+            return self.read_symbol()
+        return None
+
+    def read_symbols(self):
+        n = self.read_uint()
+        return [self.read_symbol() for i in range(n)]
+
+    # ____________________________________________________________
+
+    def read_header(self, mtime, digest, bytecode_expand):
+        """ Returns True if the cache is still valid for the given source """
+        if self.read_bytes(len(MAGIC)) != MAGIC:
+            return False
+        if self.read_byte() != VERSION:
+            return False
+        if self.read_bool() != bytecode_expand:
+            return False
+        cached_mtime = self.read_float()
+        cached_digest = self.read_bytes(16)
+        if cached_mtime != mtime:
+            if digest is None or cached_digest != digest:
+                return False
+        return True
+
+    def read_tables(self):
+        n = self.read_uint()
+        strings = [None] * n
+        for i in range(n):
+            length = self.read_uint()
+            strings[i] = self.read_bytes(length)
+        self.strings = strings
+        n = self.read_uint()
+        symbols = [None] * n
+        for i in range(n):
+            kind = self.read_byte()
+            name = self.read_string()
+            if kind == SYM_INTERNED:
+                w_sym = values.W_Symbol.make(name)
+            elif kind == SYM_UNREADABLE:
+                w_sym = values.W_Symbol.make_unreadable(name)
+            else:
+                # uninterned symbols only need to preserve identity within
+                # the module, so one fresh symbol per table entry suffices
+                w_sym = values.W_Symbol(name)
+            symbols[i] = w_sym
+        self.symbols = symbols
+
+    # ____________________________________________________________
+    # values
+
+    def read_value(self):
+        tag = self.read_byte()
+        if tag == V_VOID:
+            return values.w_void
+        if tag == V_TRUE:
+            return values.w_true
+        if tag == V_FALSE:
+            return values.w_false
+        if tag == V_NULL:
+            return values.w_null
+        if tag == V_FIXNUM:
+            return values.W_Fixnum.make(self.read_int())
+        if tag == V_FLONUM:
+            return values.W_Flonum.make(self.read_float())
+        if tag == V_BIGNUM:
+            return values.W_Bignum(rbigint.fromdecimalstr(self.read_string()))
+        if tag == V_RATIONAL:
+            num = rbigint.fromdecimalstr(self.read_string())
+            den = rbigint.fromdecimalstr(self.read_string())
+            return values.W_Rational(num, den)
+        if tag == V_COMPLEX:
+            real = self.read_value()
+            imag = self.read_value()
+            assert isinstance(real, values.W_Real)
+            assert isinstance(imag, values.W_Real)
+            return values.W_Complex.make(real, imag)
+        if tag == V_CHAR:
+            return values.W_Character.make(unichr(self.read_uint()))
+        if tag == V_STRING:
+            return values_string.W_String.make(self.read_string())
+        if tag == V_SYMBOL:
+            return self.read_symbol()
+        if tag == V_KEYWORD:
+            return values.W_Keyword.make(self.read_string())
+        if tag == V_LIST:
+            n = self.read_uint()
+            elems = [self.read_value() for i in range(n)]
+            tail = self.read_value()
+            return values.to_improper(elems, tail)
+        if tag == V_VECTOR:
+            n = self.read_uint()
+            elems = [self.read_value() for i in range(n)]
+            return vector.W_Vector.fromelements(elems, immutable=True)
+        if tag == V_BYTES:
+            return values.W_ImmutableBytes(list(self.read_string()))
+        if tag == V_PATH:
+            return values.W_Path(self.read_string())
+        if tag == V_BOX:
+            return values.W_IBox(self.read_value())
+        if tag == V_REGEXP:
+            return values_regex.W_Regexp(self.read_string())
+        if tag == V_PREGEXP:
+            return values_regex.W_PRegexp(self.read_string())
+        if tag == V_BYTE_REGEXP:
+            return values_regex.W_ByteRegexp(self.read_string())
+        if tag == V_BYTE_PREGEXP:
+            return values_regex.W_BytePRegexp(self.read_string())
+        raise ASTCacheError("unknown value tag %d" % tag)
+
+    # ____________________________________________________________
+    # AST nodes
+
+    def read_asts(self):
+        n = self.read_uint()
+        return [self.read_ast() for i in range(n)]
+
+    def read_opt_ast(self):
+        return self.read_ast_tag(self.read_byte())
+
+    def read_ast(self):
+        ast = self.read_ast_tag(self.read_byte())
+        if ast is None:
+            raise ASTCacheError("unexpected empty AST node")
+        return ast
+
+    def read_counts(self):
+        n = self.read_uint()
+        return [self.read_uint() for i in range(n)]
+
+    def read_ast_tag(self, tag):
+        if tag == T_NONE:
+            return None
+        if tag == T_MODULE:
+            name = self.read_string()
+            lang = self.read_opt_ast()
+            config = {}
+            for i in range(self.read_uint()):
+                key = self.read_string()
+                config[key] = self.read_string()
+            body = self.read_asts()
+            return Module(name, body, config, lang=lang)
+        if tag == T_REQUIRE:
+            fname = self.read_opt_string()
+            path = self.read_string_list()
+            loader = self.loader if self.read_bool() else None
+            return Require(fname, loader, path=path)
+        if tag == T_QUOTE:
+            return Quote(self.read_value())
+        if tag == T_QUOTE_SYNTAX:
+            return QuoteSyntax(self.read_value())
+        if tag == T_VARIABLE_REFERENCE:
+            var = self.read_opt_ast()
+            path = self.read_opt_string()
+            is_mut = self.read_bool()
+            return VariableReference(var, path, is_mut)
+        if tag == T_WCM:
+            key = self.read_ast()
+            value = self.read_ast()
+            body = self.read_ast()
+            return WithContinuationMark(key, value, body)
+        if tag == T_APP:
+            rator = self.read_ast()
+            rands = self.read_asts()
+            return App.make(rator, rands)
+        if tag == T_BEGIN0:
+            first = self.read_ast()
+            body = self.read_asts()
+            return Begin0(first, body)
+        if tag == T_BEGIN:
+            return Begin(self.read_asts())
+        if tag == T_BEGIN_FOR_SYNTAX:
+            return BeginForSyntax(self.read_asts())
+        if tag == T_LEXICAL_VAR:
+            return LexicalVar(self.read_symbol())
+        if tag == T_CELL_REF:
+            return CellRef(self.read_symbol())
+        if tag == T_MODULE_VAR:
+            sym = self.read_symbol()
+            srcmod = self.read_opt_string()
+            srcsym = self.read_symbol()
+            path = self.read_string_list()
+            return ModuleVar(sym, srcmod, srcsym, path=path)
+        if tag == T_TOPLEVEL_VAR:
+            return ToplevelVar(self.read_symbol())
+        if tag == T_SET_BANG:
+            var = self.read_ast()
+            rhs = self.read_ast()
+            return SetBang(var, rhs)
+        if tag == T_IF:
+            tst = self.read_ast()
+            thn = self.read_ast()
+            els = self.read_ast()
+            return If(tst, thn, els)
+        if tag == T_CASE_LAMBDA:
+            recursive_sym = self.read_opt_symbol()
+            lams = self.read_asts()
+            return CaseLambda(lams, recursive_sym=recursive_sym)
+        if tag == T_LAMBDA:
+            formals = self.read_symbols()
+            rest = self.read_opt_symbol()
+            frees = SymList(self.read_symbols())
+            sourceinfo = None
+            if self.read_bool():
+                position = self.read_int()
+                line = self.read_int()
+                column = self.read_int()
+                span = self.read_int()
+                sourcefile = self.read_opt_string()
+                from pycket.expand import SourceInfo
+                sourceinfo = SourceInfo(position, line, column, span, sourcefile)
+            body = self.read_asts()
+            args = SymList(formals + ([rest] if rest else []), frees)
+            return Lambda(formals, rest, args, frees, body, sourceinfo=sourceinfo)
+        if tag == T_LETREC:
+            args = SymList(self.read_symbols())
+            counts = self.read_counts()
+            rhss = self.read_asts()
+            body = self.read_asts()
+            return Letrec(args, counts, rhss, body)
+        if tag == T_LET:
+            args = SymList(self.read_symbols())
+            counts = self.read_counts()
+            rhss = self.read_asts()
+            body = self.read_asts()
+            return Let(args, counts, rhss, body)
+        if tag == T_DEFINE_VALUES:
+            names = self.read_symbols()
+            display_names = self.read_symbols()
+            rhs = self.read_ast()
+            return DefineValues(names, rhs, display_names)
+        raise ASTCacheError("unknown AST tag %d" % tag)
+
+def serialize_module(module, mtime, digest, bytecode_expand=False):
+    return ASTWriter().build(module, mtime, digest, bytecode_expand)
+
+def deserialize_module(source, loader, mtime=0.0, digest=None,
+                       bytecode_expand=False):
+    reader = ASTReader(source, loader)
+    if not reader.read_header(mtime, digest, bytecode_expand):
+        return None
+    reader.read_tables()
+    module = reader.read_ast()
+    assert isinstance(module, Module)
+    return module
+
+def load_cached_module(file_name, loader, bytecode_expand=False):
+    """ Returns the normalized module AST for `file_name` if an up to date
+    cache exists, otherwise None. The content hash of the source is only
+    computed when the modification time differs from the recorded one. """
+    cache = _cache_name(file_name)
+    json = file_name + '.json'
+    try:
+        if not os.access(cache, os.R_OK):
+            return None
+        cache_mtime = os.stat(cache).st_mtime
+        if os.access(json, os.F_OK) and os.stat(json).st_mtime > cache_mtime:
+            return None
+        mtime = source_mtime(file_name)
+    except OSError:
+        return None
+    source = open_mmap(cache)
+    if source is None:
+        return None
+    stale_mtime = False
+    try:
+        reader = ASTReader(source, loader)
+        if not reader.read_header(mtime, None, bytecode_expand):
+            try:
+                digest = source_digest(file_name)
+            except (OSError, streamio.StreamError):
+                return None
+            reader = ASTReader(source, loader)
+            if not reader.read_header(mtime, digest, bytecode_expand):
+                return None
+            stale_mtime = True
+        reader.read_tables()
+        module = reader.read_ast()
+    except ASTCacheError:
+        return None
+    finally:
+        source.close()
+    assert isinstance(module, Module)
+    if stale_mtime:
+        # the source was touched but not changed, record the new mtime so
+        # that the next load does not hash the source again
+        refresh_cached_mtime(cache, mtime)
+    return module
+
+def refresh_cached_mtime(cache, mtime):
+    """ Overwrites the source mtime in the header of the cache. The field has
+    a fixed size, so the rest of the file stays as it is. Failures are
+    silently ignored. """
+    writer = ASTWriter()
+    writer.write_float(mtime)
+    data = writer.out.build()
+    try:
+        fd = os.open(cache, os.O_WRONLY, 0)
+        try:
+            os.lseek(fd, MTIME_OFFSET, 0)
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except OSError:
+        return False
+    return True
+
+def write_cached_module(file_name, module, bytecode_expand=False):
+    """ Writes the normalized module AST next to the source. The cache is
+    written to a temporary file and renamed into place, so concurrent readers
+    never observe a partial file. Failures are silently ignored. """
+    cache = _cache_name(file_name)
+    tmp = cache + '.tmp%d' % os.getpid()
+    try:
+        mtime = source_mtime(file_name)
+        digest = source_digest(file_name)
+        data = serialize_module(module, mtime, digest, bytecode_expand)
+        f = streamio.open_file_as_stream(tmp, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp, cache)
+    except (ASTCacheError, OSError, streamio.StreamError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Read-only views onto raw bytes, either held in a string or memory-mapped
+# from a file. Used by the binary AST cache and the indexed module bundles so
+# that loading a cache only touches the pages that are actually decoded.
+#
+import os
+
+from rpython.rlib import rmmap
+
+class ByteSource(object):
+    _attrs_ = []
+
+    def getlength(self):
+        raise NotImplementedError("abstract base class")
+
+    def getitem(self, index):
+        raise NotImplementedError("abstract base class")
+
+    def getslice(self, start, length):
+        raise NotImplementedError("abstract base class")
+
+    def close(self):
+        pass
+
+class StringSource(ByteSource):
+    _attrs_ = _immutable_fields_ = ["data"]
+
+    def __init__(self, data):
+        assert data is not None
+        self.data = data
+
+    def getlength(self):
+        return len(self.data)
+
+    def getitem(self, index):
+        return self.data[index]
+
+    def getslice(self, start, length):
+        assert start >= 0 and length >= 0
+        return self.data[start:start + length]
+
+class MMapSource(ByteSource):
+    _attrs_ = ["mmap", "length"]
+
+    def __init__(self, mmap, length):
+        self.mmap = mmap
+        self.length = length
+
+    def getlength(self):
+        return self.length
+
+    def getitem(self, index):
+        return self.mmap.getitem(index)
+
+    def getslice(self, start, length):
+        return self.mmap.getslice(start, length)
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+def open_mmap(fname):
+    """ Map the given file read-only. Returns None if the file cannot be
+    mapped (missing, empty, or the platform refuses), in which case callers
+    should treat the file as absent. """
+    try:
+        fd = os.open(fname, os.O_RDONLY, 0)
+    except OSError:
+        return None
+    try:
+        size = int(os.fstat(fd).st_size)
+        if size <= 0:
+            return None
+        try:
+            m = rmmap.mmap(fd, size, access=rmmap.ACCESS_READ)
+        except (rmmap.RValueError, rmmap.RTypeError, OSError):
+            return None
+        return MMapSource(m, size)
+    finally:
+        os.close(fd)
+
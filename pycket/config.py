@@ -21,7 +21,11 @@ pycketoption_descr = OptionDescription(
     BoolOption("immutable_boolean_field_elision", "elide immutable boolean fields from structs",
                default=False, cmdline="--ibfe"),
     BoolOption("hidden_classes", "use hidden classes to implement impersonators",
-               default=True, cmdline="--hidden-classes")
+               default=True, cmdline="--hidden-classes"),
+    BoolOption("ast_optimizer", "inline small procedures and fold constants before interpretation",
+               default=True, cmdline="--ast-optimizer"),
+    IntOption("inline_size", "the size, in AST nodes, up to which a procedure body is inlined",
+              default=20, cmdline="--inline-size")
 ])
 
 def get_testing_config(**overrides):
@@ -46,6 +50,8 @@ def compute_executable_suffix(config):
         res.append("-no-type-size-specialization")
     if not config.hidden_classes:
         res.append("-no-hidden-classes")
+    if not config.ast_optimizer:
+        res.append("-no-ast-optimizer")
     if config.immutable_boolean_field_elision:
         res.append("-ibfe")
     return "".join(res)
@@ -62,6 +68,8 @@ exposed_options = ['strategies',
                    'prune_env',
                    'immutable_boolean_field_elision',
                    'hidden_classes',
+                   'ast_optimizer',
+                   'inline_size',
 ]
 
 def expose_options(config):
@@ -21,6 +21,9 @@ class Link(AbstractLink):
         self.key = k
         self.val = v
         self.next = next
+        # set on the first link of a continuation whose marks a cached
+        # parameterization depends on, see _cache_paramz
+        self.walked = False
 
     @jit.unroll_safe
     def clone_links(self):
@@ -37,10 +40,68 @@ class ForwardLink(AbstractLink):
     def __init__(self, cont):
         assert isinstance(cont, BaseCont)
         self.cont = cont
+        # the innermost parameterization as seen from cont, valid as long as
+        # paramz_epoch has not changed since it was stored
+        self.paramz = None
+        self.paramz_epoch = -1
 
     def clone_links(self):
         return self
 
+class ParamzEpoch(object):
+    """ Counts the updates of parameterization marks on continuations that
+    cached parameterizations depend on. Such an update invalidates every
+    cached parameterization. Updates of other continuations, like the fresh
+    copy `parameterize` makes of its continuation, leave the caches alone. """
+    _attrs_ = ['value']
+
+    def __init__(self):
+        self.value = 0
+
+paramz_epoch = ParamzEpoch()
+
+@jit.unroll_safe
+def _find_paramz_step(cont, key, epoch):
+    """ Returns the parameterization in the marks of `cont` or cached in their
+    ForwardLink, or else the continuation to search next """
+    l = cont.marks
+    while isinstance(l, Link):
+        if l.key is key:
+            return l.val, None
+        l = l.next
+    if isinstance(l, ForwardLink):
+        if l.paramz_epoch == epoch:
+            return l.paramz, None
+        return None, l.cont
+    return None, None
+
+@jit.dont_look_inside
+def _cache_paramz(cont, w_paramz, key, epoch):
+    while cont is not None:
+        l = cont.marks
+        while isinstance(l, Link):
+            if l.key is key:
+                return
+            l = l.next
+        if not isinstance(l, ForwardLink) or l.paramz_epoch == epoch:
+            return
+        l.paramz = w_paramz
+        l.paramz_epoch = epoch
+        cont = l.cont
+        # the cache now depends on the marks of cont
+        first = cont.marks
+        if isinstance(first, Link):
+            first.walked = True
+
+def _is_walked(cont):
+    """ Whether a cached parameterization may depend on the marks of `cont` """
+    first = cont.marks
+    if isinstance(first, Link):
+        return first.walked
+    # prompts and barriers get a ForwardLink of their own even without marks,
+    # there is no link to tell whether a cache went through them
+    return isinstance(cont, Prompt) or isinstance(cont, Barrier)
+
 class BaseCont(object):
     # Racket also keeps a separate stack for continuation marks
     # so that they can be saved without saving the whole continuation.
@@ -102,13 +163,19 @@ class BaseCont(object):
     @jit.unroll_safe
     def update_cm(self, k, v):
         from pycket.prims.equal import eqp_logic
+        from pycket.values import parameterization_key
+        walked = _is_walked(self)
+        if walked and k is parameterization_key:
+            paramz_epoch.value += 1
         l = self.marks
         while isinstance(l, Link):
             if eqp_logic(l.key, k):
                 l.val = v
                 return
             l = l.next
-        self.marks = Link(k, v, self.marks)
+        first = Link(k, v, self.marks)
+        first.walked = walked
+        self.marks = first
 
     def get_marks(self, key, upto=[]):
         from pycket import values
@@ -131,6 +198,20 @@ class BaseCont(object):
             p = next
         return None
 
+    def get_parameterization(self):
+        """ Same as get_mark_first(parameterization_key), but the result is
+        cached in the ForwardLinks passed on the way, so that parameter
+        lookups do not walk the marks of a deep recursion every time """
+        from pycket.values import parameterization_key
+        epoch = paramz_epoch.value
+        w_paramz, next = _find_paramz_step(self, parameterization_key, epoch)
+        if next is None:
+            return w_paramz
+        while next is not None:
+            w_paramz, next = _find_paramz_step(next, parameterization_key, epoch)
+        _cache_paramz(self, w_paramz, parameterization_key, epoch)
+        return w_paramz
+
     def stop_at(self, upto):
         return False
 
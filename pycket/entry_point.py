@@ -3,6 +3,8 @@
 #
 # _____ Define and setup target ___
 
+import os
+
 from rpython.rlib import jit, objectmodel
 
 POST_RUN_CALLBACKS = []
@@ -28,6 +30,8 @@ def make_entry_point(pycketconfig=None):
     from pycket.error import SchemeException
     from pycket.option_helper import parse_args, ensure_json_ast
     from pycket.values_string import W_String
+    from pycket import expander
+    from pycket.prims.logging import configure_receivers
 
     def entry_point(argv):
         if not objectmodel.we_are_translated():
@@ -49,6 +53,8 @@ def make_entry_point(pycketconfig=None):
         config, names, args, retval = parse_args(argv)
         if retval != 0 or config is None:
             return retval
+        if config['server']:
+            return run_server(config, names)
         args_w = [W_String.fromstr_utf8(arg) for arg in args]
         module_name, json_ast = ensure_json_ast(config, names)
 
@@ -57,10 +63,15 @@ def make_entry_point(pycketconfig=None):
 
         multi_mod_map = ModuleMap(json_ast) if multi_mod_flag else None
 
+        expander.set_expander_enabled(config['expander-server'])
+        configure_receivers(os.environ.get('PLTSTDERR', 'error'),
+                            names.get('log-file', ''),
+                            names.get('log-level', 'debug'))
         reader = JsonLoader(bytecode_expand=entry_flag,
                             multiple_modules=multi_mod_flag,
-                            module_mapper=multi_mod_map)
-        
+                            module_mapper=multi_mod_map,
+                            use_ast_cache=config['ast-cache'])
+
         if json_ast is None:
             ast = reader.expand_to_ast(module_name)
         else:
@@ -77,6 +88,26 @@ def make_entry_point(pycketconfig=None):
             for callback in POST_RUN_CALLBACKS:
                 callback(config, env)
             shutdown(env)
+            expander.shutdown_expander()
+        return 0
+
+    def run_server(config, names):
+        from pycket.prims.input_output import stdin_port, stdout_port
+        from pycket.server import Server
+        expander.set_expander_enabled(config['expander-server'])
+        configure_receivers(os.environ.get('PLTSTDERR', 'error'),
+                            names.get('log-file', ''),
+                            names.get('log-level', 'debug'))
+        reader = JsonLoader(use_ast_cache=config['ast-cache'])
+        env = ToplevelEnv(pycketconfig)
+        try:
+            Server(reader, env, stdin_port, stdout_port).serve()
+        finally:
+            from pycket.prims.input_output import shutdown
+            for callback in POST_RUN_CALLBACKS:
+                callback(config, env)
+            shutdown(env)
+            expander.shutdown_expander()
         return 0
     return entry_point
 
@@ -97,6 +97,14 @@ class ModuleEnv(object):
         else:
             self.modules[name] = module
 
+    def replace_module(self, name, module):
+        """ Registers a fresh copy of a module under the name of one that was
+        added before. Used by the server, which instantiates the main module
+        of every request anew. """
+        from pycket.interpreter import Module
+        assert isinstance(module, Module)
+        self.modules[name] = module
+
     @jit.elidable
     def _find_module(self, name):
         return self.modules.get(name, None)
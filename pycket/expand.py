@@ -11,14 +11,18 @@ from rpython.rlib.objectmodel import specialize, we_are_translated
 from rpython.rlib.rstring import ParseStringError, ParseStringOverflowError
 from rpython.rlib.rarithmetic import string_to_int
 from rpython.rlib.unroll import unrolling_iterable
+from pycket import config
 from pycket import pycket_json
+from pycket import ast_cache
+from pycket import expander
+from pycket.bytesource import StringSource, open_mmap
 from pycket.error import SchemeException
 from pycket.interpreter import *
 from pycket import values, values_string
 from pycket import values_regex
 from pycket import vector
 from pycket import values_struct
-from pycket.hash.equal import W_EqualHashTable
+from pycket.hash.equal import make_equal_immutable_table
 
 class ExpandException(SchemeException):
     pass
@@ -49,6 +53,8 @@ _BE = "-l pycket/zo-expand --"
 
 module_map = {}
 
+BUNDLE_MAGIC = "pycket-bundle 1 "
+
 current_racket_proc = None
 
 def expand_string(s, reuse=True, srcloc=True, byte_option=False, tmp_file_name=False):
@@ -62,6 +68,11 @@ def expand_string(s, reuse=True, srcloc=True, byte_option=False, tmp_file_name=F
         tmp_module = tmp_file_name + '.rkt'
         cmd = "racket -l pycket/zo-expand -- --test --stdout %s" % tmp_module
 
+    if reuse and not byte_option:
+        data = _expand_with_server("expand-string", s.encode("utf-8"), srcloc)
+        if data is not None:
+            return data
+
     if current_racket_proc and reuse and current_racket_proc.poll() is None:
         process = current_racket_proc
     else:
@@ -100,6 +111,20 @@ def expand_file(fname):
         raise ExpandException("Racket produced an error")
     return data
 
+# Send a request to the shared expander server (see expander.py). Returns None
+# if the server is not available, in which case the caller starts racket itself.
+def _expand_with_server(op, payload, srcloc=True):
+    server = expander.get_expander()
+    if server is None:
+        return None
+    try:
+        return server.request(op, payload, srcloc)
+    except expander.ExpanderError as e:
+        raise ExpandException("Racket produced an error and said '%s'" % e.msg)
+    except expander.ExpanderUnavailable:
+        expander.expander_failed()
+        return None
+
 # Call the Racket expander and read its output from STDOUT rather than producing an
 # intermediate (possibly cached) file.
 def expand_file_rpython(rkt_file, lib=_FN):
@@ -107,6 +132,10 @@ def expand_file_rpython(rkt_file, lib=_FN):
     cmd = "racket %s --stdout \"%s\" 2>&1" % (lib, rkt_file)
     if not os.access(rkt_file, os.R_OK):
         raise ValueError("Cannot access file %s" % rkt_file)
+    if lib == _FN:
+        out = _expand_with_server("expand", rkt_file)
+        if out is not None:
+            return out
     pipe = create_popen_file(cmd, "r")
     out = pipe.read()
     err = os.WEXITSTATUS(pipe.close())
@@ -167,16 +196,20 @@ def _expand_file_to_json(rkt_file, json_file, byte_flag=False, multi_flag=False)
         pass
 
     if multi_flag:
-        print "Complete expansion for %s into %s" % (rkt_file, json_file)
+        report_expansion("Complete expansion for %s into %s" % (rkt_file, json_file))
         cmd = "racket %s --complete-expansion --output \"%s\" \"%s\" 2>&1" % (lib, json_file, rkt_file)
     else:
         if byte_flag:
-            print "Transforming %s bytecode to %s" % (rkt_file, json_file)
+            report_expansion("Transforming %s bytecode to %s" % (rkt_file, json_file))
         else:
-            print "Expanding %s to %s" % (rkt_file, json_file)
+            report_expansion("Expanding %s to %s" % (rkt_file, json_file))
             
         cmd = "racket %s --output \"%s\" \"%s\" 2>&1" % (lib, json_file, rkt_file)
-        
+
+        if not byte_flag:
+            out = _expand_with_server("expand-to", rkt_file + "\n" + json_file)
+            if out is not None:
+                return json_file
 
     # print cmd
     pipe = create_popen_file(cmd, "r")
@@ -223,10 +256,79 @@ def ensure_json_ast_run(file_name, byte_flag=False):
     json = _json_name(file_name)
     dbgprint("ensure_json_ast_run", json, filename=file_name)
     if needs_update(file_name, json):
+        if not byte_flag:
+            expand_module_graph(file_name)
+            if not needs_update(file_name, json):
+                return json
         return expand_file_to_json(file_name, json, byte_flag)
     else:
         return json
 
+# Files whose expansion failed in expand_module_graph. They are left to
+# expand_file_to_json, which reports the error.
+graph_failures = {}
+
+def _graph_needs_expansion(file_name):
+    if file_name in graph_failures:
+        return False
+    if not os.access(file_name, os.R_OK) or not os.access(file_name, os.W_OK):
+        return False
+    return needs_update(file_name, _json_name(file_name))
+
+def expand_module_graph(rkt_file):
+    """ Expand `rkt_file` and the modules it transitively requires whose
+    JSON is out of date, spreading the work over a pool of expander servers.
+    The servers report the requires of every module they expand, so
+    independent modules are expanded concurrently rather than one at a time
+    when the loader reaches them.
+
+    Requires of modules whose JSON is already up to date are not followed;
+    the loader expands those as before when it gets to them. Modules that
+    fail to expand are also left to the loader, which reports the error.
+
+    Every server is a racket process of its own, so the pool starts with the
+    shared server and only grows, up to the number of jobs, while there are
+    more modules waiting than servers to expand them. """
+    rkt_file = rpath.realpath(rkt_file)
+    if not _graph_needs_expansion(rkt_file):
+        return
+    servers = expander.get_expanders(1)
+    if not servers:
+        return
+    jobs = expander.default_jobs()
+    pool = expander.ExpanderPool(servers)
+    # the largest pool asked for, a failed attempt is not repeated
+    wanted = 1
+    seen = {rkt_file: None}
+    queue = [rkt_file]
+    while queue or pool.has_busy():
+        needed = min(jobs, len(pool.busy) + len(queue))
+        if needed > wanted:
+            wanted = needed
+            pool.add(expander.get_expanders(wanted))
+        while queue and pool.has_idle():
+            file_name = queue.pop()
+            json_file = _json_name(file_name)
+            report_expansion("Expanding %s to %s" % (file_name, json_file))
+            if not pool.submit("expand-to", file_name + "\n" + json_file, file_name):
+                graph_failures[file_name] = None
+        if not pool.has_busy():
+            # every server is gone
+            break
+        file_name, status, deps = pool.next_result()
+        if status != expander.RESULT_OK:
+            graph_failures[file_name] = None
+            continue
+        for dep in deps.split("\n"):
+            if not dep:
+                continue
+            dep = rpath.realpath(dep)
+            if dep in seen:
+                continue
+            seen[dep] = None
+            if _graph_needs_expansion(dep):
+                queue.append(dep)
+
 def ensure_json_ast_eval(code, file_name, stdlib=True, mcons=False, wrap=True):
     json = _json_name(file_name)
     if needs_update(file_name, json):
@@ -242,21 +344,43 @@ def parse_ast(json_string):
     modtable = ModTable()
     return to_ast(json, modtable)
 
-def finalize_module(mod):
-    from pycket.interpreter    import Context
+def normalize_module(mod):
+    from pycket.interpreter import Context
+    return Context.normalize_term(mod)
+
+def convert_module(mod):
     from pycket.assign_convert import assign_convert
-    mod = Context.normalize_term(mod)
+    from pycket.optimizer import optimize_module
+    if config.ast_optimizer:
+        mod = optimize_module(mod)
     mod = assign_convert(mod)
     mod.clean_caches()
     return mod
 
+def finalize_module(mod):
+    return convert_module(normalize_module(mod))
+
 def parse_module(json_string, bytecode_expand=False):
-    json = pycket_json.loads(json_string)
-    modtable = ModTable()
     reader = JsonLoader(bytecode_expand)
-    module = reader.to_module(json)
+    module = reader.read_module(pycket_json.JsonReader(json_string))
     return finalize_module(module)
 
+class ExpansionMessages(object):
+    """ Where the messages about expanding files go. The server sends them
+    to stderr, since its responses are written to stdout. """
+    _attrs_ = ["to_stderr"]
+
+    def __init__(self):
+        self.to_stderr = False
+
+expansion_messages = ExpansionMessages()
+
+def report_expansion(msg):
+    if expansion_messages.to_stderr:
+        os.write(2, msg + "\n")
+    else:
+        print msg
+
 #### ========================== Implementation functions
 
 DO_DEBUG_PRINTS = False
@@ -426,30 +550,94 @@ def parse_path(p):
     return srcmod, path
 
 class ModuleMap(object):
+    """ The modules of a complete expansion (`-c`), parsed on demand.
+
+    expand.rkt writes them as an indexed bundle, a header line
+    `pycket-bundle 1 <count>` followed by one `<offset> <length> <path>` line
+    per module and then the JSON of each module. The file is memory-mapped and
+    only the modules that are actually required get parsed. Older bundles
+    that are a single JSON object from paths to modules are indexed by
+    skipping over each module once. """
 
     def __init__(self, json_file_name):
         assert json_file_name is not None and json_file_name != ""
-        data = readfile_rpython(rpath.realpath(os.path.abspath(json_file_name)))
+        fname = rpath.realpath(os.path.abspath(json_file_name))
         self.source_json = json_file_name
-        self.mod_map = pycket_json.loads(data)
-        ## TODO: validate the json
+        self.source = open_mmap(fname)
+        if self.source is None:
+            self.source = StringSource(readfile_rpython(fname))
+        self.offsets = {}
+        self.lengths = {}
+        magic_len = min(len(BUNDLE_MAGIC), self.source.getlength())
+        if self.source.getslice(0, magic_len) == BUNDLE_MAGIC:
+            self._read_index()
+        else:
+            self._index_json()
+
+    def _read_line(self, pos):
+        end = pos
+        length = self.source.getlength()
+        while end < length and self.source.getitem(end) != "\n":
+            end += 1
+        return self.source.getslice(pos, end - pos), end + 1
+
+    def _read_index(self):
+        header, pos = self._read_line(0)
+        try:
+            count = int(header[len(BUNDLE_MAGIC):])
+        except ValueError:
+            raise ValueError("Malformed bundle header in %s" % self.source_json)
+        entries = []
+        for i in range(count):
+            line, pos = self._read_line(pos)
+            first = line.find(" ")
+            second = line.find(" ", first + 1)
+            if first < 0 or second < 0:
+                raise ValueError("Malformed bundle index in %s" % self.source_json)
+            try:
+                offset = int(line[:first])
+                length = int(line[first + 1:second])
+            except ValueError:
+                raise ValueError("Malformed bundle index in %s" % self.source_json)
+            entries.append((line[second + 1:], offset, length))
+        for path, offset, length in entries:
+            self.offsets[path] = pos + offset
+            self.lengths[path] = length
+
+    def _index_json(self):
+        reader = pycket_json.JsonReader(self.source.getslice(0, self.source.getlength()))
+        reader.start_object()
+        while True:
+            path = reader.next_key()
+            if path is None:
+                break
+            start = reader.skip_whitespace()
+            reader.skip_value()
+            self.offsets[path] = start
+            self.lengths[path] = reader.pos - start
 
     def get_mod(self, mod_path):
-        if not mod_path in self.mod_map.value_object():
+        """ Returns a JsonReader for the given module """
+        if not mod_path in self.offsets:
             raise ValueError('Requested module - %s - is not in - %s.' %
                              (mod_path, self.source_json))
+        data = self.source.getslice(self.offsets[mod_path], self.lengths[mod_path])
+        return pycket_json.JsonReader(data)
 
-        return pycket_json.JsonObject(getkey(self.mod_map.value_object(), mod_path, type='o'))
+    def close(self):
+        self.source.close()
 
 class JsonLoader(object):
 
-    _immutable_fields_ = ["modtable", "bytecode_expand", "multiple_modules"]
+    _immutable_fields_ = ["modtable", "bytecode_expand", "multiple_modules", "use_ast_cache"]
 
-    def __init__(self, bytecode_expand=False, multiple_modules=False, module_mapper=None):
+    def __init__(self, bytecode_expand=False, multiple_modules=False, module_mapper=None,
+                 use_ast_cache=True):
         self.modtable = ModTable()
         self.bytecode_expand = bytecode_expand
         self.multi_mod_flag = multiple_modules
         self.multi_mod_mapper = module_mapper
+        self.use_ast_cache = use_ast_cache
 
     def _lib_string(self):
         return _BE if self.bytecode_expand else _FN
@@ -460,24 +648,45 @@ class JsonLoader(object):
         fname = rpath.realpath(fname)
         data = expand_file_rpython(fname, self._lib_string())
         self.modtable.enter_module(fname)
-        module = self.to_module(pycket_json.loads(data))
+        module = self.read_module(pycket_json.JsonReader(data))
         module = finalize_module(module)
         self.modtable.exit_module(fname, module)
         return module
 
-    def load_json_ast_rpython(self, modname, fname):
+    def load_json_ast_rpython(self, modname, fname, try_cache=True):
         assert modname is not None
         modname = rpath.realpath(modname)
+        if try_cache and not self.multi_mod_flag:
+            module = self.load_cached_ast(modname)
+            if module is not None:
+                return module
+
         self.modtable.enter_module(modname)
 
         if self.multi_mod_flag:
-            mod_ast = self.multi_mod_mapper.get_mod(modname)
-            module = self.to_module(mod_ast)
+            mod_reader = self.multi_mod_mapper.get_mod(modname)
+            module = finalize_module(self.read_module(mod_reader))
         else:
             data = readfile_rpython(fname)
-            module = self.to_module(pycket_json.loads(data))
+            module = normalize_module(self.read_module(pycket_json.JsonReader(data)))
+            if self.use_ast_cache:
+                ast_cache.write_cached_module(modname, module, self.bytecode_expand)
+            module = convert_module(module)
 
-        module = finalize_module(module)
+        self.modtable.exit_module(modname, module)
+        return module
+
+    def load_cached_ast(self, modname):
+        """ Load the module from the binary AST cache written by a previous
+        run, skipping JSON parsing and A-normalization. Returns None if there
+        is no up to date cache. """
+        if not self.use_ast_cache:
+            return None
+        module = ast_cache.load_cached_module(modname, self, self.bytecode_expand)
+        if module is None:
+            return None
+        self.modtable.enter_module(modname)
+        module = convert_module(module)
         self.modtable.exit_module(modname, module)
         return module
 
@@ -485,12 +694,15 @@ class JsonLoader(object):
         dbgprint("expand_file_cached", "", lib=self._lib_string(), filename=rkt_file)
         # bypass if we already have module_map from the multi-ast-json
         if not self.multi_mod_flag:
+            module = self.load_cached_ast(rpath.realpath(rkt_file))
+            if module is not None:
+                return module
             try:
                 json_file = ensure_json_ast_run(rkt_file, self.bytecode_expand)
             except PermException:
                 return self.expand_to_ast(rkt_file)
-        else:
-            json_file = _json_name(rkt_file)
+            return self.load_json_ast_rpython(rkt_file, json_file, try_cache=False)
+        json_file = _json_name(rkt_file)
         return self.load_json_ast_rpython(rkt_file, json_file)
 
     def to_bindings(self, arr):
@@ -543,29 +755,61 @@ class JsonLoader(object):
         obj = json.value_object()
         assert "body-forms" in obj, "got malformed JSON from expander"
 
+        name = getkey(obj, "module-name", type='s')
+        config = self._module_config(getkey(obj, "config", type='o'), name)
+        lang = self._module_lang(obj.get("language", None))
+        body = [self.to_ast(x) for x in getkey(obj, "body-forms", type='a')]
+        return Module(name, body, config, lang=lang)
+
+    def read_module(self, reader):
+        """ Like to_module, but reads the module from a JsonReader one body
+        form at a time, so that the JSON tree of the whole module is never
+        built. The keys of the module object come in no particular order. """
+        name = None
+        config_obj = None
+        lang_json = None
+        body = None
+        reader.start_object()
+        while True:
+            key = reader.next_key()
+            if key is None:
+                break
+            if key == "body-forms":
+                body = []
+                reader.start_array()
+                while reader.next_element():
+                    body.append(self.to_ast(reader.read_value()))
+            elif key == "module-name":
+                name = reader.read_string()
+            elif key == "config":
+                config_obj = reader.read_value().value_object()
+            elif key == "language":
+                lang_json = reader.read_value()
+            else:
+                reader.skip_value()
+        assert body is not None, "got malformed JSON from expander"
+        config = self._module_config(config_obj, name)
+        lang = self._module_lang(lang_json)
+        return Module(name, body, config, lang=lang)
+
+    def _module_config(self, config_obj, modname):
         config = {}
-        config_obj = getkey(obj, "config", type='o')
         if config_obj is not None:
             for k, v in config_obj.iteritems():
                 config[k] = v.value_string()
 
             be_json = config.get("bytecode-expand", "false") == "true"
             if self.bytecode_expand != be_json:
-                modname = getkey(obj, "module-name", type='s')
                 raise ValueError('Byte-expansion is : %s, but "bytecode-expand" '
                                  'in json is : %s, in %s' %
                                  (self.bytecode_expand, be_json, modname))
+        return config
 
-        try:
-            lang_arr = obj["language"].value_array()
-        except KeyError:
-            lang = None
-        else:
-            lang = self._parse_require([lang_arr[0].value_string()]) if lang_arr else None
-
-        body = [self.to_ast(x) for x in getkey(obj, "body-forms", type='a')]
-        name = getkey(obj, "module-name", type='s')
-        return Module(name, body, config, lang=lang)
+    def _module_lang(self, lang_json):
+        if lang_json is None:
+            return None
+        lang_arr = lang_json.value_array()
+        return self._parse_require([lang_arr[0].value_string()]) if lang_arr else None
 
     @staticmethod
     def is_builtin_operation(rator):
@@ -788,10 +1032,9 @@ def to_value(json):
         if "char" in obj:
             return values.W_Character.make(unichr(int(obj["char"].value_string())))
         if "hash-keys" in obj and "hash-vals" in obj:
-            return W_EqualHashTable(
+            return make_equal_immutable_table(
                     [to_value(i) for i in obj["hash-keys"].value_array()],
-                    [to_value(i) for i in obj["hash-vals"].value_array()],
-                    immutable=True)
+                    [to_value(i) for i in obj["hash-vals"].value_array()])
         if "regexp" in obj:
             return values_regex.W_Regexp(obj["regexp"].value_string())
         if "byte-regexp" in obj:
@@ -0,0 +1,472 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Client for the persistent Racket expander (`racket -l pycket/expand --
+# --server`). Launching racket costs several hundred milliseconds, which used
+# to be paid for every module that missed the JSON cache. Instead, a single
+# expander process is started on first use and shared by all expansions of a
+# run. If the environment variable PYCKET_EXPANDER_SOCKET names a unix socket
+# served by `racket -l pycket/expand -- --server-socket <path>`, that
+# process is used instead, which shares it across runs as well.
+#
+# The protocol is described in pycket-lang/expand.rkt. A spawned server is
+# pinged right away, so that a missing racket is noticed before the first
+# request. When the server cannot be started or dies, callers fall back to
+# spawning one racket per module. SIGPIPE is ignored only while a request is
+# written, so that writing to a server that died fails with EPIPE instead of
+# killing the process. Outside of those writes, it has its default action.
+#
+# For expanding many modules at once, ExpanderPool spreads requests over
+# several servers. The number of servers defaults to the number of cores and
+# can be set with PYCKET_EXPANDER_JOBS.
+#
+import errno
+import os
+
+from rpython.rlib import rsocket, rpoll, rposix, rsignal
+from rpython.rlib.objectmodel import we_are_translated
+
+SERVER_CMD = "exec racket -l pycket/expand -- --server"
+SOCKET_VAR = "PYCKET_EXPANDER_SOCKET"
+JOBS_VAR = "PYCKET_EXPANDER_JOBS"
+
+# Outcomes of a request sent through an ExpanderPool
+RESULT_OK    = 0
+RESULT_ERROR = 1
+RESULT_LOST  = 2
+
+class ExpanderUnavailable(Exception):
+    """ The expander process could not be reached. Callers fall back to
+    starting racket directly. """
+    def __init__(self, msg):
+        self.msg = msg
+
+class ExpanderError(Exception):
+    """ The expander answered with an error, e.g. a syntax error in the
+    module being expanded. """
+    def __init__(self, msg):
+        self.msg = msg
+
+def _ignore_sigpipe():
+    # untranslated, the host python already ignores it
+    if we_are_translated():
+        rsignal.pypysig_ignore(rsignal.SIGPIPE)
+
+def _restore_sigpipe():
+    if we_are_translated():
+        rsignal.pypysig_default(rsignal.SIGPIPE)
+
+class Transport(object):
+    _attrs_ = []
+
+    def write(self, data):
+        raise NotImplementedError("abstract base class")
+
+    def read(self, size):
+        raise NotImplementedError("abstract base class")
+
+    def close(self):
+        raise NotImplementedError("abstract base class")
+
+    def fileno(self):
+        """ The descriptor to wait on for responses """
+        raise NotImplementedError("abstract base class")
+
+class PipeTransport(Transport):
+    """ Talks to a child racket process over its stdin and stdout. """
+    _attrs_ = ["pid", "to_fd", "from_fd"]
+
+    def __init__(self, pid, to_fd, from_fd):
+        self.pid = pid
+        self.to_fd = to_fd
+        self.from_fd = from_fd
+
+    @staticmethod
+    def spawn(cmd):
+        to_read, to_write = os.pipe()
+        from_read, from_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # child: becomes the expander, stdin/stdout are the pipes
+            try:
+                os.dup2(to_read, 0)
+                os.dup2(from_write, 1)
+                for fd in [to_read, to_write, from_read, from_write]:
+                    os.close(fd)
+                os.execv("/bin/sh", ["/bin/sh", "-c", cmd])
+            finally:
+                os._exit(127)
+        os.close(to_read)
+        os.close(from_write)
+        return PipeTransport(pid, to_write, from_read)
+
+    def write(self, data):
+        _ignore_sigpipe()
+        try:
+            while data:
+                written = os.write(self.to_fd, data)
+                data = data[written:]
+        finally:
+            _restore_sigpipe()
+
+    def read(self, size):
+        return os.read(self.from_fd, size)
+
+    def close(self):
+        os.close(self.to_fd)
+        os.close(self.from_fd)
+        # closing stdin makes the server exit
+        os.waitpid(self.pid, 0)
+
+    def fileno(self):
+        return self.from_fd
+
+class SocketTransport(Transport):
+    """ Talks to an already running server listening on a unix socket. """
+    _attrs_ = ["sock"]
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    @staticmethod
+    def connect(path):
+        sock = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM)
+        try:
+            sock.connect(rsocket.UNIXAddress(path))
+        except rsocket.SocketError:
+            sock.close()
+            raise
+        return SocketTransport(sock)
+
+    def write(self, data):
+        _ignore_sigpipe()
+        try:
+            self.sock.sendall(data)
+        finally:
+            _restore_sigpipe()
+
+    def read(self, size):
+        return self.sock.recv(size)
+
+    def close(self):
+        self.sock.close()
+
+    def fileno(self):
+        return self.sock.fd
+
+class ExpanderServer(object):
+    """ Sends framed requests to an expander process and matches up the
+    responses by request id. Several requests may be in flight; responses
+    for other requests are kept until they are asked for. """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.next_id = 0
+        self.responses = {}
+        # the input that was read but not consumed yet
+        self.buffer = ""
+
+    def send(self, op, payload, srcloc=True):
+        req_id = self.next_id
+        self.next_id += 1
+        options = "" if srcloc else "no-srcloc"
+        body = options + "\n" + payload
+        header = "%d %s %d\n" % (req_id, op, len(body))
+        try:
+            self.transport.write(header + body)
+        except OSError:
+            raise ExpanderUnavailable("could not send request to expander")
+        except rsocket.SocketError:
+            raise ExpanderUnavailable("could not send request to expander")
+        return req_id
+
+    def wait(self, req_id):
+        while req_id not in self.responses:
+            resp_id, ok, payload = self._read_response()
+            self.responses[resp_id] = (ok, payload)
+        ok, payload = self.responses[req_id]
+        del self.responses[req_id]
+        if not ok:
+            raise ExpanderError(payload)
+        return payload
+
+    def request(self, op, payload, srcloc=True):
+        return self.wait(self.send(op, payload, srcloc))
+
+    def has_buffered_response(self):
+        return self.buffer.find("\n") >= 0
+
+    def _read_chunk(self):
+        try:
+            data = self.transport.read(65536)
+        except OSError:
+            data = ""
+        except rsocket.SocketError:
+            data = ""
+        if not data:
+            raise ExpanderUnavailable("expander closed the connection")
+        return data
+
+    def _read_line(self):
+        while True:
+            pos = self.buffer.find("\n")
+            if pos >= 0:
+                line = self.buffer[:pos]
+                self.buffer = self.buffer[pos + 1:]
+                return line
+            # header lines are short, appending does not copy much
+            self.buffer += self._read_chunk()
+
+    def _read_exactly(self, size):
+        assert size >= 0
+        available = len(self.buffer)
+        if available < size:
+            # responses can be megabytes long, join the chunks only once
+            chunks = [self.buffer]
+            while available < size:
+                chunk = self._read_chunk()
+                chunks.append(chunk)
+                available += len(chunk)
+            self.buffer = "".join(chunks)
+        result = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return result
+
+    def _read_response(self):
+        parts = self._read_line().split(" ")
+        if len(parts) != 3:
+            raise ExpanderUnavailable("malformed response from expander")
+        try:
+            resp_id = int(parts[0])
+            size = int(parts[2])
+        except ValueError:
+            raise ExpanderUnavailable("malformed response from expander")
+        if size < 0:
+            raise ExpanderUnavailable("malformed response from expander")
+        payload = self._read_exactly(size)
+        return resp_id, parts[1] == "ok", payload
+
+    def is_alive(self):
+        """ Whether the server answers a ping """
+        try:
+            self.request("ping", "")
+        except ExpanderUnavailable:
+            return False
+        except ExpanderError:
+            # it answered after all
+            pass
+        return True
+
+    def expand(self, rkt_file, srcloc=True):
+        """ Returns the JSON for the given module """
+        return self.request("expand", rkt_file, srcloc)
+
+    def expand_to(self, rkt_file, json_file, srcloc=True):
+        """ Writes the JSON for the given module to `json_file` and returns
+        the files the module requires """
+        deps = self.request("expand-to", rkt_file + "\n" + json_file, srcloc)
+        return [dep for dep in deps.split("\n") if dep]
+
+    def expand_string(self, code, srcloc=True):
+        """ Returns the JSON for the module given as source code """
+        return self.request("expand-string", code, srcloc)
+
+    def close(self):
+        try:
+            self.transport.close()
+        except OSError:
+            pass
+        except rsocket.SocketError:
+            pass
+
+class ExpanderPool(object):
+    """ Runs requests on several servers, one request per server at a time,
+    and hands back whichever response arrives first. Each request carries a
+    tag, usually the file being expanded, which is returned with its
+    response. Servers that stop responding are dropped from the pool. """
+
+    def __init__(self, servers):
+        self.idle = servers[:]
+        self.busy = []
+        self.busy_reqs = []
+        self.busy_tags = []
+
+    def size(self):
+        return len(self.idle) + len(self.busy)
+
+    def add(self, servers):
+        """ Adds the servers that are not in the pool yet """
+        for server in servers:
+            if server not in self.idle and server not in self.busy:
+                self.idle.append(server)
+
+    def has_idle(self):
+        return len(self.idle) > 0
+
+    def has_busy(self):
+        return len(self.busy) > 0
+
+    def submit(self, op, payload, tag, srcloc=True):
+        assert self.idle
+        server = self.idle.pop()
+        try:
+            req_id = server.send(op, payload, srcloc)
+        except ExpanderUnavailable:
+            drop_expander(server)
+            return False
+        self.busy.append(server)
+        self.busy_reqs.append(req_id)
+        self.busy_tags.append(tag)
+        return True
+
+    def _ready(self):
+        """ Returns the index of a busy server that has a response, and
+        whether that server is lost instead """
+        for i in range(len(self.busy)):
+            if self.busy[i].has_buffered_response():
+                return i, False
+        fds = [server.transport.fileno() for server in self.busy]
+        while True:
+            try:
+                ready, _, _ = rpoll.select(fds, [], [])
+            except rpoll.SelectError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                return self._broken(fds), True
+            if ready:
+                return fds.index(ready[0]), False
+
+    def _broken(self, fds):
+        """ The index of a server whose descriptor cannot be waited on. If no
+        single one fails, the first one is given up so that the pool makes
+        progress. """
+        for i in range(len(fds)):
+            try:
+                rpoll.select([fds[i]], [], [], 0.0)
+            except rpoll.SelectError:
+                return i
+        return 0
+
+    def next_result(self):
+        """ Waits for a response and returns (tag, status, payload), where
+        status is one of RESULT_OK, RESULT_ERROR or RESULT_LOST. """
+        assert self.busy
+        i, lost = self._ready()
+        server = self.busy.pop(i)
+        req_id = self.busy_reqs.pop(i)
+        tag = self.busy_tags.pop(i)
+        if lost:
+            drop_expander(server)
+            return tag, RESULT_LOST, ""
+        try:
+            payload = server.wait(req_id)
+        except ExpanderError as e:
+            self.idle.append(server)
+            return tag, RESULT_ERROR, e.msg
+        except ExpanderUnavailable:
+            drop_expander(server)
+            return tag, RESULT_LOST, ""
+        self.idle.append(server)
+        return tag, RESULT_OK, payload
+
+class ExpanderHolder(object):
+    def __init__(self):
+        self.server = None
+        self.extra = []
+        self.disabled = False
+
+_holder = ExpanderHolder()
+
+def _connect():
+    path = os.environ.get(SOCKET_VAR, "")
+    if path:
+        try:
+            return ExpanderServer(SocketTransport.connect(path))
+        except rsocket.SocketError:
+            pass
+    return spawn_server()
+
+def spawn_server(cmd=SERVER_CMD):
+    """ Starts an expander process and waits until it is up. Returns None if
+    it cannot be started. """
+    try:
+        server = ExpanderServer(PipeTransport.spawn(cmd))
+    except OSError:
+        return None
+    if not server.is_alive():
+        server.close()
+        return None
+    return server
+
+def get_expander():
+    """ Returns the shared expander server, starting it if necessary, or None
+    if it is not available. """
+    if _holder.disabled:
+        return None
+    if _holder.server is None:
+        _holder.server = _connect()
+        if _holder.server is None:
+            _holder.disabled = True
+    return _holder.server
+
+def default_jobs():
+    jobs = os.environ.get(JOBS_VAR, "")
+    if jobs:
+        try:
+            return max(1, int(jobs))
+        except ValueError:
+            pass
+    return max(1, rposix.cpu_count())
+
+def get_expanders(count):
+    """ Returns up to `count` servers for expanding modules in parallel. The
+    first one is the shared server returned by `get_expander`, the others are
+    kept for the rest of the run. """
+    assert count >= 1
+    first = get_expander()
+    if first is None:
+        return []
+    # the new servers start up in parallel, and are pinged afterwards
+    started = []
+    while len(_holder.extra) + len(started) < count - 1:
+        try:
+            started.append(ExpanderServer(PipeTransport.spawn(SERVER_CMD)))
+        except OSError:
+            break
+    for server in started:
+        if server.is_alive():
+            _holder.extra.append(server)
+        else:
+            server.close()
+    return [first] + _holder.extra[:count - 1]
+
+def drop_expander(server):
+    """ Forget a server that stopped responding """
+    if server is _holder.server:
+        expander_failed()
+        return
+    if server in _holder.extra:
+        _holder.extra.remove(server)
+    server.close()
+
+def expander_failed():
+    """ Called when the server stopped responding. Later expansions spawn
+    racket directly. """
+    server = _holder.server
+    _holder.server = None
+    _holder.disabled = True
+    if server is not None:
+        server.close()
+
+def set_expander_enabled(enabled):
+    _holder.disabled = not enabled
+
+def shutdown_expander():
+    server = _holder.server
+    extra = _holder.extra
+    _holder.server = None
+    _holder.extra = []
+    if server is not None:
+        server.close()
+    for server in extra:
+        server.close()
@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Format strings of format, printf, eprintf and fprintf are compiled into
+# templates, lists of directives that are kept in a bounded cache keyed on the
+# format string, so that a format string used over and over again is only
+# parsed once.
+#
+from pycket                   import values
+from pycket.error             import SchemeException
+from pycket.printer           import print_to_port
+from rpython.rlib             import jit
+from rpython.rlib.runicode    import unicode_encode_utf_8
+
+# directive kinds
+LITERAL   = 0 # text
+VALUE     = 1 # ~a ~s ~v: the next value
+TRUNCATED = 2 # ~e ~.a ~.s ~.v: the next value, cut to error-print-width
+CHAR      = 3 # ~c: the next value, a character
+
+class Directive(object):
+    _attrs_ = _immutable_fields_ = ["kind", "text"]
+
+    def __init__(self, kind, text=""):
+        self.kind = kind
+        self.text = text
+
+class Template(object):
+    _attrs_ = _immutable_fields_ = ["directives[*]", "argcount", "truncates"]
+
+    def __init__(self, directives):
+        self.directives = directives
+        argcount = 0
+        truncates = False
+        for directive in directives:
+            if directive.kind != LITERAL:
+                argcount += 1
+            if directive.kind == TRUNCATED:
+                truncates = True
+        self.argcount = argcount
+        self.truncates = truncates
+
+    @jit.unroll_safe
+    def check_args(self, vals, name):
+        if len(vals) < self.argcount:
+            raise SchemeException(name + ": not enough arguments for format string")
+        if len(vals) > self.argcount:
+            raise SchemeException(name + ": not all values used")
+        j = 0
+        for directive in self.directives:
+            if directive.kind == LITERAL:
+                continue
+            w_val = vals[j]
+            j += 1
+            if directive.kind == CHAR and not isinstance(w_val, values.W_Character):
+                raise SchemeException("%s: ~c expects a character, given %s" %
+                                      (name, w_val.tostring()))
+
+def is_value_directive(c):
+    return c == 'a' or c == 'A' or c == 's' or c == 'S' or c == 'v' or c == 'V'
+
+def is_whitespace(c):
+    return c == ' ' or c == '\t' or c == '\n' or c == '\r' or c == '\f' or c == '\v'
+
+def parse(fmt, name):
+    directives = []
+    text = []
+    i = 0
+    len_fmt = len(fmt)
+    while i < len_fmt:
+        start = i
+        while i < len_fmt and fmt[i] != '~':
+            i += 1
+        text.append(fmt[start:i])
+        if i == len_fmt:
+            break
+        if i + 1 == len_fmt:
+            raise SchemeException(name + ": bad format string")
+        s = fmt[i+1]
+        i += 2
+        kind = LITERAL
+        if is_value_directive(s):
+            kind = VALUE
+        elif s == 'e' or s == 'E':
+            kind = TRUNCATED
+        elif s == '.':
+            if i == len_fmt or not is_value_directive(fmt[i]):
+                raise SchemeException("%s: ill-formed pattern string after ~." % name)
+            i += 1
+            kind = TRUNCATED
+        elif s == 'c' or s == 'C':
+            kind = CHAR
+        elif s == 'n' or s == '%':
+            text.append("\n")
+        elif s == '~':
+            text.append("~")
+        elif is_whitespace(s):
+            # skip the whitespace, up to a second end of line
+            newlines = 1 if s == '\n' else 0
+            while i < len_fmt and is_whitespace(fmt[i]):
+                if fmt[i] == '\n':
+                    if newlines == 1:
+                        break
+                    newlines += 1
+                i += 1
+        else:
+            raise SchemeException("%s: undexpected format character '%s'" % (name, s))
+        if kind != LITERAL:
+            literal = "".join(text)
+            if literal:
+                directives.append(Directive(LITERAL, literal))
+            text = []
+            directives.append(Directive(kind))
+    literal = "".join(text)
+    if literal:
+        directives.append(Directive(LITERAL, literal))
+    return Template(directives[:])
+
+class TemplateCacheEntry(object):
+    def __init__(self, key, template):
+        self.key = key
+        self.template = template
+        self.prev = None
+        self.next = None
+
+class TemplateCache(object):
+    """ Templates keyed on their format string. The cache holds at most
+    `max_size` entries and evicts the least recently used one when full. """
+
+    DEFAULT_SIZE = 256
+
+    def __init__(self, max_size=DEFAULT_SIZE):
+        assert max_size > 0
+        self.max_size = max_size
+        self._contents = {}
+        # most recently used entry first
+        self.head = None
+        self.tail = None
+
+    def size(self):
+        return len(self._contents)
+
+    def _unlink(self, entry):
+        if entry.prev is None:
+            self.head = entry.next
+        else:
+            entry.prev.next = entry.next
+        if entry.next is None:
+            self.tail = entry.prev
+        else:
+            entry.next.prev = entry.prev
+        entry.prev = entry.next = None
+
+    def _push_front(self, entry):
+        entry.next = self.head
+        if self.head is not None:
+            self.head.prev = entry
+        self.head = entry
+        if self.tail is None:
+            self.tail = entry
+
+    def get(self, fmt):
+        entry = self._contents.get(fmt, None)
+        if entry is None:
+            return None
+        if entry is not self.head:
+            self._unlink(entry)
+            self._push_front(entry)
+        return entry.template
+
+    def set(self, fmt, template):
+        if fmt in self._contents:
+            return
+        while len(self._contents) >= self.max_size:
+            entry = self.tail
+            assert entry is not None
+            self._unlink(entry)
+            del self._contents[entry.key]
+        entry = TemplateCacheEntry(fmt, template)
+        self._contents[fmt] = entry
+        self._push_front(entry)
+
+CACHE = TemplateCache()
+
+@jit.elidable
+def compile_template(fmt, name):
+    """ The template for the format string fmt, from the cache if possible.
+    Elidable, since the template for a format string is always the same. """
+    template = CACHE.get(fmt)
+    if template is None:
+        template = parse(fmt, name)
+        CACHE.set(fmt, template)
+    return template
+
+def truncate(s, width):
+    if len(s) <= width:
+        return s
+    if width <= 3:
+        return "..."[:max(width, 0)]
+    end = width - 3
+    assert end >= 0
+    return s[:end] + "..."
+
+@jit.unroll_safe
+def format_to(port, template, vals, name, graph=False, width=0):
+    """ Writes the values formatted by the template into the port. The values
+    are checked before anything is written. """
+    template.check_args(vals, name)
+    j = 0
+    for directive in template.directives:
+        kind = directive.kind
+        if kind == LITERAL:
+            port.write(directive.text)
+            continue
+        w_val = vals[j]
+        j += 1
+        if kind == VALUE:
+            print_to_port(w_val, port, graph)
+        elif kind == TRUNCATED:
+            buffer = values.W_StringOutputPort()
+            print_to_port(w_val, buffer, graph)
+            port.write(truncate(buffer.contents(), width))
+        else:
+            assert isinstance(w_val, values.W_Character)
+            c = w_val.value
+            port.write(unicode_encode_utf_8(c, len(c), "strict"))
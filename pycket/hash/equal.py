@@ -2,7 +2,9 @@
 from pycket                   import config
 from pycket                   import values, values_string
 from pycket.base              import SingletonMeta, UnhashableType
-from pycket.hash.base         import W_HashTable, get_dict_item, next_valid_index, w_missing
+from pycket.hash.base         import (W_HashTable, W_ImmutableHashTable, get_dict_item,
+                                     next_valid_index, w_missing)
+from pycket.hash.persistent_hash_map import make_persistent_hash_type
 from pycket.error             import SchemeException
 from pycket.cont              import continuation, loop_label
 from rpython.rlib             import rerased, jit
@@ -506,3 +508,219 @@ class W_EqualHashTable(W_HashTable):
         lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
         return "#hash(%s)" % " ".join(lst)
 
+
+# Immutable equal?-based tables are persistent hash maps from the equal? hash
+# code of the keys to buckets, which are association lists of the entries with
+# that hash code. Comparing keys with equal? may call back into Racket, so it
+# cannot happen inside the persistent map; it happens on the (usually single
+# element) bucket instead, in continuation passing style.
+
+def hash_code_value(w_hash):
+    assert isinstance(w_hash, values.W_Fixnum)
+    return r_uint(w_hash.value)
+
+def hash_code_equal(w_a, w_b):
+    assert isinstance(w_a, values.W_Fixnum)
+    assert isinstance(w_b, values.W_Fixnum)
+    return w_a.value == w_b.value
+
+def bucket_hash(w_key):
+    return values.W_Fixnum(intmask(tagged_hash(w_key)))
+
+EqualBuckets = make_persistent_hash_type(
+        super=values.W_ProtoObject,
+        keytype=values.W_Fixnum,
+        valtype=values.W_Object,
+        name="EqualBuckets",
+        hashfun=hash_code_value,
+        equal=hash_code_equal)
+
+def bucket_length(bucket):
+    size = 0
+    while isinstance(bucket, values.W_Cons):
+        size += 1
+        bucket = bucket.cdr()
+    return size
+
+def bucket_entry(bucket, index):
+    while isinstance(bucket, values.W_Cons):
+        if index == 0:
+            entry = bucket.car()
+            assert isinstance(entry, values.W_Cons)
+            return entry
+        index -= 1
+        bucket = bucket.cdr()
+    raise IndexError
+
+def bucket_replace(bucket, index, w_entry):
+    """ A copy of the bucket with the entry at `index` replaced by `w_entry`,
+    or removed if `w_entry` is None. The entries after it are shared. """
+    if index == 0:
+        assert isinstance(bucket, values.W_Cons)
+        rest = bucket.cdr()
+        if w_entry is None:
+            return rest
+        return values.W_Cons.make(w_entry, rest)
+    assert isinstance(bucket, values.W_Cons)
+    return values.W_Cons.make(bucket.car(),
+                              bucket_replace(bucket.cdr(), index - 1, w_entry))
+
+@loop_label
+def equal_bucket_index_loop(bucket, idx, key, env, cont):
+    """ Returns the index of the entry of `key` in the bucket, or #f """
+    from pycket.interpreter import return_value
+    from pycket.prims.equal import equal_func_unroll_n, EqualInfo
+    if not isinstance(bucket, values.W_Cons):
+        return return_value(values.w_false, env, cont)
+    entry = bucket.car()
+    assert isinstance(entry, values.W_Cons)
+    info = EqualInfo.BASIC_SINGLETON
+    cont = catch_bucket_is_equal_cont(bucket, idx, key, env, cont)
+    return equal_func_unroll_n(entry.car(), key, info, env, cont, 5)
+
+@continuation
+def catch_bucket_is_equal_cont(bucket, idx, key, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    val = check_one_val(_vals)
+    if val is not values.w_false:
+        return return_value(values.W_Fixnum(idx), env, cont)
+    assert isinstance(bucket, values.W_Cons)
+    return equal_bucket_index_loop(bucket.cdr(), idx + 1, key, env, cont)
+
+@continuation
+def equal_immutable_ref_cont(bucket, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_index = check_one_val(_vals)
+    if w_index is values.w_false:
+        return return_value(w_missing, env, cont)
+    assert isinstance(w_index, values.W_Fixnum)
+    return return_value(bucket_entry(bucket, w_index.value).cdr(), env, cont)
+
+@continuation
+def equal_immutable_assoc_cont(table, w_hash, bucket, key, val, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_index = check_one_val(_vals)
+    w_entry = values.W_Cons.make(key, val)
+    if w_index is values.w_false:
+        bucket = values.W_Cons.make(w_entry, bucket)
+        size = table.size + 1
+    else:
+        assert isinstance(w_index, values.W_Fixnum)
+        bucket = bucket_replace(bucket, w_index.value, w_entry)
+        size = table.size
+    buckets = table.buckets.assoc(w_hash, bucket)
+    return return_value(W_EqualImmutableHashTable(buckets, size), env, cont)
+
+@continuation
+def equal_immutable_remove_cont(table, w_hash, bucket, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_index = check_one_val(_vals)
+    if w_index is values.w_false:
+        return return_value(table, env, cont)
+    assert isinstance(w_index, values.W_Fixnum)
+    bucket = bucket_replace(bucket, w_index.value, None)
+    if bucket is values.w_null:
+        buckets = table.buckets.without(w_hash)
+    else:
+        buckets = table.buckets.assoc(w_hash, bucket)
+    return return_value(W_EqualImmutableHashTable(buckets, table.size - 1), env, cont)
+
+class W_EqualImmutableHashTable(W_ImmutableHashTable):
+    """ Immutable equal?-based hash table. Adding and removing entries takes
+    O(log n) and shares structure with the original table. """
+    _attrs_ = ['buckets', 'size', 'items']
+    _immutable_fields_ = ['buckets', 'size', 'items?']
+
+    def __init__(self, buckets, size):
+        self.buckets = buckets
+        self.size = size
+        self.items = None
+
+    def _bucket(self, w_hash):
+        return self.buckets.val_at(w_hash, values.w_null)
+
+    def hash_ref(self, key, env, cont):
+        w_hash = bucket_hash(key)
+        bucket = self._bucket(w_hash)
+        if bucket is values.w_null:
+            from pycket.interpreter import return_value
+            return return_value(w_missing, env, cont)
+        return equal_bucket_index_loop(bucket, 0, key, env,
+                equal_immutable_ref_cont(bucket, env, cont))
+
+    def hash_assoc(self, key, val, env, cont):
+        """ Returns a table with `key` mapped to `val` to `cont` """
+        w_hash = bucket_hash(key)
+        bucket = self._bucket(w_hash)
+        return equal_bucket_index_loop(bucket, 0, key, env,
+                equal_immutable_assoc_cont(self, w_hash, bucket, key, val, env, cont))
+
+    def hash_remove(self, key, env, cont):
+        w_hash = bucket_hash(key)
+        bucket = self._bucket(w_hash)
+        return equal_bucket_index_loop(bucket, 0, key, env,
+                equal_immutable_remove_cont(self, w_hash, bucket, env, cont))
+
+    def _assoc(self, key, val):
+        """ Adds an entry without calling equal? on the keys. Only for
+        building tables from keys that are compared by their `equal` method,
+        such as literals. """
+        w_hash = bucket_hash(key)
+        bucket = self._bucket(w_hash)
+        index = 0
+        curr = bucket
+        while isinstance(curr, values.W_Cons):
+            entry = curr.car()
+            assert isinstance(entry, values.W_Cons)
+            k = entry.car()
+            if k.eqv(key) or k.equal(key):
+                bucket = bucket_replace(bucket, index, values.W_Cons.make(key, val))
+                return W_EqualImmutableHashTable(self.buckets.assoc(w_hash, bucket), self.size)
+            index += 1
+            curr = curr.cdr()
+        bucket = values.W_Cons.make(values.W_Cons.make(key, val), bucket)
+        return W_EqualImmutableHashTable(self.buckets.assoc(w_hash, bucket), self.size + 1)
+
+    def hash_items(self):
+        items = []
+        for _, bucket in self.buckets.iteritems():
+            while isinstance(bucket, values.W_Cons):
+                entry = bucket.car()
+                assert isinstance(entry, values.W_Cons)
+                items.append((entry.car(), entry.cdr()))
+                bucket = bucket.cdr()
+        return items
+
+    def get_item(self, i):
+        if not (0 <= i < self.size):
+            raise IndexError
+        if len(self.buckets) == self.size:
+            # no collisions, every bucket holds a single entry
+            entry = bucket_entry(self.buckets.get_item(i)[1], 0)
+            return entry.car(), entry.cdr()
+        items = self.items
+        if items is None:
+            self.items = items = self.hash_items()
+        return items[i]
+
+    def length(self):
+        return self.size
+
+    def make_copy(self):
+        return self
+
+    def make_empty(self):
+        return W_EqualImmutableHashTable.EMPTY
+
+    def tostring(self):
+        lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
+        return "#hash(%s)" % " ".join(lst)
+
+W_EqualImmutableHashTable.EMPTY = W_EqualImmutableHashTable(EqualBuckets.EMPTY, 0)
+
+def make_equal_immutable_table(keys, vals):
+    assert len(keys) == len(vals)
+    table = W_EqualImmutableHashTable.EMPTY
+    for i, key in enumerate(keys):
+        table = table._assoc(key, vals[i])
+    return table
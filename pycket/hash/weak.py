@@ -0,0 +1,337 @@
+from pycket                   import values
+from pycket.cont              import continuation, loop_label
+from pycket.hash.base         import W_MutableHashTable, w_missing
+from pycket.hash.equal        import tagged_hash
+from pycket.hash.simple       import W_EqMutableHashTable, W_EqvMutableHashTable
+from rpython.rlib             import jit
+from rpython.rlib.objectmodel import specialize
+
+import rpython.rlib.rweakref as weakref
+
+# Weak hash tables hold their keys weakly and their values strongly. The
+# entries are kept in a list, in insertion order, with an index from hash codes
+# to positions in that list. Removed entries leave a None behind, which keeps
+# positions stable for the hash-iterate-* primitives until the list is
+# compacted.
+#
+# Entries whose key was collected are dropped when they are met during lookups,
+# and by a sweep over all entries whenever the entry list has doubled in size
+# since the last sweep, so that a table that keeps receiving new keys stays
+# proportional to the number of live keys. Only adding an entry sweeps, so
+# counting or looking up entries never moves the positions of an iteration.
+# The count of entries is kept up to date by adding, removing and sweeping.
+
+MIN_SWEEP = 8
+
+def is_immediate(w_key):
+    """ Keys that are immediate values in Racket are never collected """
+    return isinstance(w_key, values.W_Fixnum) or isinstance(w_key, values.W_Character)
+
+class WeakEntry(object):
+    _attrs_ = ['hash', 'key', 'strong_key', 'value']
+    _immutable_fields_ = ['hash', 'key', 'strong_key']
+
+    def __init__(self, hash, w_key, w_value):
+        self.hash = hash
+        self.key = weakref.ref(w_key)
+        self.strong_key = w_key if is_immediate(w_key) else None
+        self.value = w_value
+
+    def get_key(self):
+        return self.key()
+
+class W_WeakHashTable(W_MutableHashTable):
+    _attrs_ = ['entries', 'index', 'live', 'sweep_at']
+    _immutable_fields_ = ['entries', 'index']
+
+    def __init__(self):
+        self.entries = []
+        self.index = {}
+        self.live = 0
+        self.sweep_at = MIN_SWEEP
+
+    def hash_code(self, w_key):
+        raise NotImplementedError("abstract method")
+
+    def cmp_keys(self, w_a, w_b):
+        raise NotImplementedError("abstract method")
+
+    def _remove_at(self, pos):
+        entry = self.entries[pos]
+        assert entry is not None
+        self.entries[pos] = None
+        positions = self.index[entry.hash]
+        positions.remove(pos)
+        if not positions:
+            del self.index[entry.hash]
+        self.live -= 1
+
+    def _find(self, w_key):
+        """ Position of the entry for `w_key`, or -1. Entries with dead keys
+        met on the way are removed. """
+        hash = self.hash_code(w_key)
+        positions = self.index.get(hash, None)
+        if positions is None:
+            return -1
+        for pos in positions[:]:
+            entry = self.entries[pos]
+            assert entry is not None
+            w_k = entry.get_key()
+            if w_k is None:
+                self._remove_at(pos)
+            elif self.cmp_keys(w_k, w_key):
+                return pos
+        return -1
+
+    def _position_of(self, hash, w_key):
+        """ Position of the entry whose key is `w_key` itself, or -1 """
+        positions = self.index.get(hash, None)
+        if positions is None:
+            return -1
+        for pos in positions:
+            entry = self.entries[pos]
+            assert entry is not None
+            if entry.get_key() is w_key:
+                return pos
+        return -1
+
+    def _add(self, hash, w_key, w_value):
+        if len(self.entries) >= self.sweep_at:
+            self.sweep()
+        pos = len(self.entries)
+        self.entries.append(WeakEntry(hash, w_key, w_value))
+        positions = self.index.get(hash, None)
+        if positions is None:
+            self.index[hash] = [pos]
+        else:
+            positions.append(pos)
+        self.live += 1
+
+    def _set(self, w_key, w_value):
+        pos = self._find(w_key)
+        if pos >= 0:
+            entry = self.entries[pos]
+            assert entry is not None
+            entry.value = w_value
+        else:
+            self._add(self.hash_code(w_key), w_key, w_value)
+
+    @jit.dont_look_inside
+    def sweep(self):
+        """ Drops the entries whose keys were collected and compacts the
+        entry list """
+        entries = []
+        index = {}
+        for entry in self.entries:
+            if entry is None or entry.get_key() is None:
+                continue
+            positions = index.get(entry.hash, None)
+            if positions is None:
+                index[entry.hash] = [len(entries)]
+            else:
+                positions.append(len(entries))
+            entries.append(entry)
+        # the fields are immutable, update the containers in place
+        del self.entries[:]
+        self.entries.extend(entries)
+        self.index.clear()
+        self.index.update(index)
+        self.live = len(entries)
+        self.sweep_at = max(2 * self.live, MIN_SWEEP)
+
+    def hash_ref(self, w_key, env, cont):
+        from pycket.interpreter import return_value
+        pos = self._find(w_key)
+        if pos < 0:
+            return return_value(w_missing, env, cont)
+        entry = self.entries[pos]
+        assert entry is not None
+        return return_value(entry.value, env, cont)
+
+    def hash_set(self, w_key, w_value, env, cont):
+        from pycket.interpreter import return_value
+        self._set(w_key, w_value)
+        return return_value(values.w_void, env, cont)
+
+    def hash_remove_inplace(self, w_key, env, cont):
+        from pycket.interpreter import return_value
+        pos = self._find(w_key)
+        if pos >= 0:
+            self._remove_at(pos)
+        return return_value(values.w_void, env, cont)
+
+    def get_item(self, i):
+        if not (0 <= i < len(self.entries)):
+            raise IndexError
+        entry = self.entries[i]
+        if entry is None:
+            raise KeyError
+        w_key = entry.get_key()
+        if w_key is None:
+            raise KeyError
+        return w_key, entry.value
+
+    def hash_iterate_next(self, pos):
+        i = pos.value + 1
+        while i < len(self.entries):
+            entry = self.entries[i]
+            if entry is not None and entry.get_key() is not None:
+                return values.wrap(i)
+            i += 1
+        return values.w_false
+
+    def hash_items(self):
+        items = []
+        for entry in self.entries:
+            if entry is None:
+                continue
+            w_key = entry.get_key()
+            if w_key is not None:
+                items.append((w_key, entry.value))
+        return items
+
+    def hash_iterate_first(self):
+        for i in range(len(self.entries)):
+            entry = self.entries[i]
+            if entry is not None and entry.get_key() is not None:
+                return i
+        raise IndexError
+
+    def length(self):
+        # keys collected since the last sweep are still counted
+        return self.live
+
+    def tostring(self):
+        lst = [values.W_Cons.make(k, v).tostring() for k, v in self.hash_items()]
+        return "#%s(%s)" % (self.printname, " ".join(lst))
+
+class W_WeakEqHashTable(W_WeakHashTable):
+    printname = "hasheq"
+
+    def hash_code(self, w_key):
+        return W_EqMutableHashTable.hash_value(w_key)
+
+    def cmp_keys(self, w_a, w_b):
+        return W_EqMutableHashTable.cmp_value(w_a, w_b)
+
+    def make_empty(self):
+        return W_WeakEqHashTable()
+
+class W_WeakEqvHashTable(W_WeakHashTable):
+    printname = "hasheqv"
+
+    def hash_code(self, w_key):
+        return W_EqvMutableHashTable.hash_value(w_key)
+
+    def cmp_keys(self, w_a, w_b):
+        return W_EqvMutableHashTable.cmp_value(w_a, w_b)
+
+    def make_empty(self):
+        return W_WeakEqvHashTable()
+
+@loop_label
+def weak_equal_find_loop(table, positions, idx, w_key, env, cont):
+    """ Returns the position of the entry for `w_key` among `positions`, or
+    #f, comparing keys with equal? """
+    from pycket.interpreter import return_value
+    from pycket.prims.equal import equal_func_unroll_n, EqualInfo
+    while idx < len(positions):
+        # positions may be stale when a comparison changed the table
+        pos = positions[idx]
+        entry = table.entries[pos] if pos < len(table.entries) else None
+        w_k = entry.get_key() if entry is not None else None
+        if w_k is not None:
+            info = EqualInfo.BASIC_SINGLETON
+            cont = catch_weak_is_equal_cont(table, positions, idx, entry.hash, w_k,
+                                            w_key, env, cont)
+            return equal_func_unroll_n(w_k, w_key, info, env, cont, 5)
+        idx += 1
+    return return_value(values.w_false, env, cont)
+
+@continuation
+def catch_weak_is_equal_cont(table, positions, idx, hash, w_k, w_key, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    val = check_one_val(_vals)
+    if val is not values.w_false:
+        # the comparison may have removed the entry or moved it by adding
+        # entries, look up where the compared key is now
+        pos = table._position_of(hash, w_k)
+        if pos >= 0:
+            return return_value(values.W_Fixnum(pos), env, cont)
+    return weak_equal_find_loop(table, positions, idx + 1, w_key, env, cont)
+
+def _live_entry(table, w_pos):
+    """ The entry found by weak_equal_find_loop, if any. Its position was
+    looked up after the last equal? comparison, so it is still current. """
+    if w_pos is values.w_false:
+        return None
+    assert isinstance(w_pos, values.W_Fixnum)
+    entry = table.entries[w_pos.value]
+    assert entry is not None
+    return entry
+
+@continuation
+def weak_equal_ref_cont(table, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    entry = _live_entry(table, check_one_val(_vals))
+    if entry is None:
+        return return_value(w_missing, env, cont)
+    return return_value(entry.value, env, cont)
+
+@continuation
+def weak_equal_set_cont(table, w_key, w_value, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    entry = _live_entry(table, check_one_val(_vals))
+    if entry is None:
+        table._add(table.hash_code(w_key), w_key, w_value)
+    else:
+        entry.value = w_value
+    return return_value(values.w_void, env, cont)
+
+@continuation
+def weak_equal_remove_cont(table, env, cont, _vals):
+    from pycket.interpreter import check_one_val, return_value
+    w_pos = check_one_val(_vals)
+    if _live_entry(table, w_pos) is not None:
+        assert isinstance(w_pos, values.W_Fixnum)
+        table._remove_at(w_pos.value)
+    return return_value(values.w_void, env, cont)
+
+class W_WeakEqualHashTable(W_WeakHashTable):
+    printname = "hash"
+
+    def hash_code(self, w_key):
+        return tagged_hash(w_key)
+
+    def cmp_keys(self, w_a, w_b):
+        return w_a.eqv(w_b) or w_a.equal(w_b)
+
+    def _candidates(self, w_key):
+        positions = self.index.get(self.hash_code(w_key), None)
+        if positions is None:
+            return []
+        # the comparisons may run Racket code that changes the table
+        return positions[:]
+
+    def hash_ref(self, w_key, env, cont):
+        return weak_equal_find_loop(self, self._candidates(w_key), 0, w_key, env,
+                weak_equal_ref_cont(self, env, cont))
+
+    def hash_set(self, w_key, w_value, env, cont):
+        return weak_equal_find_loop(self, self._candidates(w_key), 0, w_key, env,
+                weak_equal_set_cont(self, w_key, w_value, env, cont))
+
+    def hash_remove_inplace(self, w_key, env, cont):
+        return weak_equal_find_loop(self, self._candidates(w_key), 0, w_key, env,
+                weak_equal_remove_cont(self, env, cont))
+
+    def make_empty(self):
+        return W_WeakEqualHashTable()
+
+@specialize.arg(0)
+def make_weak_table(cls, keys, vals):
+    table = cls()
+    assert len(keys) == len(vals)
+    for i, w_key in enumerate(keys):
+        table._set(w_key, vals[i])
+    return table
@@ -3,6 +3,7 @@
 
 from pycket                   import config
 from pycket                   import values, values_string, values_parameter
+from pycket                   import safepoint, values_thread
 from pycket                   import vector
 from pycket.AST               import AST
 from pycket.arity             import Arity
@@ -988,6 +989,7 @@ class App(AST):
     # are simple.
     @jit.unroll_safe
     def interpret(self, env, cont):
+        safepoint.count()
         rator = self.rator
         if (not env.pycketconfig().callgraph and
                 isinstance(rator, ModuleVar) and
@@ -2124,6 +2126,9 @@ def inner_interpret_two_state(ast, env, cont):
         else:
             ast, env, cont = ast.interpret(env, cont)
         if ast.should_enter:
+            if safepoint.tick():
+                ast, env, cont = safepoint.run_handlers(ast, env, cont)
+                continue
             driver_two_state.can_enter_jit(ast=ast, came_from=came_from, env=env, cont=cont)
 
 def get_printable_location_one_state(green_ast ):
@@ -2142,6 +2147,9 @@ def inner_interpret_one_state(ast, env, cont):
         driver_one_state.jit_merge_point(ast=ast, env=env, cont=cont)
         ast, env, cont = ast.interpret(env, cont)
         if ast.should_enter:
+            if safepoint.tick():
+                ast, env, cont = safepoint.run_handlers(ast, env, cont)
+                continue
             driver_one_state.can_enter_jit(ast=ast, env=env, cont=cont)
 
 def interpret_one(ast, env=None):
@@ -2153,14 +2161,23 @@ def interpret_one(ast, env=None):
         inner_interpret = inner_interpret_one_state
     cont = NilCont()
     cont.update_cm(values.parameterization_key, values_parameter.top_level_config)
+    scheduler = values_thread.get_scheduler()
+    scheduler.depth += 1
     try:
-        inner_interpret(ast, env, cont)
-    except Done, e:
-        return e.values
-    except SchemeException, e:
-        if e.context_ast is None:
-            e.context_ast = ast
-        raise
+        state_ast, state_env, state_cont = ast, env, cont
+        while True:
+            try:
+                inner_interpret(state_ast, state_env, state_cont)
+            except Done, e:
+                return e.values
+            except SchemeException, e:
+                if scheduler.current is scheduler.main or not scheduler.can_switch():
+                    if e.context_ast is None:
+                        e.context_ast = ast
+                    raise
+                state_ast, state_env, state_cont = scheduler.thread_failed(e)
+    finally:
+        scheduler.depth -= 1
 
 def interpret_toplevel(a, env):
     if isinstance(a, Begin):
@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# AST optimizer, run on the A-normalized module before assignment conversion.
+#
+# It works on one module at a time and
+#   - inlines calls of small, non-recursive procedures defined in the module,
+#   - folds applications of pure primitives to constants,
+#   - propagates constants bound by `let` and drops unused pure bindings,
+#   - picks the branch of an `if` whose test is constant (`If.make` does it).
+#
+# A procedure can be inlined if it is defined by a `define-values` of a
+# lambda with a fixed number of arguments, the variable is never mutated, and
+# its body is at most `config.inline_size` nodes, contains no lambdas, no
+# assignments and no continuation marks, and refers to no procedure defined
+# in the same module, which rules out recursion. The variables bound in the
+# inlined body are renamed. Calls are only inlined after the definition, and
+# at most MODULE_BUDGET nodes are inlined into a module.
+#
+from pycket             import config
+from pycket             import values
+from pycket.ast_visitor import ASTVisitor
+from pycket.error       import SchemeException
+from pycket.interpreter import (
+    App,
+    Begin,
+    Begin0,
+    CaseLambda,
+    DefineValues,
+    Gensym,
+    If,
+    Lambda,
+    Let,
+    Letrec,
+    LexicalVar,
+    Module,
+    ModuleVar,
+    Quote,
+    QuoteSyntax,
+    SymbolSet,
+    ToplevelVar,
+    make_lambda,
+    make_let,
+    make_letrec,
+    variable_set,
+)
+
+# the number of nodes that may be inlined into one module
+MODULE_BUDGET = 2000
+
+# primitives without effects whose result does not depend on anything but
+# their arguments and is not freshly allocated
+PURE_PRIMITIVES = {}
+for _name in ["+", "-", "*", "/", "=", "<", ">", "<=", ">=",
+              "add1", "sub1", "abs", "max", "min",
+              "quotient", "remainder", "modulo",
+              "zero?", "positive?", "negative?", "even?", "odd?",
+              "exact->inexact", "inexact->exact",
+              "fx+", "fx-", "fx*", "fx=", "fx<", "fx>", "fx<=", "fx>=",
+              "fl+", "fl-", "fl*", "fl/", "fl=", "fl<", "fl>", "fl<=", "fl>=",
+              "not", "eq?", "eqv?", "null?", "pair?", "number?", "fixnum?",
+              "flonum?", "integer?", "symbol?", "string?", "char?", "boolean?",
+              "procedure?", "vector?",
+              "car", "cdr", "char->integer"]:
+    PURE_PRIMITIVES[values.W_Symbol.make(_name)] = None
+
+def fold_primitive(rator, rands):
+    """ The constant result of applying a pure primitive to constants, or
+    None if the application cannot be folded """
+    if not isinstance(rator, ModuleVar) or not rator.is_primitive():
+        return None
+    if rator.srcsym not in PURE_PRIMITIVES:
+        return None
+    args_w = [None] * len(rands)
+    for i, rand in enumerate(rands):
+        if not isinstance(rand, Quote):
+            return None
+        args_w[i] = rand.w_val
+    try:
+        w_prim = rator._lookup_primitive()
+    except SchemeException:
+        return None
+    if not isinstance(w_prim, values.W_Prim) or w_prim.simple_func is None:
+        return None
+    try:
+        w_result = w_prim.simple_func(args_w)
+    except SchemeException:
+        # the error is raised when the program runs
+        return None
+    if w_result is None or isinstance(w_result, values.Values):
+        return None
+    return Quote(w_result)
+
+def is_local_module_var(ast):
+    return isinstance(ast, ModuleVar) and ast.srcmod is None and ast.path is None
+
+def defined_lambda(define):
+    """ The lambda of a definition `(define-values (f) (lambda ...))` """
+    if not isinstance(define, DefineValues) or len(define.names) != 1:
+        return None
+    rhs = define.rhs
+    if isinstance(rhs, CaseLambda):
+        if len(rhs.lams) != 1 or rhs.recursive_sym is not None:
+            return None
+        rhs = rhs.lams[0]
+    if not isinstance(rhs, Lambda):
+        return None
+    return rhs
+
+def inline_size(lam, procedures, limit):
+    """ The number of nodes in the body of the lambda, or -1 if the lambda
+    cannot be inlined or its body has more than `limit` nodes """
+    if lam.rest is not None or lam.frees.elems:
+        return -1
+    size = 0
+    todo = lam.body[:]
+    while todo:
+        ast = todo.pop()
+        size += 1
+        if size > limit:
+            return -1
+        if not isinstance(ast, (App, Begin, Begin0, If, Let, LexicalVar,
+                                ModuleVar, Quote, QuoteSyntax, ToplevelVar)):
+            return -1
+        if is_local_module_var(ast):
+            assert isinstance(ast, ModuleVar)
+            if ast.srcsym in procedures:
+                return -1
+        todo.extend(ast.direct_children())
+    return size
+
+class Renamer(ASTVisitor):
+    """ Copies an inlined body, giving the variables it binds fresh names """
+
+    def visit_lexical_var(self, ast, names):
+        assert isinstance(ast, LexicalVar)
+        return LexicalVar(names.get(ast.sym, ast.sym))
+
+    def visit_let(self, ast, names):
+        assert isinstance(ast, Let)
+        rhss = [r.visit(self, names) for r in ast.rhss]
+        inner = names.copy()
+        varss = []
+        for vars in ast._rebuild_args():
+            fresh = [Gensym.gensym(v.variable_name()) for v in vars]
+            for i, v in enumerate(vars):
+                inner[v] = fresh[i]
+            varss.append(fresh)
+        body = [b.visit(self, inner) for b in ast.body]
+        return make_let(varss, rhss, body)
+
+def shadow(constants, syms):
+    """ The constants without the ones named by `syms` """
+    for sym in syms:
+        if sym in constants:
+            break
+    else:
+        return constants
+    result = constants.copy()
+    for sym in syms:
+        if sym in result:
+            del result[sym]
+    return result
+
+class Optimizer(ASTVisitor):
+
+    def __init__(self, procedures):
+        # the procedures of the module, and the inlinable ones defined so far
+        self.procedures = procedures
+        self.inlinable = {}
+        self.budget = MODULE_BUDGET
+
+    def define(self, form):
+        lam = defined_lambda(form)
+        if lam is None:
+            return
+        assert isinstance(form, DefineValues)
+        w_name = form.names[0]
+        if self.procedures.get(w_name, -1) >= 0:
+            self.inlinable[w_name] = lam
+
+    def inline(self, rator, rands, constants):
+        if not is_local_module_var(rator):
+            return None
+        assert isinstance(rator, ModuleVar)
+        lam = self.inlinable.get(rator.srcsym, None)
+        if lam is None or len(lam.formals) != len(rands):
+            return None
+        size = self.procedures[rator.srcsym]
+        if size > self.budget:
+            return None
+        self.budget -= size
+        names = {}
+        varss = [None] * len(rands)
+        for i, formal in enumerate(lam.formals):
+            fresh = Gensym.gensym(formal.variable_name())
+            names[formal] = fresh
+            varss[i] = [fresh]
+        renamer = Renamer()
+        body = [b.visit(renamer, names) for b in lam.body]
+        return make_let(varss, rands, body).visit(self, constants)
+
+    def visit_lexical_var(self, ast, constants):
+        assert isinstance(ast, LexicalVar)
+        w_val = constants.get(ast.sym, None)
+        if w_val is not None:
+            return Quote(w_val)
+        return ast
+
+    def visit_app(self, ast, constants):
+        assert isinstance(ast, App)
+        rator = ast.rator.visit(self, constants)
+        rands = [a.visit(self, constants) for a in ast.rands]
+        result = fold_primitive(rator, rands)
+        if result is not None:
+            return result
+        result = self.inline(rator, rands, constants)
+        if result is not None:
+            return result
+        return App.make(rator, rands, ast.env_structure)
+
+    def visit_lambda(self, ast, constants):
+        assert isinstance(ast, Lambda)
+        constants = shadow(constants, ast.args.elems)
+        body = [b.visit(self, constants) for b in ast.body]
+        return make_lambda(ast.formals, ast.rest, body, sourceinfo=ast.sourceinfo)
+
+    def visit_letrec(self, ast, constants):
+        assert isinstance(ast, Letrec)
+        constants = shadow(constants, ast.args.elems)
+        rhss = [r.visit(self, constants) for r in ast.rhss]
+        body = [b.visit(self, constants) for b in ast.body]
+        return make_letrec(ast._rebuild_args(), rhss, body)
+
+    def visit_let(self, ast, constants):
+        assert isinstance(ast, Let)
+        varss = ast._rebuild_args()
+        rhss = [r.visit(self, constants) for r in ast.rhss]
+        inner = shadow(constants, ast.args.elems)
+        muts = variable_set()
+        for b in ast.body:
+            muts.update(b.mutated_vars())
+        for i, vars in enumerate(varss):
+            rhs = rhss[i]
+            if (len(vars) == 1 and isinstance(rhs, Quote) and
+                    LexicalVar(vars[0]) not in muts):
+                if inner is constants:
+                    inner = constants.copy()
+                inner[vars[0]] = rhs.w_val
+        body = [b.visit(self, inner) for b in ast.body]
+
+        # drop the pure bindings nobody refers to
+        frees = SymbolSet.EMPTY
+        for b in body:
+            frees = frees.union(b.free_vars())
+        live_varss = []
+        live_rhss = []
+        for i, vars in enumerate(varss):
+            rhs = rhss[i]
+            if len(vars) == 1 and rhs.ispure and not frees.haskey(vars[0]):
+                continue
+            live_varss.append(vars)
+            live_rhss.append(rhs)
+        return make_let(live_varss, live_rhss, body)
+
+    def visit_module(self, ast, constants):
+        assert isinstance(ast, Module)
+        return optimize_module(ast)
+
+def optimize_module(module):
+    """ Optimizes the body of the module in place """
+    limit = config.inline_size
+    procedures = {}
+    for form in module.body:
+        lam = defined_lambda(form)
+        if lam is not None:
+            assert isinstance(form, DefineValues)
+            procedures[form.names[0]] = -1
+    muts = module.mod_mutated_vars()
+    for form in module.body:
+        lam = defined_lambda(form)
+        if lam is not None:
+            assert isinstance(form, DefineValues)
+            w_name = form.names[0]
+            if ModuleVar(w_name, None, w_name) not in muts:
+                procedures[w_name] = inline_size(lam, procedures, limit)
+    optimizer = Optimizer(procedures)
+    for i, form in enumerate(module.body):
+        form = form.visit(optimizer, {})
+        module.body[i] = form
+        optimizer.define(form)
+    return module
@@ -42,6 +42,13 @@ def print_help(argv):
   -c <file> : run pycket with complete expansion, expanding every dependent module and put everything into one single json. <file> can also be a json pre-generated with -c option, in this case pycket doesn't need to expand anything at all.
  Configuration options:
   --stdlib: Use Pycket's version of stdlib (only applicable for -e)
+  --no-ast-cache: Don't read or write the binary AST cache (<file>.rkt.ast)
+  --no-expander-server: Start a new racket for every module to expand
+  --log-file <file> : Append the log messages to <file>
+  --log-level <levels> : The levels to log to the file, like PLTSTDERR
+                         (default: debug)
+  --server : Run the programs requested on stdin, one after the other,
+             keeping the loaded modules and compiled code between them
  Meta options:
   --jit <jitargs> : Set RPython JIT options may be 'default', 'off',
                     or 'param=value,param=value' list
@@ -58,6 +65,9 @@ def parse_args(argv):
         'stdlib': False,
 #        'mcons': False,
         'mode': _run,
+        'ast-cache': True,
+        'expander-server': True,
+        'server': False,
     }
     names = {
         # 'file': "",
@@ -149,6 +159,24 @@ def parse_args(argv):
         elif argv[i] == '--save-callgraph':
             config['save-callgraph'] = True
 
+        elif argv[i] == '--no-ast-cache':
+            config['ast-cache'] = False
+
+        elif argv[i] == '--no-expander-server':
+            config['expander-server'] = False
+
+        elif argv[i] == '--server':
+            config['server'] = True
+            retval = 0
+
+        elif argv[i] in ["--log-file", "--log-level"]:
+            if to <= i + 1:
+                print "missing argument after %s" % argv[i]
+                retval = 5
+                break
+            names[argv[i][2:]] = argv[i + 1]
+            i += 1
+
         else:
             if 'file' in names:
                 break
@@ -232,8 +232,10 @@ def make_procedure(n="<procedure>", argstypes=None, simple=True, arity=None):
             assert isinstance(_arity, Arity)
         func_result_handling = _make_result_handling_func(func_arg_unwrap, simple)
         result_arity = Arity.oneof(1) if simple else None
+        simple_func = func_arg_unwrap if simple else None
         return values.W_Prim(name, make_remove_extra_info(func_result_handling),
-                             arity=_arity, result_arity=result_arity)
+                             arity=_arity, result_arity=result_arity,
+                             simple_func=simple_func)
     return wrapper
 
 def make_remove_extra_info(func):
@@ -282,9 +284,10 @@ def expose(n, argstypes=None, simple=True, arity=None, nyi=False, extra_info=Fal
         if not extra_info:
             func_result_handling = make_remove_extra_info(func_result_handling)
         result_arity = Arity.ONE if simple else None
+        simple_func = func_arg_unwrap if simple and not nyi else None
         p = values.W_Prim(name, func_result_handling,
                           arity=_arity, result_arity=result_arity,
-                          simple1=call1, simple2=call2)
+                          simple1=call1, simple2=call2, simple_func=simple_func)
         for nam in names:
             sym = values.W_Symbol.make(nam)
             if sym in prim_env:
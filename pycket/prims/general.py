@@ -7,6 +7,7 @@ from pycket import impersonators as imp
 from pycket import values, values_string
 from pycket.cont import continuation, loop_label, call_cont
 from pycket.arity import Arity
+from pycket import values_logger
 from pycket import values_parameter
 from pycket import values_struct
 from pycket import values_regex
@@ -15,6 +16,7 @@ from pycket.error import SchemeException, UserException
 from pycket.foreign import W_CPointer, W_CType
 from pycket.hash.base import W_HashTable
 from pycket.hash.simple import (W_EqImmutableHashTable, make_simple_immutable_table)
+from pycket.hash.weak import W_WeakHashTable
 from pycket.prims.expose import (unsafe, default, expose, expose_val, prim_env,
                                  procedure, define_nyi, subclass_unsafe)
 
@@ -37,6 +39,7 @@ from pycket.prims import parameter
 from pycket.prims import random
 from pycket.prims import regexp
 from pycket.prims import string
+from pycket.prims import thread
 from pycket.prims import struct_structinfo
 from pycket.prims import undefined
 from pycket.prims import vector
@@ -84,8 +87,6 @@ for args in [
         ("syntax?", values.W_Syntax),
         ("thread-cell?", values.W_ThreadCell),
         ("thread-cell-values?", values.W_ThreadCellValues),
-        ("semaphore?", values.W_Semaphore),
-        ("semaphore-peek-evt?", values.W_SemaphorePeekEvt),
         ("path?", values.W_Path),
         ("bytes?", values.W_Bytes),
         ("pseudo-random-generator?", values.W_PseudoRandomGenerator),
@@ -112,11 +113,11 @@ for args in [
         ("hash-eq?", W_HashTable),
         ("hash-eqv?", W_HashTable),
         ("hash-equal?", W_HashTable),
-        ("hash-weak?", W_HashTable),
+        ("hash-weak?", W_WeakHashTable),
         ("cpointer?", W_CPointer),
         ("ctype?", W_CType),
         ("continuation-prompt-tag?", values.W_ContinuationPromptTag),
-        ("logger?", values.W_Logger),
+        ("logger?", values_logger.W_Logger),
         ("evt?", values.W_Evt),
         ]:
     make_pred(*args)
@@ -371,14 +372,9 @@ for args in [ ("subprocess?",),
               ("liberal-define-context?",),
               ("handle-evt?",),
               ("exn:srclocs?",),
-              ("log-receiver?",),
               # FIXME: these need to be defined with structs
               ("date-dst?",),
-              ("thread?",),
-              ("thread-running?",),
-              ("thread-dead?",),
               ("will-executor?",),
-              ("semaphore-try-wait?",),
               ("readtable?",),
               ("link-exists?",),
               ("rename-transformer?",),
@@ -428,44 +424,6 @@ def version(env, cont):
     result = values_string.W_String.fromascii("unknown version" if version is None else version)
     return return_value(result, env, cont)
 
-@continuation
-def sem_post_cont(sem, env, cont, vals):
-    sem.post()
-    from pycket.interpreter import return_multi_vals
-    return return_multi_vals(vals, env, cont)
-
-@expose("call-with-semaphore", simple=False)
-def call_with_sem(args, env, cont):
-    if len(args) < 2:
-        raise SchemeException("error call-with-semaphore")
-    sem = args[0]
-    f = args[1]
-    if len(args) == 2:
-        new_args = []
-        fail = None
-    else:
-        new_args = args[3:]
-        if args[2] is values.w_false:
-            fail = None
-        else:
-            fail = args[2]
-    assert isinstance(sem, values.W_Semaphore)
-    assert f.iscallable()
-    sem.wait()
-    return f.call(new_args, env, sem_post_cont(sem, env, cont))
-
-@expose("current-thread", [])
-def current_thread():
-    return values.W_Thread()
-
-@expose("semaphore-post", [values.W_Semaphore])
-def sem_post(s):
-    s.post()
-
-@expose("semaphore-wait", [values.W_Semaphore])
-def sem_wait(s):
-    s.wait()
-
 @expose("procedure-rename", [procedure, values.W_Object])
 def procedure_rename(p, n):
     return p
@@ -680,14 +638,6 @@ def apply(args, env, cont, extra_call_info):
     new_args = others + rest
     return fn.call_with_extra_info(new_args, env, cont, extra_call_info)
 
-@expose("make-semaphore", [default(values.W_Fixnum, values.W_Fixnum.ZERO)])
-def make_semaphore(n):
-    return values.W_Semaphore(n.value)
-
-@expose("semaphore-peek-evt", [values.W_Semaphore])
-def sem_peek_evt(s):
-    return values.W_SemaphorePeekEvt(s)
-
 @expose("not", [values.W_Object])
 def notp(a):
     return values.W_Bool.make(a is values.w_false)
@@ -963,10 +913,17 @@ def append(lists):
     return acc
 
 def append_two(l1, l2):
+    """ Copies the cells of the proper list l1 once and shares l2 """
+    # the copy of a cell claims to be proper if the cell did, which is only
+    # true if l2 is proper too
+    proper = l2.is_proper_list()
     first = None
     last  = None
     while isinstance(l1, values.W_Cons):
-        v = l1.clone()
+        if proper:
+            v = l1.clone()
+        else:
+            v = values.W_Cons.make(l1.car(), l2)
         if first is None:
             first = v
         else:
@@ -1053,18 +1010,19 @@ def list_ref_impl(lst, pos):
 def list_ref(lst, pos):
     return list_ref_impl(lst, pos.value)
 
+@jit.look_inside_iff(enter_list_ref_iff)
+def list_tail_impl(lst, pos):
+    if pos < 0:
+        raise SchemeException("list-tail: negative index")
+    for i in range(pos):
+        if not isinstance(lst, values.W_Cons):
+            raise SchemeException("list-tail: index too large for list")
+        lst = lst.cdr()
+    return lst
+
 @expose("list-tail", [values.W_Object, values.W_Fixnum])
 def list_tail(lst, pos):
-    start_pos = pos.value
-    if start_pos == 0:
-        return lst
-    else:
-        if isinstance(lst, values.W_Cons):
-            assert start_pos > 0
-            # XXX inefficient
-            return values.to_list(values.from_list(lst)[start_pos:])
-        else:
-            return values.w_null
+    return list_tail_impl(lst, pos.value)
 
 @expose("current-seconds", [])
 def current_seconds():
@@ -1174,8 +1132,17 @@ def unsafe_mcdr(p):
 @expose("port-next-location", [values.W_Object], simple=False)
 def port_next_loc(p, env, cont):
     from pycket.interpreter import return_multi_vals
-    return return_multi_vals(values.Values.make([values.w_false] * 3),
-                             env, cont)
+    if not isinstance(p, values.W_InputPort):
+        return return_multi_vals(values.Values.make([values.w_false] * 3),
+                                 env, cont)
+    line, column, position = p.next_location()
+    if line < 0:
+        w_line = w_column = values.w_false
+    else:
+        w_line = values.W_Fixnum(line)
+        w_column = values.W_Fixnum(column)
+    vals = [w_line, w_column, values.W_Fixnum(position)]
+    return return_multi_vals(values.Values.make(vals), env, cont)
 
 @expose("port-writes-special?", [values.W_Object])
 def port_writes_special(v):
@@ -1416,12 +1383,12 @@ class ReaderGraphBuilder(object):
         if not type.isprefab:
             return v
 
-        size = v._get_size_list()
-        p = values_struct.W_Struct.make_n(size, type)
+        size = type.total_field_cnt
+        p = values_struct.make_blank_struct(type)
         self.state[v] = p
         for i in range(size):
             val = self.reader_graph_loop(v._ref(i))
-            p._set_list(i, val)
+            p._init_field(i, val)
 
         return p
 
@@ -1443,9 +1410,20 @@ class ReaderGraphBuilder(object):
             empty._set(key, val)
         return empty
 
+    def reader_graph_loop_equal_immutable_hash(self, v):
+        from pycket.hash.equal import make_equal_immutable_table
+        keys = []
+        vals = []
+        for key, val in v.hash_items():
+            keys.append(self.reader_graph_loop(key))
+            vals.append(self.reader_graph_loop(val))
+        p = make_equal_immutable_table(keys, vals)
+        self.state[v] = p
+        return p
+
     def reader_graph_loop(self, v):
         assert v is not None
-        from pycket.hash.equal import W_EqualHashTable
+        from pycket.hash.equal import W_EqualHashTable, W_EqualImmutableHashTable
         if v in self.state:
             return self.state[v]
         if v.is_proxy():
@@ -1458,6 +1436,8 @@ class ReaderGraphBuilder(object):
             return self.reader_graph_loop_struct(v)
         if isinstance(v, W_EqualHashTable):
             return self.reader_graph_loop_equal_hash(v)
+        if isinstance(v, W_EqualImmutableHashTable):
+            return self.reader_graph_loop_equal_immutable_hash(v)
         if isinstance(v, values.W_Placeholder):
             return self.reader_graph_loop(v.value)
         # XXX FIXME: doesn't handle stuff
@@ -1544,8 +1524,7 @@ make_stub_predicates(
     "internal-definition-context?",
     "namespace?",
     "security-guard?",
-    "compiled-module-expression?",
-    "channel?")
+    "compiled-module-expression?")
 
 @expose("__dummy-function__", [])
 def __dummy__():
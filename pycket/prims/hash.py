@@ -8,7 +8,10 @@ from pycket.hash.simple  import (
     W_EqvImmutableHashTable, W_EqImmutableHashTable,
     make_simple_mutable_table, make_simple_mutable_table_assocs,
     make_simple_immutable_table, make_simple_immutable_table_assocs)
-from pycket.hash.equal   import W_EqualHashTable
+from pycket.hash.equal   import (
+    W_EqualHashTable, W_EqualImmutableHashTable, make_equal_immutable_table)
+from pycket.hash.weak    import (
+    W_WeakEqHashTable, W_WeakEqvHashTable, W_WeakEqualHashTable, make_weak_table)
 from pycket.cont         import continuation, loop_label
 from pycket.error        import SchemeException
 from pycket.prims.expose import default, expose, procedure, define_nyi
@@ -31,7 +34,10 @@ def prefix_hash_names(base):
 def hash_iterate_first(ht):
     if ht.length() == 0:
         return values.w_false
-    return values.W_Fixnum.ZERO
+    try:
+        return values.wrap(ht.hash_iterate_first())
+    except IndexError:
+        return values.w_false
 
 @expose(prefix_hash_names("hash-iterate-next"), [W_HashTable, values.W_Fixnum])
 def hash_iterate_next(ht, pos):
@@ -140,21 +146,25 @@ def from_assocs(assocs, fname):
         vals.append(val.cdr())
     return keys[:], vals[:]
 
-@expose("make-weak-hasheq", [])
-def make_weak_hasheq():
-    # FIXME: not actually weak
-    return make_simple_mutable_table(W_EqvMutableHashTable, None, None)
+@expose(["make-weak-hasheq", "make-late-weak-hasheq"], [default(values.W_List, values.w_null)])
+def make_weak_hasheq(assocs):
+    keys, vals = from_assocs(assocs, "make-weak-hasheq")
+    return make_weak_table(W_WeakEqHashTable, keys, vals)
 
-@expose(["make-weak-hash", "make-late-weak-hasheq"], [default(values.W_List, None)])
+@expose("make-weak-hasheqv", [default(values.W_List, values.w_null)])
+def make_weak_hasheqv(assocs):
+    keys, vals = from_assocs(assocs, "make-weak-hasheqv")
+    return make_weak_table(W_WeakEqvHashTable, keys, vals)
+
+@expose("make-weak-hash", [default(values.W_List, values.w_null)])
 def make_weak_hash(assocs):
-    if assocs is None:
-        return W_EqualHashTable([], [], immutable=False)
-    return W_EqualHashTable(*from_assocs(assocs, "make-weak-hash"), immutable=False)
+    keys, vals = from_assocs(assocs, "make-weak-hash")
+    return make_weak_table(W_WeakEqualHashTable, keys, vals)
 
 @expose("make-immutable-hash", [default(values.W_List, values.w_null)])
 def make_immutable_hash(assocs):
     keys, vals = from_assocs(assocs, "make-immutable-hash")
-    return W_EqualHashTable(keys, vals, immutable=True)
+    return make_equal_immutable_table(keys, vals)
 
 @expose("make-immutable-hasheq", [default(values.W_List, values.w_null)])
 def make_immutable_hasheq(assocs):
@@ -170,7 +180,7 @@ def hash(args):
         raise SchemeException("hash: key does not have a corresponding value")
     keys = [args[i] for i in range(0, len(args), 2)]
     vals = [args[i] for i in range(1, len(args), 2)]
-    return W_EqualHashTable(keys, vals, immutable=True)
+    return make_equal_immutable_table(keys, vals)
 
 @expose("hasheq")
 def hasheq(args):
@@ -223,6 +233,9 @@ def hash_set(table, key, val, env, cont):
     if not table.immutable():
         raise SchemeException("hash-set: not given an immutable table")
 
+    if isinstance(table, W_EqualImmutableHashTable):
+        return table.hash_assoc(key, val, env, cont)
+
     # Fast path
     if isinstance(table, W_ImmutableHashTable):
         new_table = table.assoc(key, val)
@@ -286,9 +299,12 @@ def hash_copy_loop(keys, idx, src, new, env, cont):
 
 def hash_copy(src, env, cont):
     from pycket.interpreter import return_value
-    new = src.make_empty()
-    if isinstance(src, W_ImmutableHashTable):
-        return return_value(new, env, cont)
+    if isinstance(src, W_EqualImmutableHashTable):
+        new = W_EqualHashTable([], [])
+    else:
+        new = src.make_empty()
+        if isinstance(src, W_ImmutableHashTable):
+            return return_value(new, env, cont)
     if src.length() == 0:
         return return_value(new, env, cont)
     return hash_copy_loop(src.hash_items(), 0, src, new, env, cont)
@@ -15,8 +15,10 @@ from pycket              import values
 from pycket              import values_parameter
 from pycket              import values_struct
 from pycket              import values_string
+from pycket              import formatter
 from pycket.error        import SchemeException
-from pycket.prims.expose import default, expose, expose_val, procedure
+from pycket.printer      import print_to_port
+from pycket.prims.expose import default, expose, expose_val, make_procedure, procedure
 
 from sys import platform
 
@@ -76,6 +78,51 @@ def idchar(c):
     c = c[0] # tell the annotator it's really a single char
     return c.isalnum() or c in allowed_char
 
+class Scanner(object):
+    """ Reads the characters of a datum directly from the buffer of an input
+    port, asking the port for more input only when the buffer runs out. The
+    port's position is brought up to date with `finish`. """
+    _attrs_ = ["port", "buf", "pos"]
+
+    def __init__(self, port):
+        self.port = port
+        self.buf = port.get_buffer()
+        self.pos = port.get_pos()
+
+    def refill(self):
+        port = self.port
+        port.set_pos(self.pos)
+        more = port.fill()
+        self.buf = port.get_buffer()
+        self.pos = port.get_pos()
+        return more
+
+    def read(self):
+        """ The next byte, or "" at the end of the input """
+        if self.pos >= len(self.buf) and not self.refill():
+            return ""
+        c = self.buf[self.pos]
+        self.pos += 1
+        return c
+
+    def peek(self):
+        if self.pos >= len(self.buf) and not self.refill():
+            return ""
+        return self.buf[self.pos]
+
+    def skip_line(self):
+        while True:
+            pos = self.buf.find("\n", self.pos)
+            if pos >= 0:
+                self.pos = pos + 1
+                return
+            self.pos = len(self.buf)
+            if not self.refill():
+                return
+
+    def finish(self):
+        self.port.set_pos(self.pos)
+
 def read_number_or_id(f, init):
     sofar = StringBuilder(64)
     sofar.append(init)
@@ -84,9 +131,8 @@ def read_number_or_id(f, init):
         if c == "":
             break
         if idchar(c):
-            v = f.read(1)
-            assert v == c
-            sofar.append(v)
+            f.pos += 1
+            sofar.append(c)
         else:
             break
     got = sofar.build()
@@ -102,20 +148,20 @@ def read_number_or_id(f, init):
         except:
             return values.W_Symbol.make(got)
 
-# FIXME: replace with a string builder
-# FIXME: unicode
 def read_string(f):
     buf = StringBuilder(64)
     isascii = True
     while True:
-        c = f.read(1)[0]
+        c = f.read()
+        if not c:
+            raise SchemeException("read: expected a closing '\"'")
         if c == '"':
             string = buf.build()
             if isascii:
                 return values_string.W_String.fromascii(string)
             return values_string.W_String.fromstr_utf8(string)
         elif c == '\\':
-            n = f.read(1)[0]
+            n = f.read()
             if n == '"' or n == '\\':
                 c = n
             elif n == 'n':
@@ -125,16 +171,16 @@ def read_string(f):
             else:
                 raise SchemeException("read: bad escape character in string: %s"%n)
         else:
-            isascii &= ord(c) < 128
+            isascii &= ord(c[0]) < 128
         buf.append(c)
 
 def read_token(f):
     while True:
-        c = f.read(1) # FIXME: unicode
+        c = f.read() # FIXME: unicode
         if not c:
             return values.eof_object
         if c == ";":
-            f.readline()
+            f.skip_line()
             continue
         if c in [" ", "\n", "\t"]:
             continue
@@ -157,14 +203,14 @@ def read_token(f):
         if c == ",":
             p = f.peek()
             if p == "@":
-                p = f.read(1)
+                f.read()
                 return unquote_splicing_token
             else:
                 return unquote_token
         if idchar(c):
             return read_number_or_id(f, c)
         if c == "#":
-            c2 = f.read(1)
+            c2 = f.read()
             if c2 == "'":
                 return quote_syntax_token
             if c2 == "`":
@@ -172,7 +218,7 @@ def read_token(f):
             if c2 == ",":
                 p = f.peek()
                 if p == "@":
-                    p = f.read(1)
+                    f.read()
                     return unsyntax_splicing_token
                 return unsyntax_token
             if c2 == "t":
@@ -182,7 +228,7 @@ def read_token(f):
             if c2 in ["(", "[", "{"]:
                 return LParenToken("#" + c2)
             if c2 == "\\":
-                s = f.read(1)
+                s = f.read()
                 if not s:
                     raise SchemeException("unexpected end of file")
                 c = ord(s[0]) # XXX deal with unicode
@@ -228,10 +274,17 @@ def read_stream_rt(port, rt, env, cont):
     return return_value(read_stream(port), env, cont)
 
 @jit.dont_look_inside
-def read_stream(stream):
+def read_stream(port):
+    scanner = Scanner(port)
+    try:
+        return read_datum(scanner)
+    finally:
+        scanner.finish()
+
+def read_datum(stream):
     next_token = read_token(stream)
     if isinstance(next_token, SpecialToken):
-        v = read_stream(stream)
+        v = read_datum(stream)
         return next_token.finish(v)
     if isinstance(next_token, DelimToken):
         if not isinstance(next_token, LParenToken):
@@ -262,7 +315,7 @@ def read_list(stream, end):
     while True:
         next_token = read_token(stream)
         if next_token is dot_token:
-            last = read_stream(stream)
+            last = read_datum(stream)
             close = read_token(stream)
             if isinstance(close, RParenToken):
                 check_matches(end, close.str)
@@ -275,7 +328,7 @@ def read_list(stream, end):
         elif isinstance(next_token, LParenToken):
             v = read_list(stream, next_token.str)
         elif isinstance(next_token, SpecialToken):
-            arg = read_stream(stream)
+            arg = read_datum(stream)
             v = next_token.finish(arg)
         else:
             assert isinstance(next_token, values.W_Object)
@@ -324,36 +377,20 @@ def do_read_one_cont(as_bytes, peek, env, cont, _vals):
     w_port = check_one_val(_vals)
     return do_read_one(w_port, as_bytes, peek, env, cont)
 
-def utf8_code_length(i):
-    if i < 0x80:
-        return 1
-    return ord(runicode._utf8_code_length[i - 0x80])
-
-def do_read_one(w_port, as_bytes, peek, env, cont):
+def do_read_one(w_port, as_bytes, peek, env, cont, skip=0):
     from pycket.interpreter import return_value
-    if peek:
-        c = w_port.peek()
-    else:
-        c = w_port.read(1)
-
-    if len(c) == 0:
-        return return_value(values.eof_object, env, cont)
-
-    i = ord(c[0])
     if as_bytes:
+        if w_port.ensure(skip + 1) <= skip:
+            return return_value(values.eof_object, env, cont)
+        pos = w_port.get_pos()
+        i = ord(w_port.get_buffer()[pos + skip])
+        if not peek:
+            w_port.set_pos(pos + 1)
         return return_value(values.W_Fixnum(i), env, cont)
-    else:
-        # hmpf, poking around in internals
-        needed = utf8_code_length(i)
-        if peek:
-            old = w_port.tell()
-            c = w_port.read(needed)
-            w_port.seek(old)
-        elif needed > 1:
-            c += w_port.read(needed - 1)
-        c = c.decode("utf-8")
-        assert len(c) == 1
-        return return_value(values.W_Character(c[0]), env, cont)
+    c = w_port.read_char(peek, skip)
+    if c is None:
+        return return_value(values.eof_object, env, cont)
+    return return_value(values.W_Character(c), env, cont)
 
 @expose("read-char", [default(values.W_Object, None)], simple=False)
 def read_char(w_port, env, cont):
@@ -378,15 +415,7 @@ def do_peek_cont(as_bytes, skip, env, cont, _vals):
     return do_peek(w_port, as_bytes, skip, env, cont)
 
 def do_peek(w_port, as_bytes, skip, env, cont):
-    if skip == 0:
-        return do_read_one(w_port, as_bytes, True, env, cont)
-    else:
-        # FIXME: put into port.
-        old = w_port.tell()
-        w_port.seek(old + skip)
-        ret = do_read_one(w_port, as_bytes, True, env, cont)
-        w_port.seek(old)
-        return ret
+    return do_read_one(w_port, as_bytes, True, env, cont, skip)
 
 @expose("peek-char", [default(values.W_Object, None),
                       default(values.W_Fixnum, values.W_Fixnum.ZERO)],
@@ -816,7 +845,7 @@ def display(datum, out, env, cont):
         port = current_out_param.get(cont) if out is None else out
         write_bytes_avail(bytes, port , 0, len(bytes))
         return return_void(env, cont)
-    return do_print(datum.tostring(), out, env, cont)
+    return do_print_value(datum, out, env, cont)
 
 @expose("newline", [default(values.W_OutputPort, None)], simple=False)
 def newline(out, env, cont):
@@ -824,11 +853,11 @@ def newline(out, env, cont):
 
 @expose("write", [values.W_Object, default(values.W_OutputPort, None)], simple=False)
 def write(o, p, env, cont):
-    return do_print(o.tostring(), p, env, cont)
+    return do_print_value(o, p, env, cont)
 
 @expose("print", [values.W_Object, default(values.W_OutputPort, None)], simple=False)
 def _print(o, p, env, cont):
-    return do_print(o.tostring(), p, env, cont)
+    return do_print_value(o, p, env, cont)
 
 def do_print(str, port, env, cont):
     cont = do_print_cont(str, env, cont)
@@ -842,52 +871,39 @@ def do_print_cont(str, env, cont, _vals):
     port.write(str)
     return return_void(env, cont)
 
-# XXX: Might need to be careful with this heuristic due to mutable strings, but
-# mutable strings are unlikely to be constant, as they are not interned.
-@jit.look_inside_iff(lambda form, vals, name: jit.isconstant(form))
+def do_print_value(w_value, port, env, cont):
+    cont = do_print_value_cont(w_value, env, cont)
+    return get_output_port(port, env, cont)
+
+@continuation
+def do_print_value_cont(w_value, env, cont, _vals):
+    from pycket.interpreter import check_one_val
+    port = check_one_val(_vals)
+    assert isinstance(port, values.W_OutputPort)
+    print_to_port(w_value, port, print_graph(cont))
+    return return_void(env, cont)
+
+def print_graph(cont):
+    return print_graph_param.get(cont) is not values.w_false
+
+def get_template(form, name):
+    return formatter.compile_template(form.as_str_utf8(), name) # XXX for now
+
+def format_to(port, form, vals, name, cont):
+    template = get_template(form, name)
+    width = 0
+    if template.truncates:
+        w_width = error_print_width_param.get(cont)
+        if not isinstance(w_width, values.W_Fixnum):
+            raise SchemeException("%s: error-print-width is not a fixnum" % name)
+        width = w_width.value
+    formatter.format_to(port, template, vals, name, print_graph(cont), width)
+
 def format(form, vals, name):
-    fmt = form.as_str_utf8() # XXX for now
-    i = 0
-    j = 0
-    result = []
-    len_fmt = len(fmt)
-    while True:
-        start = i
-        while i < len_fmt:
-            if fmt[i] == '~':
-                break
-            i += 1
-        else:
-            # not left via break, so we're done
-            result.append(fmt[start:len_fmt])
-            break
-        result.append(fmt[start:i])
-        if i+1 == len_fmt:
-            raise SchemeException(name + ": bad format string")
-        s = fmt[i+1]
-        if (s == 'a' or # turns into switch
-            s == 'A' or
-            s == 's' or
-            s == 'S' or
-            s == 'v' or
-            s == 'V' or
-            s == 'e' or
-            s == 'E' or
-            s == '.'):
-            if j >= len(vals):
-                raise SchemeException(name + ": not enough arguments for format string")
-            result.append(vals[j].tostring())
-            j += 1
-        elif s == 'n' or s == '%':
-            result.append("\n") # newline
-        elif s == '~':
-            result.append("~")
-        else:
-            raise SchemeException("%s: undexpected format character '%s'" % (name, s))
-        i += 2
-    if j != len(vals):
-        raise SchemeException(name + ": not all values used")
-    return "".join(result)
+    port = values.W_StringOutputPort()
+    template = get_template(form, name)
+    formatter.format_to(port, template, vals, name, width=ERROR_PRINT_WIDTH)
+    return port.contents()
 
 @expose("printf", simple=False)
 def printf(args, env, cont):
@@ -896,7 +912,8 @@ def printf(args, env, cont):
     fmt = args[0]
     if not isinstance(fmt, values_string.W_String):
         raise SchemeException("printf: expected a format string, got something else")
-    return do_print(format(fmt, args[1:], "printf"), None, env, cont)
+    format_to(current_out_param.get(cont), fmt, args[1:], "printf", cont)
+    return return_void(env, cont)
 
 @expose("eprintf", simple=False)
 def eprintf(args, env, cont):
@@ -905,24 +922,28 @@ def eprintf(args, env, cont):
     fmt = args[0]
     if not isinstance(fmt, values_string.W_String):
         raise SchemeException("eprintf: expected a format string, got something else")
-    return do_print(format(fmt, args[1:], "eprintf"), current_error_param.get(cont), env, cont)
+    format_to(current_error_param.get(cont), fmt, args[1:], "eprintf", cont)
+    return return_void(env, cont)
 
-@expose("format")
-def do_format(args):
+@expose("format", simple=False)
+def do_format(args, env, cont):
+    from pycket.interpreter import return_value
     if len(args) == 0:
         raise SchemeException("format: expects format string")
     fmt = args[0]
     if not isinstance(fmt, values_string.W_String):
         raise SchemeException("format: expected a format string, got something else")
     vals = args[1:]
-    return values_string.W_String.fromstr_utf8(format(fmt, vals, "format"))
+    port = values.W_StringOutputPort()
+    format_to(port, fmt, vals, "format", cont)
+    return return_value(values_string.W_String.fromstr_utf8(port.contents()), env, cont)
 
 @expose("fprintf", simple=False)
 def do_fprintf(args, env, cont):
     out, form, v = args[0], args[1], args[2:]
     assert isinstance(out, values.W_OutputPort)
     assert isinstance(form, values_string.W_String)
-    out.write(format(form, v, "fprintf"))
+    format_to(out, form, v, "fprintf", cont)
     return return_void(env, cont)
 
 # Why is this different than format/fprintf?
@@ -948,7 +969,7 @@ def cur_print_proc(args, env, cont, extra_call_info):
     v = args[0]
     port = current_out_param.get(cont)
     if v is not values.w_void:
-        port.write(v.tostring())
+        print_to_port(v, port, print_graph(cont))
         port.write("\n")
     return return_void(env, cont)
 
@@ -1009,9 +1030,11 @@ def port_write_handler(out, proc):
 def port_print_handler(out, proc):
     return standard_printer
 
-# FIXME: implementation
 @expose("port-count-lines!", [values.W_Port])
 def port_count_lines_bang(p):
+    # FIXME: output ports do not count lines
+    if isinstance(p, values.W_InputPort):
+        p.count_lines()
     return values.w_void
 
 def is_path_string(path):
@@ -1252,6 +1275,19 @@ expose_val("current-error-port", current_error_param)
 expose_val("current-input-port", current_in_param)
 
 print_graph_param = values_parameter.W_Parameter(values.w_false)
+ERROR_PRINT_WIDTH = 256
+
+@make_procedure("error-print-width", [values.W_Object])
+def error_print_width_guard(w_width):
+    if not isinstance(w_width, values.W_Fixnum) or w_width.value < 3:
+        raise SchemeException(
+            "error-print-width: contract violation\n"
+            "  expected: (and/c exact-integer? (>=/c 3))\n"
+            "  given: %s" % w_width.tostring())
+    return w_width
+
+error_print_width_param = values_parameter.W_Parameter(
+        values.W_Fixnum(ERROR_PRINT_WIDTH), error_print_width_guard)
 print_struct_param = values_parameter.W_Parameter(values.w_false)
 print_box_param = values_parameter.W_Parameter(values.w_false)
 print_vector_length_param = values_parameter.W_Parameter(values.w_false)
@@ -1260,6 +1296,7 @@ print_boolean_long_form_param = values_parameter.W_Parameter(values.w_false)
 print_as_expression_param = values_parameter.W_Parameter(values.w_true)
 
 expose_val("print-graph", print_graph_param)
+expose_val("error-print-width", error_print_width_param)
 expose_val("print-struct", print_struct_param)
 expose_val("print-box", print_box_param)
 expose_val("print-vector-length", print_vector_length_param)
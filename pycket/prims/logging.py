@@ -1,52 +1,129 @@
-
-from pycket                 import values, values_parameter
+from pycket                 import values, values_parameter, values_string
+from pycket                 import values_logger
 from pycket.arity           import Arity
 from pycket.argument_parser import ArgParser, EndOfInput
+from pycket.entry_point     import register_post_run_callback
+from pycket.error           import SchemeException
 from pycket.prims.expose    import default, expose, expose_val
-from rpython.rlib           import jit
-
-DEBUG = values.W_Symbol.make("debug")
+from pycket.values_logger   import W_Logger, W_LogReceiver
 
-w_default_logger = values.W_Logger(values.w_false, values.w_false, values.w_false, [])
+w_default_logger = values_logger.w_root_logger
 
-LOG_LEVEL = ['none', 'fatal', 'error', 'warning', 'info', 'debug']
-LOG_LEVEL = tuple(map(values.W_Symbol.make, LOG_LEVEL) + [values.w_false])
+def check_topic(w_topic, who):
+    if w_topic is not values.w_false and not isinstance(w_topic, values.W_Symbol):
+        raise SchemeException("%s: expected a symbol or #f as topic, got %s" %
+                              (who, w_topic.tostring()))
+    return w_topic
 
 @expose("make-logger", arity=Arity.geq(0))
-@jit.unroll_safe
 def make_logger(args):
     parser = ArgParser("make-logger", args)
 
-    topic           = values.w_false
-    parent          = values.w_false
-    propagate_level = DEBUG
+    topic  = values.w_false
+    parent = values.w_false
 
     try:
         topic = parser.expect(values.W_Symbol, values.w_false)
-        parent = parser.expect(values.W_Logger, values.w_false)
-        propagate_level = parser.expect(*LOG_LEVEL)
+        parent = parser.expect(W_Logger, values.w_false)
     except EndOfInput:
         pass
 
-    # Any remaining arguments are propagate topics
-    propagate_topic = parser.expect_many(values.W_Symbol, values.w_false)
+    # Any remaining arguments are the propagate levels and topics
+    rest = args[parser.index:] if parser.has_more() else []
+    if rest:
+        propagate = values_logger.parse_filter(rest, "make-logger")
+    else:
+        propagate = values_logger.ALL_LEVELS
+    if parent is values.w_false:
+        return W_Logger(topic, None, propagate)
+    assert isinstance(parent, W_Logger)
+    return W_Logger(topic, parent, propagate)
 
-    return values.W_Logger(topic, parent, propagate_level, propagate_topic)
-
-@expose("log-level?", [values.W_Object, values.W_Object, default(values.W_Object, values.w_false)])
+@expose("log-level?", [W_Logger, values.W_Symbol, default(values.W_Object, values.w_false)])
 def log_level(logger, level, topic):
-    # TODO: Actual implementation
+    level = values_logger.level_from_symbol(level, "log-level?")
+    check_topic(topic, "log-level?")
+    return values.W_Bool.make(logger.is_level(level, topic))
+
+@expose("log-max-level", [W_Logger, default(values.W_Object, values.w_false)])
+def log_max_level(logger, topic):
+    check_topic(topic, "log-max-level")
+    for level in range(values_logger.DEBUG, values_logger.NONE, -1):
+        if logger.is_level(level, topic):
+            return values_logger.W_LEVELS[level]
     return values.w_false
 
 @expose("log-message", arity=Arity.oneof(4, 5, 6))
 def log_message(args):
-    # TODO: Actual implementation
-    return
+    logger = args[0]
+    if not isinstance(logger, W_Logger):
+        raise SchemeException("log-message: expected a logger")
+    level = values_logger.level_from_symbol(args[1], "log-message")
+    topic = logger.topic
+    prefix = True
+    if len(args) == 6:
+        topic = check_topic(args[2], "log-message")
+        message, data = args[3], args[4]
+        prefix = args[5] is not values.w_false
+    elif len(args) == 5 and not isinstance(args[2], values_string.W_String):
+        topic = check_topic(args[2], "log-message")
+        message, data = args[3], args[4]
+    else:
+        message, data = args[2], args[3]
+        if len(args) == 5:
+            prefix = args[4] is not values.w_false
+    if not isinstance(message, values_string.W_String):
+        raise SchemeException("log-message: expected a string as message")
+    if not logger.is_level(level, topic):
+        return values.w_void
+    if prefix and topic is not values.w_false:
+        assert isinstance(topic, values.W_Symbol)
+        message = values_string.W_String.fromstr_utf8(
+            "%s: %s" % (topic.utf8value, message.as_str_utf8()))
+    logger.log(level, topic, message, data)
+    return values.w_void
 
-@expose("logger-name", [values.W_Logger])
+@expose("make-log-receiver", arity=Arity.geq(2))
+def make_log_receiver(args):
+    logger = args[0]
+    if not isinstance(logger, W_Logger):
+        raise SchemeException("make-log-receiver: expected a logger")
+    filter = values_logger.parse_filter(args[1:], "make-log-receiver")
+    w_receiver = W_LogReceiver(filter, values_logger.QueueReceiver.CAPACITY)
+    logger.add_receiver(w_receiver.receiver)
+    return w_receiver
+
+@expose("log-receiver?", [values.W_Object])
+def log_receiver_p(obj):
+    return values.W_Bool.make(isinstance(obj, W_LogReceiver))
+
+@expose("logger-name", [W_Logger])
 def logger_name(logger):
     return logger.topic
 
 w_current_logger = values_parameter.W_Parameter(w_default_logger)
 expose_val("current-logger", w_current_logger)
 
+def configure_receivers(stderr_spec, log_file, file_spec):
+    """ Sets up the receivers of the root logger: one writing to stderr, as
+    PLTSTDERR asks, and one appending to `log_file` if it is given """
+    from pycket.prims.input_output import stderr_port
+    root = values_logger.w_root_logger
+    root.receivers = []
+    values_logger.file_receivers.receivers = []
+    filter = values_logger.parse_spec(stderr_spec)
+    if filter is None:
+        filter = values_logger.parse_spec("error")
+        assert filter is not None
+    root.add_receiver(values_logger.PortReceiver(filter, stderr_port))
+    if log_file:
+        filter = values_logger.parse_spec(file_spec)
+        if filter is None:
+            raise SchemeException("bad log level specification: %s" % file_spec)
+        receiver = values_logger.FileReceiver(filter, log_file)
+        values_logger.file_receivers.receivers.append(receiver)
+        root.add_receiver(receiver)
+
+@register_post_run_callback
+def flush_log_files(config, env):
+    values_logger.file_receivers.flush()
@@ -18,6 +18,16 @@ def make_parameter(init, guard):
 def make_derived_parameter(param, guard, wrap):
     return values_parameter.W_DerivedParameter(param, guard, wrap)
 
+def apply_primitive_guard(param, w_val):
+    """ Runs the guard of the parameter on the value if the guard is a simple
+    primitive. Other guards would need a continuation and are not run. """
+    if not isinstance(param, values_parameter.W_Parameter):
+        return w_val
+    guard = param.guard
+    if isinstance(guard, values.W_Prim) and guard.simple_func is not None:
+        return guard.simple_func([w_val])
+    return w_val
+
 @expose("extend-parameterization", arity=Arity.geq(1))
 @jit.unroll_safe
 def scheme_extend_parameterization(args):
@@ -34,6 +44,7 @@ def scheme_extend_parameterization(args):
     while parser.has_more():
         param  = parser.expect(values_parameter.W_BaseParameter)
         key    = parser.expect(values.W_Object)
+        key    = apply_primitive_guard(param, key)
         config = config.extend([param], [key])
 
     return config
@@ -48,9 +59,8 @@ def call_w_paramz(f, paramz, env, cont):
     return call_with_parameterization(f, [], paramz, env, cont)
 
 def call_with_extended_paramz(f, args, keys, vals, env, cont):
-    from pycket.values import parameterization_key
     # XXX seems untested?
-    paramz = cont.get_mark_first(parameterization_key)
+    paramz = cont.get_parameterization()
     assert isinstance(paramz, values_parameter.W_Parameterization) # XXX is this always right?
     paramz_new = paramz.extend(keys, vals)
     return call_with_parameterization(f, args, paramz_new, env, cont)
@@ -1,53 +1,155 @@
-from rpython.rlib import rrandom, rarithmetic
+import time
+
+from rpython.rlib import jit, rarithmetic
 
 from pycket.prims.expose import default, expose, expose_val
+from pycket              import config
 from pycket              import values, values_parameter
 from pycket              import vector as values_vector
 from pycket.error        import SchemeException
 
-# XXX for now just always use a global rng
-
-rng = rrandom.Random()
-
-@expose("random")
-def random(args):
-    if not args:
-        # random flonum
-        return values.W_Flonum(rng.random())
-    a1 = args[0]
-    if isinstance(a1, values.W_Fixnum):
-        upper = a1.value
-        return values.W_Fixnum(int(rng.random() * upper))
-    if isinstance(a1, values.W_PseudoRandomGenerator):
-        return values.W_Flonum(rng.random())
+W_PseudoRandomGenerator = values.W_PseudoRandomGenerator
+
+# the largest k of (random k)
+MAX_RANDOM_RANGE = 4294967087
+
+current_pseudo_random_generator = values_parameter.W_Parameter(W_PseudoRandomGenerator())
+expose_val("current-pseudo-random-generator", current_pseudo_random_generator)
+
+def current_generator(cont):
+    w_gen = current_pseudo_random_generator.get(cont)
+    if not isinstance(w_gen, W_PseudoRandomGenerator):
+        raise SchemeException("current-pseudo-random-generator: not a pseudo-random-generator")
+    return w_gen
+
+def check_range(w_k, name):
+    if not isinstance(w_k, values.W_Fixnum) or not (0 < w_k.value <= MAX_RANDOM_RANGE):
+        raise SchemeException("%s: expected an integer in [1, %d], got %s" %
+                              (name, MAX_RANDOM_RANGE, w_k.tostring()))
+    return w_k.value
+
+@expose("random", simple=False)
+def random(args, env, cont):
+    from pycket.interpreter import return_value
+    nargs = len(args)
+    if nargs > 0 and isinstance(args[nargs - 1], W_PseudoRandomGenerator):
+        gen = args[nargs - 1]
+        assert isinstance(gen, W_PseudoRandomGenerator)
+        nargs -= 1
+    else:
+        gen = current_generator(cont)
+    if nargs == 0:
+        return return_value(values.W_Flonum(gen.random()), env, cont)
+    if nargs == 1:
+        upper = check_range(args[0], "random")
+        return return_value(values.W_Fixnum(gen.random_int(upper)), env, cont)
+    if nargs == 2:
+        w_min, w_max = args[0], args[1]
+        if not isinstance(w_min, values.W_Fixnum) or not isinstance(w_max, values.W_Fixnum):
+            raise SchemeException("random: expected exact integers as range")
+        k = check_range(values.W_Fixnum(w_max.value - w_min.value), "random")
+        return return_value(values.W_Fixnum(w_min.value + gen.random_int(k)),
+                            env, cont)
     raise SchemeException("random: invalid arguments")
 
-@expose(["flrandom", "unsafe-flrandom"], [values.W_PseudoRandomGenerator])
+@expose(["flrandom", "unsafe-flrandom"], [W_PseudoRandomGenerator])
 def flrandom(gen):
-    return values.W_Flonum(rng.random())
+    return values.W_Flonum(gen.random())
 
-@expose("random-seed", [values.W_Fixnum])
-def random_seed(seed):
-    key = [rarithmetic.r_uint(seed.value)]
-    rng.init_by_array(key)
-    return values.w_void
+@expose("random-seed", [values.W_Fixnum], simple=False)
+def random_seed(seed, env, cont):
+    from pycket.interpreter import return_void
+    if not (0 <= seed.value <= 2147483647):
+        raise SchemeException("random-seed: expected an integer in [0, 2147483647]")
+    current_generator(cont).seed(seed.value)
+    return return_void(env, cont)
 
 @expose("make-pseudo-random-generator", [])
 def make_pseudo_random_generator():
-    return values.W_PseudoRandomGenerator()
-
-current_pseudo_random_generator = values_parameter.W_Parameter(values.W_PseudoRandomGenerator())
-expose_val("current-pseudo-random-generator", current_pseudo_random_generator)
+    seed = rarithmetic.intmask(int(time.time() * 1000.0)) & 0x7FFFFFFF
+    return W_PseudoRandomGenerator(seed)
 
-@expose("pseudo-random-generator->vector", [values.W_PseudoRandomGenerator])
+@expose("pseudo-random-generator->vector", [W_PseudoRandomGenerator])
 def pseudo_random_generator_to_vector(gen):
-    return values_vector.W_Vector.fromelements([])
+    elements = [values.W_Integer.fromfloat(x) for x in gen.get_state()]
+    return values_vector.W_Vector.fromelements(elements, immutable=True)
+
+def vector_state(vec):
+    """ The state stored in a vector by pseudo-random-generator->vector, or
+    None if it is not one """
+    if not isinstance(vec, values_vector.W_Vector) or vec.length() != 6:
+        return None
+    state = [0.0] * 6
+    for i in range(6):
+        w_x = vec.ref(i)
+        if isinstance(w_x, values.W_Fixnum):
+            state[i] = float(w_x.value)
+        elif isinstance(w_x, values.W_Bignum):
+            try:
+                state[i] = w_x.value.tofloat()
+            except OverflowError:
+                return None
+        else:
+            return None
+    if not W_PseudoRandomGenerator.is_valid_state(state):
+        return None
+    return state
+
+def expect_state(vec, name):
+    state = vector_state(vec)
+    if state is None:
+        raise SchemeException("%s: expected a pseudo-random-generator vector" % name)
+    return state
 
-@expose("vector->pseudo-random-generator", [values.W_PseudoRandomGenerator, default(values.W_MVector, None)])
-def vector_to_pseudo_random_generator(gen, vec):
-    return values.W_PseudoRandomGenerator()
+@expose("vector->pseudo-random-generator", [values_vector.W_Vector])
+def vector_to_pseudo_random_generator(vec):
+    gen = W_PseudoRandomGenerator()
+    gen.set_state(expect_state(vec, "vector->pseudo-random-generator"))
+    return gen
+
+@expose("vector->pseudo-random-generator!", [W_PseudoRandomGenerator, values_vector.W_Vector])
+def vector_to_pseudo_random_generator_bang(gen, vec):
+    gen.set_state(expect_state(vec, "vector->pseudo-random-generator!"))
+    return values.w_void
 
 @expose("pseudo-random-generator-vector?", [values.W_Object])
 def pseudo_random_generator_vector_huh(vec):
-    return values.W_Bool.make(isinstance(vec, values.W_MVector) and vec.length() == 0)
+    return values.W_Bool.make(vector_state(vec) is not None)
+
+# Bulk sampling: fills a whole vector in one call, writing the samples
+# unboxed into the vector's storage.
+
+@jit.dont_look_inside
+def fill_floats(gen, storage):
+    for i in range(len(storage)):
+        storage[i] = gen.random()
+
+@jit.dont_look_inside
+def fill_fixnums(gen, storage, upper):
+    for i in range(len(storage)):
+        storage[i] = gen.random_int(upper)
+
+@expose("flrandom-fill!", [values_vector.W_FlVector,
+                           default(W_PseudoRandomGenerator, None)], simple=False)
+def flrandom_fill(flvector, gen, env, cont):
+    from pycket.interpreter import return_value
+    if gen is None:
+        gen = current_generator(cont)
+    fill_floats(gen, flvector.float_storage())
+    return return_value(flvector, env, cont)
 
+@expose("random-fill!", [values_vector.W_Vector, values.W_Fixnum,
+                         default(W_PseudoRandomGenerator, None)], simple=False)
+def random_fill(vector, w_k, gen, env, cont):
+    from pycket.interpreter import return_value
+    if vector.immutable():
+        raise SchemeException("random-fill!: expected a mutable vector")
+    upper = check_range(w_k, "random-fill!")
+    if gen is None:
+        gen = current_generator(cont)
+    if config.strategies:
+        fill_fixnums(gen, vector.fixnum_storage(), upper)
+    else:
+        for i in range(vector.length()):
+            vector.set(i, values.W_Fixnum(gen.random_int(upper)))
+    return return_value(vector, env, cont)
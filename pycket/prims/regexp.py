@@ -1,6 +1,7 @@
 from pycket.prims.expose import (unsafe, default, expose, expose_val,
                                  procedure, make_call_method, define_nyi)
 from pycket import values, values_string, values_regex
+from pycket import vector as values_vector
 from pycket.error import SchemeException
 
 from rpython.rlib import jit, rstring
@@ -80,7 +81,7 @@ def match(w_re, w_str, start=0, end=sys.maxint):
         result = w_re.match_string(w_str.as_str(), start, end)
         return result
     if isinstance(w_str, values.W_InputPort):
-        result = w_re.match_port(w_str)
+        result = w_re.match_port(w_str, start, end)
         return result
     raise SchemeException("regexp-match: can't deal with this type")
 
@@ -94,7 +95,7 @@ def match_positions(w_re, w_str, start=0, end=sys.maxint):
         result = w_re.match_string_positions(w_str.as_str(), start, end)
         return result
     if isinstance(w_str, values.W_InputPort):
-        result = w_re.match_port_positions(w_str)
+        result = w_re.match_port_positions(w_str, start, end)
         return result
     raise SchemeException("regexp-match-positions: can't deal with this type")
 
@@ -274,3 +275,11 @@ def regexp_replace_star(pattern, input, insert, prefix):
     builder.append_slice(str, lhs, len(str))
     return values_string.W_String.fromunicode(builder.build())
 
+@expose("regexp-cache-stats", [])
+def regexp_cache_stats():
+    """ Statistics of the compiled regexp cache, as the vector
+    #(hits misses evictions size capacity) """
+    cache = values_regex.CACHE
+    stats = [cache.hits, cache.misses, cache.evictions, cache.size(), cache.max_size]
+    return values_vector.W_Vector.fromelements(
+        [values.W_Fixnum(n) for n in stats], immutable=True)
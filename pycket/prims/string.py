@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import operator as op
 from pycket import values
+from pycket import values_string
 from pycket.values_string import W_String
 from pycket.error import SchemeException
 from pycket.prims.expose import default, expose, unsafe, subclass_unsafe
@@ -236,28 +237,33 @@ def string_append_fastpath(args):
 @expose("string-append")
 @jit.unroll_safe
 def string_append(args):
+    strings_w = [None] * len(args)
+    for i in range(len(args)):
+        arg = args[i]
+        if not isinstance(arg, W_String):
+            raise SchemeException("string-append: expected a string")
+        strings_w[i] = arg
+    # long strings are appended without copying them, which keeps
+    # accumulating a string by appending to it linear
+    w_rope = W_String.make_rope(strings_w)
+    if w_rope is not None:
+        return w_rope
     if jit.isconstant(len(args)):
-        return string_append_fastpath(args)
+        return string_append_fastpath(strings_w)
     if not args:
         return W_String.fromascii("")
     builder = StringBuilder(len(args))
     unibuilder = None
     ascii_idx = 0
     try:
-        for ascii_idx in range(len(args)):
-            arg = args[ascii_idx]
-            if not isinstance(arg, W_String):
-                raise SchemeException("string-append: expected a string")
-            builder.append(arg.as_str_ascii())
+        for ascii_idx in range(len(strings_w)):
+            builder.append(strings_w[ascii_idx].as_str_ascii())
     except ValueError:
         unibuilder = UnicodeBuilder(len(args))
         unibuilder.append(unicode(builder.build()))
         builder = None
-        for i in range(ascii_idx, len(args)):
-            arg = args[i]
-            if not isinstance(arg, W_String):
-                raise SchemeException("string-append: expected a string")
-            unibuilder.append(arg.as_unicode())
+        for i in range(ascii_idx, len(strings_w)):
+            unibuilder.append(strings_w[i].as_unicode())
     if unibuilder is None:
         assert builder is not None
         return W_String.fromascii(builder.build())
@@ -265,6 +271,11 @@ def string_append(args):
         assert unibuilder is not None
         return W_String.fromunicode(unibuilder.build())
 
+@expose("string-literal-cache-size", [])
+def string_literal_cache_size():
+    """ The number of interned string literals that are still alive """
+    return values.W_Fixnum(values_string.literal_cache.size())
+
 @expose(["string-length", "unsafe-string-length"], [W_String])
 def string_length(s1):
     return values.W_Fixnum(s1.length())
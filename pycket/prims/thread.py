@@ -0,0 +1,228 @@
+import time
+
+from pycket              import values
+from pycket              import values_thread
+from pycket.cont         import continuation
+from pycket.error        import SchemeException
+from pycket.prims.expose import default, expose, procedure
+from pycket.values_thread import (W_Thread, W_Semaphore, W_SemaphorePeekEvt,
+                                  W_Channel, W_ChannelPutEvt)
+
+def seconds_value(w_secs, who):
+    w_float = w_secs.arith_exact_inexact()
+    assert isinstance(w_float, values.W_Flonum)
+    if w_float.value < 0.0:
+        raise SchemeException("%s: expected a non-negative real number" % who)
+    return w_float.value
+
+for args in [("thread?", W_Thread),
+             ("semaphore?", W_Semaphore),
+             ("semaphore-peek-evt?", W_SemaphorePeekEvt),
+             ("channel?", W_Channel),
+             ("channel-put-evt?", W_ChannelPutEvt)]:
+    def make_pred(name, cls):
+        @expose(name, [values.W_Object])
+        def predicate(obj):
+            return values.W_Bool.make(isinstance(obj, cls))
+        predicate.__name__ = "predicate(%s)" % name
+    make_pred(*args)
+
+# threads
+
+@expose("thread", [procedure], simple=False)
+def thread(w_thunk, env, cont):
+    from pycket.interpreter import return_value
+    w_thread = values_thread.get_scheduler().spawn(w_thunk, env, cont)
+    return return_value(w_thread, env, cont)
+
+@expose("current-thread", [])
+def current_thread():
+    return values_thread.get_scheduler().current
+
+@expose("thread-running?", [W_Thread])
+def thread_running(w_thread):
+    return values.W_Bool.make(not w_thread.dead)
+
+@expose("thread-dead?", [W_Thread])
+def thread_dead(w_thread):
+    return values.W_Bool.make(w_thread.dead)
+
+@expose("thread-wait", [W_Thread], simple=False)
+def thread_wait(w_thread, env, cont):
+    from pycket.interpreter import return_void
+    if w_thread.dead:
+        return return_void(env, cont)
+    scheduler = values_thread.get_scheduler()
+    if w_thread is scheduler.current:
+        raise SchemeException("thread-wait: a thread cannot wait for itself")
+    waiter = scheduler.block("thread-wait", env, cont)
+    w_thread.register(waiter, values.w_void)
+    return scheduler.next_state()
+
+@expose("kill-thread", [W_Thread], simple=False)
+def kill_thread(w_thread, env, cont):
+    from pycket.interpreter import return_void
+    scheduler = values_thread.get_scheduler()
+    if w_thread is scheduler.main:
+        raise SchemeException("kill-thread: cannot kill the main thread")
+    scheduler.terminate(w_thread)
+    if w_thread is scheduler.current:
+        return scheduler.next_state()
+    return return_void(env, cont)
+
+@expose("sleep", [default(values.W_Real, values.W_Fixnum.ZERO)], simple=False)
+def sleep(w_secs, env, cont):
+    from pycket.interpreter import return_void
+    secs = seconds_value(w_secs, "sleep")
+    scheduler = values_thread.get_scheduler()
+    if not scheduler.started or not scheduler.can_switch():
+        time.sleep(secs)
+        return return_void(env, cont)
+    waiter = scheduler.block("sleep", env, cont)
+    scheduler.sleep(waiter, secs)
+    return scheduler.next_state()
+
+# semaphores
+
+@expose("make-semaphore", [default(values.W_Fixnum, values.W_Fixnum.ZERO)])
+def make_semaphore(n):
+    if n.value < 0:
+        raise SchemeException("make-semaphore: expected a non-negative count")
+    return W_Semaphore(n.value)
+
+@expose("semaphore-post", [W_Semaphore])
+def sem_post(s):
+    s.post()
+
+@expose("semaphore-try-wait?", [W_Semaphore])
+def sem_try_wait(s):
+    return values.W_Bool.make(s.try_wait())
+
+def wait_semaphore(s, env, cont):
+    from pycket.interpreter import return_void
+    if s.try_wait():
+        return return_void(env, cont)
+    scheduler = values_thread.get_scheduler()
+    waiter = scheduler.block("semaphore-wait", env, cont)
+    s.register(waiter, values.w_void)
+    return scheduler.next_state()
+
+@expose("semaphore-wait", [W_Semaphore], simple=False)
+def sem_wait(s, env, cont):
+    return wait_semaphore(s, env, cont)
+
+@expose("semaphore-peek-evt", [W_Semaphore])
+def sem_peek_evt(s):
+    return W_SemaphorePeekEvt(s)
+
+@continuation
+def sem_post_cont(sem, env, cont, vals):
+    from pycket.interpreter import return_multi_vals
+    sem.post()
+    return return_multi_vals(vals, env, cont)
+
+@continuation
+def sem_call_cont(sem, f, args, env, cont, _vals):
+    return f.call(args, env, sem_post_cont(sem, env, cont))
+
+@expose("call-with-semaphore", simple=False)
+def call_with_sem(args, env, cont):
+    if len(args) < 2:
+        raise SchemeException("call-with-semaphore: expected at least 2 arguments")
+    sem = args[0]
+    f = args[1]
+    if not isinstance(sem, W_Semaphore):
+        raise SchemeException("call-with-semaphore: expected a semaphore")
+    if not f.iscallable():
+        raise SchemeException("call-with-semaphore: expected a procedure")
+    if len(args) == 2:
+        new_args = []
+        fail = values.w_false
+    else:
+        new_args = args[3:]
+        fail = args[2]
+    if fail is not values.w_false and sem.n < 1:
+        return fail.call([], env, cont)
+    return wait_semaphore(sem, env, sem_call_cont(sem, f, new_args, env, cont))
+
+# channels
+
+@expose("make-channel", [])
+def make_channel():
+    return W_Channel()
+
+@expose("channel-put-evt", [W_Channel, values.W_Object])
+def channel_put_evt(ch, w_value):
+    return W_ChannelPutEvt(ch, w_value)
+
+@expose("channel-put", [W_Channel, values.W_Object], simple=False)
+def channel_put(ch, w_value, env, cont):
+    from pycket.interpreter import return_void
+    if ch.try_put(w_value):
+        return return_void(env, cont)
+    scheduler = values_thread.get_scheduler()
+    waiter = scheduler.block("channel-put", env, cont)
+    W_ChannelPutEvt(ch, w_value).register(waiter, values.w_void)
+    return scheduler.next_state()
+
+@expose("channel-get", [W_Channel], simple=False)
+def channel_get(ch, env, cont):
+    from pycket.interpreter import return_value
+    w_value = ch.try_get()
+    if w_value is not None:
+        return return_value(w_value, env, cont)
+    scheduler = values_thread.get_scheduler()
+    waiter = scheduler.block("channel-get", env, cont)
+    ch.register(waiter, None)
+    return scheduler.next_state()
+
+@expose("channel-try-get", [W_Channel])
+def channel_try_get(ch):
+    w_value = ch.try_get()
+    return w_value if w_value is not None else values.w_false
+
+# synchronization
+
+def check_evts(evts, who):
+    result = [None] * len(evts)
+    for i, w_evt in enumerate(evts):
+        if not isinstance(w_evt, values.W_Evt):
+            raise SchemeException("%s: expected an event, got %s" % (who, w_evt.tostring()))
+        result[i] = w_evt
+    return result
+
+def do_sync(evts, timeout, who, env, cont):
+    """ Synchronizes on the first ready event. A negative timeout means to
+    wait forever. """
+    from pycket.interpreter import return_value
+    for w_evt in evts:
+        w_result = w_evt.try_sync()
+        if w_result is not None:
+            return return_value(w_result, env, cont)
+    if timeout == 0.0:
+        return return_value(values.w_false, env, cont)
+    scheduler = values_thread.get_scheduler()
+    waiter = scheduler.block(who, env, cont)
+    for w_evt in evts:
+        w_evt.register(waiter, w_evt)
+    if timeout > 0.0:
+        scheduler.sleep(waiter, timeout)
+    return scheduler.next_state()
+
+@expose("sync", simple=False)
+def sync(args, env, cont):
+    return do_sync(check_evts(args, "sync"), -1.0, "sync", env, cont)
+
+@expose("sync/timeout", simple=False)
+def sync_timeout(args, env, cont):
+    if not args:
+        raise SchemeException("sync/timeout: expected at least 1 argument")
+    w_timeout = args[0]
+    if w_timeout is values.w_false:
+        timeout = -1.0
+    elif isinstance(w_timeout, values.W_Real):
+        timeout = seconds_value(w_timeout, "sync/timeout")
+    else:
+        raise SchemeException("sync/timeout: expected a timeout or #f")
+    return do_sync(check_evts(args[1:], "sync/timeout"), timeout,
+                   "sync/timeout", env, cont)
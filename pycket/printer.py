@@ -0,0 +1,274 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Printing of values into output ports. Instead of building the printed
+# representation with W_Object.tostring, which recurses on the Python stack
+# and materializes the whole string, the printer walks compound values with an
+# explicit stack of frames and hands the output to the port in chunks.
+#
+# Pairs, mutable pairs, boxes, vectors and structs are printed by the printer
+# itself, everything else is printed with its tostring method.
+#
+# Before printing a compound value, the printer looks for the components that
+# need a graph label (`#0=` and `#0#`). Cycles are always labeled. When
+# print-graph is true, every component that occurs more than once is labeled;
+# otherwise only the components that could close a cycle, the ones with state
+# that changes after they are created, are tracked, so that scanning a large
+# immutable list takes no extra space.
+#
+from pycket                   import values
+from pycket                   import vector as values_vector
+from pycket.values_struct     import W_Struct, W_PrefabKey
+from rpython.rlib             import jit
+from rpython.rlib.rstring     import StringBuilder
+
+CHUNK_SIZE = 4096
+
+# a label that is needed but has not been printed yet
+UNPRINTED = -1
+
+class Frame(object):
+    """ A compound value whose components are being printed """
+    _attrs_ = ["w_value"]
+
+    def next(self, printer):
+        """ Returns the next component to print, or None when the value is
+        complete. Separators and closing delimiters are emitted on the way. """
+        raise NotImplementedError("abstract base class")
+
+class ListFrame(Frame):
+    _attrs_ = ["w_rest", "started", "tail"]
+
+    def __init__(self, w_cons):
+        self.w_value = w_cons
+        self.w_rest = w_cons
+        self.started = False
+        self.tail = False
+
+    def next(self, printer):
+        if self.tail:
+            printer.emit(")")
+            return None
+        w_rest = self.w_rest
+        if isinstance(w_rest, values.W_Cons) and (not self.started or
+                                                  printer.continues_list(w_rest)):
+            if self.started:
+                printer.emit(" ")
+            self.started = True
+            self.w_rest = w_rest.cdr()
+            return w_rest.car()
+        if w_rest is values.w_null:
+            printer.emit(")")
+            return None
+        # an improper list, or a tail that has a label
+        printer.emit(" . ")
+        self.tail = True
+        return w_rest
+
+class ItemsFrame(Frame):
+    """ A value printed as a sequence of components between delimiters. A
+    None component is printed as '...'. """
+    _attrs_ = ["items", "index", "separator", "close"]
+
+    def __init__(self, w_value, items, separator, close):
+        self.w_value = w_value
+        self.items = items
+        self.index = 0
+        self.separator = separator
+        self.close = close
+
+    def next(self, printer):
+        while self.index < len(self.items):
+            if self.index > 0:
+                printer.emit(self.separator)
+            w_item = self.items[self.index]
+            self.index += 1
+            if w_item is not None:
+                return w_item
+            printer.emit("...")
+        printer.emit(self.close)
+        return None
+
+class VectorFrame(Frame):
+    _attrs_ = ["index"]
+
+    def __init__(self, w_vector):
+        self.w_value = w_vector
+        self.index = 0
+
+    def next(self, printer):
+        w_vector = self.w_value
+        assert isinstance(w_vector, values_vector.W_Vector)
+        if self.index >= w_vector.length():
+            printer.emit(")")
+            return None
+        if self.index > 0:
+            printer.emit(" ")
+        w_item = w_vector.ref(self.index)
+        self.index += 1
+        return w_item
+
+def is_mutable(w_value):
+    """ Whether w_value can refer to values created after it, which is needed
+    to close a cycle """
+    if isinstance(w_value, values.W_WrappedConsMaybe):
+        return True
+    if isinstance(w_value, values.W_Cons) or isinstance(w_value, values.W_IBox):
+        return False
+    if isinstance(w_value, values_vector.W_Vector):
+        return not w_value.immutable()
+    return True
+
+class Printer(object):
+    _attrs_ = ["port", "graph", "scanning", "labels", "seen", "counter",
+               "builder"]
+
+    def __init__(self, port, graph):
+        self.port = port
+        self.graph = graph
+        self.scanning = False
+        # the values that need a label, mapped to their number once printed
+        self.labels = {}
+        # while scanning: the values seen with print-graph, or the mutable
+        # values on the path to the current one without it
+        self.seen = {}
+        self.counter = 0
+        self.builder = StringBuilder()
+
+    def emit(self, s):
+        if self.scanning:
+            return
+        self.builder.append(s)
+        if self.builder.getlength() >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.builder.getlength() > 0:
+            self.port.write(self.builder.build())
+            self.builder = StringBuilder()
+
+    def continues_list(self, w_cons):
+        """ Whether the pair w_cons, the rest of a list being printed, is
+        printed as part of the list rather than after a dot """
+        if not self.scanning:
+            return w_cons not in self.labels
+        if self.graph:
+            if w_cons in self.seen:
+                self.labels[w_cons] = UNPRINTED
+                return False
+            self.seen[w_cons] = None
+            return True
+        # a mutable pair is scanned as a value of its own, to track it
+        return not is_mutable(w_cons)
+
+    def open(self, w_value):
+        """ Starts printing w_value, returns the frame for its components """
+        if self.scanning:
+            if not is_compound(w_value):
+                return None
+            if self.graph:
+                if w_value in self.seen:
+                    self.labels[w_value] = UNPRINTED
+                    return None
+                self.seen[w_value] = None
+            elif is_mutable(w_value):
+                if w_value in self.seen:
+                    self.labels[w_value] = UNPRINTED
+                    return None
+                self.seen[w_value] = None
+        else:
+            label = self.labels.get(w_value, -2)
+            if label >= 0:
+                self.emit("#%d#" % label)
+                return None
+            if label == UNPRINTED:
+                self.labels[w_value] = self.counter
+                self.emit("#%d=" % self.counter)
+                self.counter += 1
+        return self.make_frame(w_value)
+
+    def close(self, frame):
+        if self.scanning and not self.graph:
+            # the path no longer goes through the value
+            w_value = frame.w_value
+            if w_value in self.seen:
+                del self.seen[w_value]
+
+    def make_frame(self, w_value):
+        if isinstance(w_value, values.W_Cons):
+            self.emit("(")
+            return ListFrame(w_value)
+        if isinstance(w_value, values.W_MCons):
+            self.emit("(mcons ")
+            return ItemsFrame(w_value, [w_value.car(), w_value.cdr()], " ", ")")
+        if isinstance(w_value, values.W_MBox) or isinstance(w_value, values.W_IBox):
+            self.emit("'#&")
+            return ItemsFrame(w_value, [w_value.value], "", "")
+        if isinstance(w_value, values_vector.W_Vector):
+            self.emit("#(")
+            return VectorFrame(w_value)
+        if isinstance(w_value, W_Struct):
+            w_type = w_value.struct_type()
+            if w_type.isprefab:
+                prefab_key = W_PrefabKey.from_struct_type(w_type)
+                self.emit("#s(%s " % prefab_key.short_key().tostring())
+                items = [w_value._ref(i) for i in range(w_type.total_field_cnt)]
+                return ItemsFrame(w_value, items, " ", ")")
+            if not w_type.all_opaque():
+                self.emit("(%s " % w_type.name.utf8value)
+                items = []
+                w_value.printed_fields(items, w_type)
+                return ItemsFrame(w_value, items, " ", ")")
+        if not self.scanning:
+            self.emit(w_value.tostring())
+        return None
+
+    def walk(self, w_value):
+        stack = []
+        w_next = w_value
+        while True:
+            if w_next is not None:
+                frame = self.open(w_next)
+                if frame is not None:
+                    stack.append(frame)
+            if not stack:
+                break
+            frame = stack[-1]
+            w_next = frame.next(self)
+            if w_next is None:
+                stack.pop()
+                self.close(frame)
+
+    @jit.dont_look_inside
+    def print_value(self, w_value):
+        if is_compound(w_value):
+            self.scanning = True
+            self.walk(w_value)
+            self.scanning = False
+            self.seen.clear()
+        self.walk(w_value)
+        self.flush()
+
+def is_compound(w_value):
+    """ Whether the printer prints the components of w_value itself """
+    if isinstance(w_value, W_Struct):
+        w_type = w_value.struct_type()
+        return w_type.isprefab or not w_type.all_opaque()
+    return (isinstance(w_value, values.W_Cons) or
+            isinstance(w_value, values.W_MCons) or
+            isinstance(w_value, values.W_MBox) or
+            isinstance(w_value, values.W_IBox) or
+            isinstance(w_value, values_vector.W_Vector))
+
+def print_to_port(w_value, port, graph=False):
+    """ Prints w_value into the output port in chunks """
+    if not is_compound(w_value):
+        port.write(w_value.tostring())
+        return
+    Printer(port, graph).print_value(w_value)
+
+def tostring(w_value, graph=False):
+    """ The printed representation of w_value, with cycles labeled """
+    port = values.W_StringOutputPort()
+    print_to_port(w_value, port, graph)
+    return port.contents()
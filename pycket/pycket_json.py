@@ -1,6 +1,7 @@
-from rpython.rlib.runicode import unicode_encode_utf_8
-from rpython.rlib.objectmodel import specialize, r_dict
-from rpython.rlib.parsing.ebnfparse import parse_ebnf, make_parse_function
+from rpython.rlib.objectmodel import specialize
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rstring import (StringBuilder, ParseStringError,
+                                  ParseStringOverflowError)
 from rpython.tool.pairtype import extendabletype
 
 # Union-Object to represent a json structure in a static way
@@ -160,146 +161,283 @@ json_true = JsonTrue()
 json_false = JsonFalse()
 
 
-class FakeSpace(object):
+# Pull parser for JSON. Instead of building the whole tree, consumers walk the
+# input with start_object/next_key and start_array/next_element, and only
+# materialize the parts they need with read_value. Strings are interned per
+# reader, so the many repetitions of keys, symbol names and module paths in
+# expander output share one copy.
+class JsonReader(object):
 
-    w_None = json_null
-    w_True = json_true
-    w_False = json_false
-    w_ValueError = ValueError
-    w_UnicodeDecodeError = UnicodeDecodeError
-    w_UnicodeEncodeError = UnicodeEncodeError
-    w_int = JsonInt
-    w_float = JsonFloat
-
-    def newtuple(self, items):
-        return None
-
-    def newdict(self):
-        return JsonObject({})
-
-    def newobject(self, d):
-        return JsonObject(d)
-
-    def newlist(self, items):
-        return JsonArray([])
-
-    def newint(self, intval):
-        return JsonInt(intval)
-
-    def newfloat(self, floatval):
-        return JsonFloat(floatval)
-
-    def newunicode(self, unicodeval):
-        return JsonString(unicodeval.encode('utf-8'))
-
-    def unicode_w(self, s):
-        assert isinstance(s, JsonString)
-        string = s.value_string()
-        return string.decode('utf-8')
-        # return str_decode_utf_8(string, len(string), 'strict')
-
-    def newtext(self, text):
-        return JsonString(text)
-
-    def newbytes(self, bytes):
-        return JsonString(bytes)
-
-    def call_method(self, obj, name, arg):
-        assert name == 'append'
-        assert isinstance(obj, JsonArray)
-        obj.value.append(arg)
-    call_method._dont_inline_ = True
-
-    def call_function(self, w_func, *args_w):
-        assert 0
-
-    def setitem(self, d, key, value):
-        assert isinstance(d, JsonObject)
-        assert isinstance(key, JsonString)
-        d.value[key.value_string()] = value
-
-    def wrapunicode(self, x):
-        return JsonString(unicode_encode_utf_8(x, len(x), "strict"))
-
-    def wrapint(self, x):
-        return JsonInt(x)
-
-    def wrapfloat(self, x):
-        return JsonFloat(x)
-
-    def wrap(self, x):
-        if isinstance(x, int):
-            return JsonInt(x)
-        elif isinstance(x, float):
-            return JsonFloat(x)
-        return self.wrapunicode(unicode(x))
-    wrap._annspecialcase_ = "specialize:argtype(1)"
-
-fakespace = FakeSpace()
-
-from pypy.module._pypyjson.interp_decoder import JSONDecoder, slice_eq, slice_hash
-
-class OwnJSONDecoder(JSONDecoder):
-    def __init__(self, s):
-        self.space = fakespace
+    def __init__(self, s, pos=0):
+        assert s is not None
         self.s = s
-        # we put our string in a raw buffer so:
-        # 1) we automatically get the '\0' sentinel at the end of the string,
-        #    which means that we never have to check for the "end of string"
-        self.ll_chars = s + chr(0)
-        self.pos = 0
-        self.cache = r_dict(slice_eq, slice_hash)
-
-    def close(self):
-        pass
-
-    def _create_dict(self, d):
-        newdict = {}
-        for key, val in d.iteritems():
-            utf8 = unicode_encode_utf_8(key, len(key), "strict")
-            newdict[utf8] = val
-        return self.space.newobject(newdict)
+        self.pos = pos
+        self.length = len(s)
+        # number of elements read so far in each open object/array
+        self.counts = []
+        self.strings = {}
 
     @specialize.arg(1)
     def _raise(self, msg, *args):
         raise ValueError(msg % args)
 
-    def decode_float(self, i):
-        start = i
-        while self.ll_chars[i] in "+-0123456789.eE":
+    def _char(self, i):
+        if i < self.length:
+            return self.s[i]
+        return "\0"
+
+    def skip_whitespace(self):
+        i = self.pos
+        while i < self.length and self.s[i] in " \t\r\n":
             i += 1
         self.pos = i
-        return self.space.wrap(float(self.getslice(start, i)))
-
-    def decode_string(self, i):
-        start = i
-        while True:
-            # this loop is a fast path for strings which do not contain escape
-            # characters
-            ch = self.ll_chars[i]
+        return i
+
+    def at_end(self):
+        return self.skip_whitespace() >= self.length
+
+    def _expect(self, ch):
+        i = self.skip_whitespace()
+        if self._char(i) != ch:
+            self._raise("Expected '%s' at char %d", ch, i)
+        self.pos = i + 1
+
+    def _intern(self, s):
+        result = self.strings.get(s, None)
+        if result is None:
+            self.strings[s] = s
+            return s
+        return result
+
+    def _next_item(self, close):
+        """ Consumes the separator before the next item of the innermost
+        object or array. Returns False and leaves the container when `close`
+        comes next. """
+        assert self.counts
+        i = self.skip_whitespace()
+        if self._char(i) == close:
+            self.pos = i + 1
+            self.counts.pop()
+            return False
+        count = self.counts[-1]
+        if count > 0:
+            self._expect(",")
+        self.counts[-1] = count + 1
+        return True
+
+    def start_object(self):
+        self._expect("{")
+        self.counts.append(0)
+
+    def next_key(self):
+        """ Returns the key of the next entry of the current object, or None
+        at the end of the object. The value is read next. """
+        if not self._next_item("}"):
+            return None
+        key = self.read_string()
+        self._expect(":")
+        return key
+
+    def start_array(self):
+        self._expect("[")
+        self.counts.append(0)
+
+    def next_element(self):
+        """ Returns True if the current array has another element, which is
+        read next, and False at the end of the array. """
+        return self._next_item("]")
+
+    def read_string(self):
+        i = self.skip_whitespace()
+        if self._char(i) != '"':
+            self._raise("Expected string at char %d", i)
+        start = i = i + 1
+        while i < self.length:
+            # fast path for strings without escapes
+            ch = self.s[i]
+            if ch == '"':
+                self.pos = i + 1
+                return self._intern(self.s[start:i])
+            if ch == "\\":
+                return self._intern(self._read_string_escaped(start, i))
+            if ch < "\x20":
+                self._raise("Invalid control character at char %d", i)
+            i += 1
+        self._raise("Unterminated string starting at char %d", start - 1)
+
+    def _read_string_escaped(self, start, i):
+        builder = StringBuilder()
+        builder.append_slice(self.s, start, i)
+        while i < self.length:
+            ch = self.s[i]
             i += 1
             if ch == '"':
-                content_utf8 = self.getslice(start, i-1)
                 self.pos = i
-                return JsonString(content_utf8)
-            elif ch == '\\':
-                self.pos = i-1
-                return self.decode_string_escaped(start)
-            elif ch < '\x20':
-                self._raise("Invalid control character at char %d", self.pos-1)
-
-
+                return builder.build()
+            if ch < "\x20":
+                self._raise("Invalid control character at char %d", i - 1)
+            if ch != "\\":
+                builder.append(ch)
+                continue
+            ch = self._char(i)
+            i += 1
+            if ch == "n":
+                builder.append("\n")
+            elif ch == "t":
+                builder.append("\t")
+            elif ch == "r":
+                builder.append("\r")
+            elif ch == "b":
+                builder.append("\b")
+            elif ch == "f":
+                builder.append("\f")
+            elif ch == '"' or ch == "\\" or ch == "/":
+                builder.append(ch)
+            elif ch == "u":
+                code = self._read_hex(i)
+                i += 4
+                if (0xd800 <= code <= 0xdbff and self._char(i) == "\\"
+                        and self._char(i + 1) == "u"):
+                    low = self._read_hex(i + 2)
+                    if 0xdc00 <= low <= 0xdfff:
+                        code = 0x10000 + (((code - 0xd800) << 10) | (low - 0xdc00))
+                        i += 6
+                _append_utf8(builder, code)
+            else:
+                self._raise("Invalid \\escape: %s (char %d)", ch, i - 1)
+        self._raise("Unterminated string starting at char %d", start - 1)
+
+    def _read_hex(self, i):
+        if i + 4 > self.length:
+            self._raise("Invalid \\uXXXX escape (char %d)", i)
+        code = 0
+        for j in range(i, i + 4):
+            ch = self.s[j]
+            if "0" <= ch <= "9":
+                digit = ord(ch) - ord("0")
+            elif "a" <= ch <= "f":
+                digit = ord(ch) - ord("a") + 10
+            elif "A" <= ch <= "F":
+                digit = ord(ch) - ord("A") + 10
+            else:
+                self._raise("Invalid \\uXXXX escape (char %d)", i)
+            code = code * 16 + digit
+        return code
+
+    def _read_number(self):
+        start = i = self.skip_whitespace()
+        is_float = False
+        while i < self.length:
+            ch = self.s[i]
+            if ch in ".eE":
+                is_float = True
+            elif ch not in "+-0123456789":
+                break
+            i += 1
+        if i == start:
+            self._raise("No JSON object could be decoded: unexpected '%s' at char %d",
+                        self._char(i), i)
+        self.pos = i
+        text = self.s[start:i]
+        if not is_float:
+            try:
+                return JsonInt(string_to_int(text))
+            except ParseStringOverflowError:
+                pass
+            except ParseStringError:
+                self._raise("Invalid number at char %d", start)
+        try:
+            return JsonFloat(float(text))
+        except ValueError:
+            self._raise("Invalid number at char %d", start)
+
+    def _read_literal(self, word, value):
+        i = self.pos
+        if self.s[i:i + len(word)] != word:
+            self._raise("No JSON object could be decoded: unexpected '%s' at char %d",
+                        self._char(i), i)
+        self.pos = i + len(word)
+        return value
+
+    def read_value(self):
+        """ Reads the next value and returns it as a tree of JsonBase """
+        i = self.skip_whitespace()
+        ch = self._char(i)
+        if ch == "{":
+            self.start_object()
+            dct = {}
+            while True:
+                key = self.next_key()
+                if key is None:
+                    break
+                dct[key] = self.read_value()
+            return JsonObject(dct)
+        if ch == "[":
+            self.start_array()
+            lst = []
+            while self.next_element():
+                lst.append(self.read_value())
+            return JsonArray(lst)
+        if ch == '"':
+            return JsonString(self.read_string())
+        if ch == "t":
+            return self._read_literal("true", json_true)
+        if ch == "f":
+            return self._read_literal("false", json_false)
+        if ch == "n":
+            return self._read_literal("null", json_null)
+        return self._read_number()
+
+    def skip_value(self):
+        """ Skips over the next value without building it """
+        i = self.skip_whitespace()
+        ch = self._char(i)
+        if ch == "{":
+            self.start_object()
+            while self.next_key() is not None:
+                self.skip_value()
+        elif ch == "[":
+            self.start_array()
+            while self.next_element():
+                self.skip_value()
+        elif ch == '"':
+            self._skip_string()
+        else:
+            self.read_value()
+
+    def _skip_string(self):
+        i = self.pos + 1
+        while i < self.length:
+            ch = self.s[i]
+            if ch == '"':
+                self.pos = i + 1
+                return
+            if ch == "\\":
+                i += 1
+            i += 1
+        self._raise("Unterminated string starting at char %d", self.pos)
+
+def _append_utf8(builder, code):
+    if code < 0x80:
+        builder.append(chr(code))
+    elif code < 0x800:
+        builder.append(chr(0xc0 | (code >> 6)))
+        builder.append(chr(0x80 | (code & 0x3f)))
+    elif code < 0x10000:
+        builder.append(chr(0xe0 | (code >> 12)))
+        builder.append(chr(0x80 | ((code >> 6) & 0x3f)))
+        builder.append(chr(0x80 | (code & 0x3f)))
+    else:
+        builder.append(chr(0xf0 | (code >> 18)))
+        builder.append(chr(0x80 | ((code >> 12) & 0x3f)))
+        builder.append(chr(0x80 | ((code >> 6) & 0x3f)))
+        builder.append(chr(0x80 | (code & 0x3f)))
 
 def loads(s):
-    decoder = OwnJSONDecoder(s)
-    try:
-        w_res = decoder.decode_any(0)
-        i = decoder.skip_whitespace(decoder.pos)
-        if i < len(s):
-            start = i
-            end = len(s) - 1
-            raise ValueError("Extra data: char %d - %d" % (start, end))
-        return w_res
-    finally:
-        decoder.close()
-
+    reader = JsonReader(s)
+    w_res = reader.read_value()
+    if not reader.at_end():
+        start = reader.pos
+        end = len(s) - 1
+        raise ValueError("Extra data: char %d - %d" % (start, end))
+    return w_res
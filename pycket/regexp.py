@@ -1,5 +1,6 @@
 import sys
 
+from rpython.rlib import jit
 from rpython.rlib.listsort import make_timsort_class
 from rpython.rlib.objectmodel import specialize
 from rpython.rlib.rstring import UnicodeBuilder
@@ -81,19 +82,101 @@ CATEGORY_UNI_NOT_WORD = 15
 CATEGORY_UNI_LINEBREAK = 16
 CATEGORY_UNI_NOT_LINEBREAK = 17
 
+class CompiledRegexp(object):
+    _immutable_fields_ = ["code[*]", "flags", "groupcount", "groupindex",
+                          "indexgroup", "group_offsets"]
+
+    def __init__(self, code, flags, groupcount, groupindex, indexgroup, group_offsets):
+        self.code = code
+        self.flags = flags
+        self.groupcount = groupcount
+        self.groupindex = groupindex
+        self.indexgroup = indexgroup
+        self.group_offsets = group_offsets
+
+class RegexpCacheEntry(object):
+    def __init__(self, key, compiled_regexp):
+        self.key = key
+        self.compiled_regexp = compiled_regexp
+        self.prev = None
+        self.next = None
+
 class RegexpCache(object):
-    # XXX should be elidable for the JIT.
-    def __init__(self):
-        self._contents = {}
+    """ Compiled regexps keyed on (pattern, flags, kind), where kind tells
+    regexps, pregexps and their byte variants apart. The cache holds at most
+    `max_size` entries and evicts the least recently used one when full.
+
+    Lookups happen once per regexp object (see W_AnyRegexp.ensure_compiled),
+    so the cache itself is kept out of JIT traces. """
 
-    def contains(self, pattern, flags):
-        return (pattern, flags) in self._contents
+    DEFAULT_SIZE = 512
+
+    def __init__(self, max_size=DEFAULT_SIZE):
+        assert max_size > 0
+        self.max_size = max_size
+        self._contents = {}
+        # most recently used entry first
+        self.head = None
+        self.tail = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def size(self):
+        return len(self._contents)
+
+    def _unlink(self, entry):
+        if entry.prev is None:
+            self.head = entry.next
+        else:
+            entry.prev.next = entry.next
+        if entry.next is None:
+            self.tail = entry.prev
+        else:
+            entry.next.prev = entry.prev
+        entry.prev = entry.next = None
+
+    def _push_front(self, entry):
+        entry.next = self.head
+        if self.head is not None:
+            self.head.prev = entry
+        self.head = entry
+        if self.tail is None:
+            self.tail = entry
+
+    def get(self, pattern, flags, kind):
+        entry = self._contents.get((pattern, flags, kind), None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if entry is not self.head:
+            self._unlink(entry)
+            self._push_front(entry)
+        return entry.compiled_regexp
+
+    def set(self, pattern, flags, kind, compiled_regexp):
+        key = (pattern, flags, kind)
+        entry = self._contents.get(key, None)
+        if entry is not None:
+            entry.compiled_regexp = compiled_regexp
+            return
+        while len(self._contents) >= self.max_size:
+            self._evict()
+        entry = RegexpCacheEntry(key, compiled_regexp)
+        self._contents[key] = entry
+        self._push_front(entry)
 
-    def get(self, pattern, flags):
-        return self._contents[pattern, flags]
+    def _evict(self):
+        entry = self.tail
+        assert entry is not None
+        self._unlink(entry)
+        del self._contents[entry.key]
+        self.evictions += 1
 
-    def set(self, pattern, flags, compiled_regexp):
-        self._contents[pattern, flags] = compiled_regexp
+    def clear(self):
+        self._contents.clear()
+        self.head = self.tail = None
 
 
 class UnscopedFlagSet(Exception):
@@ -1339,11 +1422,15 @@ def _compile_no_cache(pattern, flags):
     index_group = {}
     for n, v in info.group_index.iteritems():
         index_group[v] = n
-    return code, info.flags, info.group_count, info.group_index, index_group, info.group_offsets
+    return CompiledRegexp(code, info.flags, info.group_count, info.group_index,
+                          index_group, info.group_offsets)
 
 
-def compile(cache, pattern, flags=0):
-    if not cache.contains(pattern, flags):
-        cache.set(pattern, flags, _compile_no_cache(pattern, flags))
-    return cache.get(pattern, flags)
+@jit.dont_look_inside
+def compile(cache, pattern, flags=0, kind=0):
+    compiled = cache.get(pattern, flags, kind)
+    if compiled is None:
+        compiled = _compile_no_cache(pattern, flags)
+        cache.set(pattern, flags, kind, compiled)
+    return compiled
 
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Safepoints of the interpreter loop. Work that has to happen periodically
+# while a program runs, like switching green threads, polling for breaks or
+# taking profiler samples, is done by safepoint handlers.
+#
+# The interpreter counts ticks: one at every point where the loop may enter
+# the JIT and one for every application. When the ticks of an interval are
+# used up, the handlers run at the next of those loop points. A handler gets
+# the state of the machine, an (ast, env, cont) triple, and returns the state
+# to continue with, so it can capture the current continuation and resume
+# another one.
+#
+# Counting is switched off as long as no handler is registered. The JIT
+# constant-folds that check, and otherwise a tick costs a decrement plus, at
+# the loop points, one guard.
+#
+from rpython.rlib import jit
+
+# Number of ticks between two runs of the handlers
+INTERVAL = 20000
+
+class SafepointHandler(object):
+    _attrs_ = []
+
+    def safepoint(self, ast, env, cont):
+        """ Called with the state of the interpreter. Returns the state to
+        continue with, which is the same one to just go on. """
+        raise NotImplementedError("abstract base class")
+
+class Safepoints(object):
+    _attrs_ = ["active", "handlers", "interval", "fuel"]
+    _immutable_fields_ = ["active?"]
+
+    def __init__(self, interval=INTERVAL):
+        assert interval > 0
+        self.active = False
+        self.handlers = []
+        self.interval = interval
+        self.fuel = interval
+
+    def register(self, handler):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+        if not self.active:
+            self.active = True
+            self.refuel()
+
+    def unregister(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        if not self.handlers:
+            self.active = False
+
+    def refuel(self):
+        """ Starts a new interval """
+        self.fuel = self.interval
+
+    def count(self):
+        if self.active:
+            self.fuel -= 1
+
+    def tick(self):
+        """ Counts a tick at a loop point. Returns True when the handlers
+        are due. """
+        if not self.active:
+            return False
+        self.fuel -= 1
+        return self.fuel <= 0
+
+    @jit.dont_look_inside
+    def run_handlers(self, ast, env, cont):
+        self.refuel()
+        for handler in self.handlers[:]:
+            ast, env, cont = handler.safepoint(ast, env, cont)
+        return ast, env, cont
+
+safepoints = Safepoints()
+
+def count():
+    safepoints.count()
+
+def tick():
+    return safepoints.tick()
+
+def run_handlers(ast, env, cont):
+    return safepoints.run_handlers(ast, env, cont)
@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Server mode: one process runs many programs.
+#
+# A run of a single program pays for expanding and instantiating its
+# libraries and for warming up the JIT. With `--server`, the interpreter
+# reads run requests from stdin instead, one after the other, and keeps the
+# toplevel environment, the loaded and instantiated modules and the compiled
+# traces between them. Only the main module of a request is loaded and
+# instantiated again for every request.
+#
+# Every request gets its own command-line arguments, its own
+# `current-input-port`, reading the payload of the request, and its own
+# `current-output-port`, whose contents are sent back as the response.
+#
+# Requests, on stdin:
+#
+#   run <module path>\n
+#   <argument count>\n
+#   one line per argument
+#   <payload length>\n
+#   the payload
+#
+# Responses, on stdout:
+#
+#   ok <length>\n        or        error <length>\n
+#   the output of the program, followed by the error message for an error
+#
+# The server stops at the end of its input. A malformed request gets an
+# error response, and the lines after it are skipped up to the next line
+# that starts with `run `. Threads a program spawns are killed when it
+# ends, and the messages about expanding files go to stderr, to keep them
+# out of the responses.
+#
+from pycket                  import rpath, values, values_thread
+from pycket.error            import SchemeException
+from pycket.expand           import expansion_messages
+from pycket.values_parameter import top_level_config
+from pycket.values_string    import W_String
+
+class ProtocolError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+class Request(object):
+    _attrs_ = _immutable_fields_ = ["path", "args[*]", "payload"]
+
+    def __init__(self, path, args, payload):
+        self.path = path
+        self.args = args
+        self.payload = payload
+
+def read_line(port):
+    """ Reads a line without its newline. Returns None at the end of the
+    input. """
+    line = port.readline()
+    if not line:
+        return None
+    if line[-1] == "\n":
+        stop = len(line) - 1
+        assert stop >= 0
+        line = line[:stop]
+    return line
+
+def read_count(port, what):
+    line = read_line(port)
+    if line is None:
+        raise ProtocolError("missing %s" % what)
+    try:
+        count = int(line)
+    except ValueError:
+        raise ProtocolError("malformed %s: %s" % (what, line))
+    if count < 0:
+        raise ProtocolError("malformed %s: %s" % (what, line))
+    return count
+
+def read_request(port, line=None):
+    """ Reads the next request from the port, None at the end of the
+    input. `line` is the first line of the request if it was read already. """
+    if line is None:
+        line = read_line(port)
+    if line is None:
+        return None
+    if not line.startswith("run "):
+        raise ProtocolError("unknown request: %s" % line)
+    path = line[len("run "):]
+    count = read_count(port, "argument count")
+    args = [None] * count
+    for i in range(count):
+        arg = read_line(port)
+        if arg is None:
+            raise ProtocolError("missing argument")
+        args[i] = arg
+    length = read_count(port, "payload length")
+    payload = port.read(length)
+    if len(payload) != length:
+        raise ProtocolError("truncated payload")
+    return Request(path, args, payload)
+
+def skip_to_request(port):
+    """ Skips the input up to the first line of the next request and returns
+    that line, or None at the end of the input """
+    while True:
+        line = read_line(port)
+        if line is None or line.startswith("run "):
+            return line
+
+def write_response(port, status, output):
+    port.write("%s %d\n" % (status, len(output)))
+    port.write(output)
+    port.flush()
+
+class Server(object):
+    _attrs_ = ["reader", "env", "requests", "responses"]
+
+    def __init__(self, reader, env, requests, responses):
+        self.reader = reader
+        self.env = env
+        self.requests = requests
+        self.responses = responses
+
+    def serve(self):
+        """ Runs requests until the end of the input. Returns the number of
+        requests run. """
+        count = 0
+        to_stderr = expansion_messages.to_stderr
+        expansion_messages.to_stderr = True
+        try:
+            line = None
+            while True:
+                try:
+                    request = read_request(self.requests, line)
+                except ProtocolError, e:
+                    write_response(self.responses, "error", "ERROR:\n%s\n" % e.msg)
+                    line = skip_to_request(self.requests)
+                    if line is None:
+                        return count
+                    continue
+                line = None
+                if request is None:
+                    return count
+                status, output = self.run(request)
+                write_response(self.responses, status, output)
+                count += 1
+        finally:
+            expansion_messages.to_stderr = to_stderr
+
+    def run(self, request):
+        """ Runs the main module of the request. Returns the status and the
+        output of the run. """
+        from pycket.interpreter import interpret_module
+        from pycket.prims.input_output import current_in_param, current_out_param
+        env = self.env
+        out = values.W_StringOutputPort()
+        w_in = values.W_StringInputPort(request.payload)
+        # the root values of the parameters, which are shared by the requests
+        out_cell = top_level_config.get(current_out_param)
+        in_cell = top_level_config.get(current_in_param)
+        assert isinstance(out_cell, values.W_ThreadCell)
+        assert isinstance(in_cell, values.W_ThreadCell)
+        old_out = out_cell.get()
+        old_in = in_cell.get()
+        out_cell.set(out)
+        in_cell.set(w_in)
+        env.commandline_arguments = [W_String.fromstr_utf8(arg) for arg in request.args]
+        scheduler = values_thread.get_scheduler()
+        scheduler.track_threads()
+        status = "ok"
+        try:
+            module_name = rpath.realpath(request.path)
+            # a fresh copy of the module, which has not been instantiated yet
+            ast = self.reader.expand_file_cached(module_name)
+            env.globalconfig.load(ast)
+            env.module_env.replace_module(module_name, ast)
+            interpret_module(ast, env)
+        except SchemeException, e:
+            out.write("ERROR:\n%s\n" % e.format_error())
+            status = "error"
+        except (ValueError, OSError):
+            # the module could not be read
+            out.write("ERROR:\ncannot load %s\n" % request.path)
+            status = "error"
+        finally:
+            scheduler.reset()
+            out_cell.set(old_out)
+            in_cell.set(old_in)
+        return status, out.contents()
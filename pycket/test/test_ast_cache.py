@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the binary AST cache
+#
+import os
+import pytest
+
+from pycket                import ast_cache, values, vector
+from pycket.ast_cache      import (serialize_module, deserialize_module,
+                                   load_cached_module, write_cached_module)
+from pycket.assign_convert import assign_convert
+from pycket.bytesource     import StringSource
+from pycket.env            import ToplevelEnv
+from pycket.interpreter    import *
+
+sym = values.W_Symbol.make
+
+def make_module():
+    a, x, y, z = sym("a"), sym("x"), sym("y"), sym("z")
+    plus = ModuleVar(sym("+"), "#%kernel", sym("+"))
+    lam = make_lambda([a], None,
+                      [App.make(plus, [LexicalVar(a), Quote(values.W_Fixnum(1))])])
+    xvar = ModuleVar(x, None, x)
+    call = App.make(xvar, [App.make(xvar, [Quote(values.W_Fixnum(40))])])
+    lit = values.to_improper([values.W_Fixnum(1), values.W_Flonum(2.5), sym("s"),
+                              vector.W_Vector.fromelements([values.w_true], immutable=True)],
+                             values.W_Fixnum(3))
+    body = [DefineValues([x], CaseLambda([lam]), [x]),
+            DefineValues([y], call, [y]),
+            DefineValues([z], Quote(lit), [z])]
+    return Context.normalize_term(Module("m", body, {"k": "v"}))
+
+def run_converted(module):
+    module = assign_convert(module)
+    module.interpret_mod(ToplevelEnv())
+    return module
+
+def test_roundtrip():
+    module = make_module()
+    data = serialize_module(module, 1.5, "\0" * 16)
+    copy = deserialize_module(StringSource(data), None, mtime=1.5)
+    assert copy is not module
+    assert copy.tostring() == module.tostring()
+    assert copy.config == {"k": "v"}
+    copy = run_converted(copy)
+    assert copy.defs[sym("y")].value == 42
+    assert copy.defs[sym("z")].equal(run_converted(make_module()).defs[sym("z")])
+
+def test_gensyms_keep_identity():
+    module = make_module()
+    data = serialize_module(module, 1.5, "\0" * 16)
+    copy = deserialize_module(StringSource(data), None, mtime=1.5)
+    let = copy.body[1].rhs
+    assert isinstance(let, Let)
+    gensym = let.args.elems[0]
+    assert not gensym.is_interned()
+    assert let.body[0].rands[0].sym is gensym
+
+def test_header_validation():
+    data = serialize_module(make_module(), 1.5, "a" * 16)
+    assert deserialize_module(StringSource(data), None, mtime=2.5) is None
+    assert deserialize_module(StringSource(data), None, mtime=2.5, digest="b" * 16) is None
+    assert deserialize_module(StringSource(data), None, mtime=2.5, digest="a" * 16) is not None
+    assert deserialize_module(StringSource(data), None, mtime=1.5, bytecode_expand=True) is None
+
+def test_cache_file(tmpdir, monkeypatch):
+    source = tmpdir / "prog.rkt"
+    source.write("#lang pycket\n")
+    fname = str(source)
+    original = make_module()
+    assert load_cached_module(fname, None) is None
+    assert write_cached_module(fname, original)
+    assert os.path.exists(fname + ".ast")
+    module = load_cached_module(fname, None)
+    assert module.tostring() == original.tostring()
+
+    # touching the source keeps the cache valid as long as the content is the same
+    os.utime(fname, (0, 0))
+    assert load_cached_module(fname, None) is not None
+    # and records the new mtime, so the source is not hashed again
+    def no_digest(file_name):
+        assert False, "the source should not be hashed"
+    monkeypatch.setattr(ast_cache, "source_digest", no_digest)
+    assert load_cached_module(fname, None) is not None
+    monkeypatch.undo()
+
+    source.write("#lang pycket\n1\n")
+    assert load_cached_module(fname, None) is None
+
+def test_unsupported_literal_is_not_cached(tmpdir):
+    source = tmpdir / "prog.rkt"
+    source.write("#lang pycket\n")
+    fname = str(source)
+    w_mutable = vector.W_Vector.fromelements([values.w_true])
+    module = Module("m", [Quote(w_mutable)], {})
+    assert not write_cached_module(fname, module)
+    assert not os.path.exists(fname + ".ast")
@@ -1,6 +1,9 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import pytest
+
+from pycket.error  import SchemeException
 from pycket.values import *
 
 from pycket.test.testhelper import execute, run_fix, run
@@ -67,3 +70,33 @@ class TestConses(object):
 
         c =  W_Cons.make(W_Fixnum(1), c)
         assert c.is_proper_list()
+
+    def test_list_tail_shares_the_tail(self):
+        from pycket.prims.general import list_tail_impl
+        l = to_list([W_Fixnum(i) for i in range(5)])
+        assert list_tail_impl(l, 0) is l
+        assert list_tail_impl(l, 2) is l.cdr().cdr()
+        assert list_tail_impl(l, 5) is w_null
+        improper = W_Cons.make(W_Fixnum(1), W_Fixnum(2))
+        assert list_tail_impl(improper, 1).value == 2
+        with pytest.raises(SchemeException):
+            list_tail_impl(l, 6)
+        with pytest.raises(SchemeException):
+            list_tail_impl(l, -1)
+
+    def test_append_copies_once(self):
+        from pycket.prims.general import append
+        l1 = to_list([W_Fixnum(1), W_Fixnum(2)])
+        l2 = to_list([W_Fixnum(3)])
+        l = append([l1, l2])
+        assert [w_x.value for w_x in from_list(l)] == [1, 2, 3]
+        assert l.cdr().cdr() is l2
+        assert l is not l1 and l1.cdr().cdr() is w_null
+        assert append([w_null, l2]) is l2
+
+    def test_append_improper_tail(self):
+        from pycket.prims.general import append
+        l = append([to_list([W_Fixnum(1), W_Fixnum(2)]), W_Fixnum(3)])
+        assert not l.is_proper_list()
+        assert not l.cdr().is_proper_list()
+        assert l.cdr().cdr().value == 3
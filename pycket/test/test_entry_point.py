@@ -157,6 +157,22 @@ class TestOptions(object):
         assert names1['multiple-modules'] == f_name
         assert args1 == []
 
+    def test_log_file(self, empty_json):
+        argv = ['arg0', '--log-file', 'out.log', '--log-level', 'info@GC',
+                empty_json]
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert names['log-file'] == 'out.log'
+        assert names['log-level'] == 'info@GC'
+        assert names['file'] == empty_json
+
+    def test_server(self):
+        argv = ['arg0', '--server']
+        config, names, args, retval = parse_args(argv)
+        assert retval == 0
+        assert config['server']
+        assert 'file' not in names
+
 class TestCommandline(object):
     """These are quire similar to TestOptions but targeted at the higher level
     entry_point interface. At that point, we only have the program exit code.
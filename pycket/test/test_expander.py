@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the framing of requests to the expander server
+#
+import os
+import pytest
+
+from pycket.expander import (ExpanderServer, ExpanderError, ExpanderUnavailable,
+                             ExpanderPool, Transport, RESULT_OK, RESULT_ERROR,
+                             RESULT_LOST, spawn_server)
+
+class StringTransport(Transport):
+    """ Records what is written and replays canned responses in small
+    chunks, so that frames are split across reads. """
+    def __init__(self, responses, chunk=3):
+        self.written = ""
+        self.pending = responses
+        self.chunk = chunk
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    def read(self, size):
+        size = min(size, self.chunk)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+def frame(req_id, status, payload):
+    return "%d %s %d\n%s" % (req_id, status, len(payload), payload)
+
+def test_request_framing():
+    transport = StringTransport(frame(0, "ok", '{"module": 1}'))
+    server = ExpanderServer(transport)
+    assert server.expand("/tmp/a.rkt") == '{"module": 1}'
+    assert transport.written == "0 expand 11\n\n/tmp/a.rkt"
+
+def test_options():
+    transport = StringTransport(frame(0, "ok", "/x/b.rkt\n/x/c.rkt"))
+    server = ExpanderServer(transport)
+    assert server.expand_to("a.rkt", "a.rkt.json", srcloc=False) == ["/x/b.rkt", "/x/c.rkt"]
+    assert transport.written == "0 expand-to 26\nno-srcloc\na.rkt\na.rkt.json"
+
+def test_out_of_order_responses():
+    transport = StringTransport(frame(1, "ok", "second\n") + frame(0, "ok", "first"))
+    server = ExpanderServer(transport)
+    first = server.send("expand", "a.rkt")
+    second = server.send("expand", "b.rkt")
+    assert server.wait(first) == "first"
+    assert server.wait(second) == "second\n"
+
+def test_large_response():
+    payload = "x" * 100000
+    transport = StringTransport(frame(0, "ok", payload) + frame(1, "ok", "y"),
+                                chunk=1000)
+    server = ExpanderServer(transport)
+    assert server.expand("a.rkt") == payload
+    assert server.expand("b.rkt") == "y"
+
+def test_errors():
+    transport = StringTransport(frame(0, "error", "bad syntax"))
+    server = ExpanderServer(transport)
+    with pytest.raises(ExpanderError) as e:
+        server.expand_string("#lang racket (")
+    assert e.value.msg == "bad syntax"
+    # the connection is gone after that
+    with pytest.raises(ExpanderUnavailable):
+        server.expand("a.rkt")
+    server.close()
+    assert transport.closed
+
+def test_ping():
+    transport = StringTransport(frame(0, "ok", ""))
+    assert ExpanderServer(transport).is_alive()
+    assert transport.written == "0 ping 1\n\n"
+    # a server that is gone does not answer
+    assert not ExpanderServer(StringTransport("")).is_alive()
+
+def test_spawn_without_racket():
+    assert spawn_server("exec /nonexistent/racket --server") is None
+
+class PipeTransport(StringTransport):
+    """ Responses come through a real pipe, so the pool can wait on it """
+    def __init__(self):
+        StringTransport.__init__(self, "")
+        self.read_fd, self.write_fd = os.pipe()
+
+    def respond(self, data):
+        os.write(self.write_fd, data)
+
+    def read(self, size):
+        return os.read(self.read_fd, size)
+
+    def fileno(self):
+        return self.read_fd
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+def test_pool():
+    slow, fast = PipeTransport(), PipeTransport()
+    pool = ExpanderPool([ExpanderServer(slow), ExpanderServer(fast)])
+    assert pool.submit("expand-to", "a.rkt\na.rkt.json", "a.rkt")
+    assert pool.submit("expand-to", "b.rkt\nb.rkt.json", "b.rkt")
+    assert not pool.has_idle()
+    # whichever server the files went to, answer b.rkt first
+    b_transport = fast if "b.rkt" in fast.written else slow
+    a_transport = slow if b_transport is fast else fast
+    b_transport.respond(frame(0, "error", "bad syntax"))
+    assert pool.next_result() == ("b.rkt", RESULT_ERROR, "bad syntax")
+    assert pool.has_idle()
+    a_transport.respond(frame(0, "ok", "/x/c.rkt"))
+    assert pool.next_result() == ("a.rkt", RESULT_OK, "/x/c.rkt")
+    assert not pool.has_busy()
+    slow.close()
+    fast.close()
+
+def test_pool_with_broken_server():
+    broken, fine = PipeTransport(), PipeTransport()
+    pool = ExpanderPool([ExpanderServer(broken), ExpanderServer(fine)])
+    assert pool.submit("expand-to", "a.rkt\na.rkt.json", "a.rkt")
+    assert pool.submit("expand-to", "b.rkt\nb.rkt.json", "b.rkt")
+    tag = "a.rkt" if "a.rkt" in broken.written else "b.rkt"
+    # waiting on the descriptor fails for good
+    os.close(broken.read_fd)
+    assert pool.next_result() == (tag, RESULT_LOST, "")
+    assert pool.has_busy()
+    fine.respond(frame(0, "ok", ""))
+    assert pool.next_result()[1] == RESULT_OK
+    os.close(broken.write_fd)
+    fine.close()
+
+def test_graph_pool_grows_with_the_queue(monkeypatch):
+    from pycket import expand, expander
+    transports = [PipeTransport() for i in range(3)]
+    servers = [ExpanderServer(t) for t in transports]
+    asked = []
+    def get_expanders(count):
+        asked.append(count)
+        return servers[:count]
+    monkeypatch.setattr(expander, "get_expanders", get_expanders)
+    monkeypatch.setattr(expander, "default_jobs", lambda: 8)
+    monkeypatch.setattr(expand, "_graph_needs_expansion",
+                        lambda file_name: file_name not in expand.graph_failures)
+    # a.rkt requires b.rkt and c.rkt, which require nothing
+    transports[0].respond(frame(0, "ok", "/x/b.rkt\n/x/c.rkt") + frame(1, "ok", ""))
+    transports[1].respond(frame(0, "ok", ""))
+    expand.expand_module_graph("/x/a.rkt")
+    # one server for a.rkt, a second one once both requires are waiting
+    assert asked == [1, 2]
+    assert "a.rkt" in transports[0].written
+    assert transports[2].written == ""
+    for t in transports:
+        t.close()
@@ -0,0 +1,63 @@
+import pytest
+from pycket                 import values
+from pycket                 import formatter
+from pycket.error           import SchemeException
+
+def run_format(fmt, *vals, **kwargs):
+    port = values.W_StringOutputPort()
+    template = formatter.compile_template(fmt, "format")
+    formatter.format_to(port, template, list(vals), "format", **kwargs)
+    return port.contents()
+
+def test_format_directives(doctest):
+    """
+    > (format "~a + ~s = ~v~n" 1 2 3)
+    "1 + 2 = 3\\n"
+    > (format "~c~~" #\\x)
+    "x~"
+    > (parameterize ([error-print-width 5]) (format "~.a|~e" "abcdefgh" "ab"))
+    "ab...|ab"
+    > (format "a~   \\n   b")
+    "ab"
+    E (format "~c" 1)
+    E (format "~.x" 1)
+    """
+
+def test_templates_are_cached(monkeypatch):
+    monkeypatch.setattr(formatter, "CACHE", formatter.TemplateCache(max_size=2))
+    t1 = formatter.compile_template("~a and ~a", "format")
+    assert t1.argcount == 2
+    assert [d.kind for d in t1.directives] == [
+        formatter.VALUE, formatter.LITERAL, formatter.VALUE]
+    assert formatter.compile_template("~a and ~a", "printf") is t1
+    formatter.compile_template("x", "format")
+    formatter.compile_template("y", "format")
+    assert formatter.CACHE.size() == 2
+    assert formatter.compile_template("~a and ~a", "format") is not t1
+
+def test_format_to():
+    w_x = values.W_Symbol.make("x")
+    assert run_format("~a~%~s ~~", values.W_Fixnum(1), w_x) == "1\n'x ~"
+    assert run_format("~c!", values.W_Character(u"\u03bb")) == "\xce\xbb!"
+    assert run_format("~.a", values.W_Fixnum(123456), width=5) == "12..."
+    assert run_format("~e", values.W_Fixnum(12345), width=5) == "12345"
+    assert run_format("a~ \n  \n b") == "a\n b"
+    with pytest.raises(SchemeException):
+        run_format("~a")
+    with pytest.raises(SchemeException):
+        run_format("~a", w_x, w_x)
+    # nothing is written when an argument is wrong
+    port = values.W_StringOutputPort()
+    template = formatter.compile_template("~a~c", "printf")
+    with pytest.raises(SchemeException):
+        formatter.format_to(port, template, [w_x, w_x], "printf")
+    assert port.contents() == ""
+
+def test_error_print_width_guard():
+    from pycket.prims.input_output import error_print_width_param
+    from pycket.prims.parameter    import apply_primitive_guard
+    w_width = values.W_Fixnum(3)
+    assert apply_primitive_guard(error_print_width_param, w_width) is w_width
+    for w_bad in [values.W_Symbol.make("x"), values.W_Fixnum(2)]:
+        with pytest.raises(SchemeException):
+            apply_primitive_guard(error_print_width_param, w_bad)
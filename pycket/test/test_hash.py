@@ -545,3 +545,161 @@ def test_hash_iterate_functions(doctest):
     > (hash-iterate-next equal-table3 (hash-iterate-first equal-table3))
     #f
     """
+
+def test_immutable_equal_hash(doctest):
+    """
+    ! (define h (for/fold ([acc (hash)]) ([i (in-range 100)]) (hash-set acc (number->string i) i)))
+    ! (define h2 (hash-remove (hash-set h "7" 'seven) "8"))
+    > (hash-count h)
+    100
+    > (hash-ref h (string-append "4" "2"))
+    42
+    > (hash-ref h2 "7")
+    'seven
+    > (hash-ref h "7")
+    7
+    > (hash-ref h2 "8" #f)
+    #f
+    > (hash-count h2)
+    99
+    > (hash-ref (hash-set (hash #(1 2) 'a) (vector 3 4) 'b) (vector 1 2))
+    'a
+    """
+
+def test_immutable_equal_hash_whitebox():
+    from pycket.hash.equal import W_EqualImmutableHashTable, make_equal_immutable_table
+    from pycket.interpreter import App, ModuleVar, Quote, interpret_one
+    from pycket.vector import W_Vector
+    sym = values.W_Symbol.make
+
+    def call(name, *args):
+        prim = ModuleVar(sym(name), "#%kernel", sym(name))
+        return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+
+    def vec(*elems):
+        return W_Vector.fromelements([values.W_Fixnum(e) for e in elems], immutable=True)
+
+    table = make_equal_immutable_table([values.W_Fixnum(1), values.W_Fixnum(1)],
+                                       [sym("a"), sym("b")])
+    assert table.length() == 1
+    assert call("hash-ref", table, values.W_Fixnum(1)) is sym("b")
+
+    # vectors are unhashable, so they all end up in the same bucket
+    for i in range(10):
+        table = call("hash-set", table, vec(i, i), values.W_Fixnum(i))
+    assert isinstance(table, W_EqualImmutableHashTable)
+    assert table.length() == 11
+    assert len(table.buckets) == 2
+    assert call("hash-ref", table, vec(3, 3)).value == 3
+
+    smaller = call("hash-remove", table, vec(3, 3))
+    assert smaller.length() == 10
+    assert call("hash-ref", smaller, vec(3, 3), values.w_false) is values.w_false
+    assert call("hash-ref", table, vec(3, 3)).value == 3
+    assert call("hash-remove", smaller, vec(3, 3)) is smaller
+
+    replaced = call("hash-set", table, vec(5, 5), sym("five"))
+    assert replaced.length() == 11
+    assert call("hash-ref", replaced, vec(5, 5)) is sym("five")
+    assert call("hash-ref", table, vec(5, 5)).value == 5
+
+    keys = [table.get_item(i)[0] for i in range(table.length())]
+    assert len(keys) == 11
+    assert sorted([k.tostring() for k in keys]) == sorted([k.tostring() for k, _ in table.hash_items()])
+
+def test_weak_hash(doctest):
+    """
+    ! (define h (make-weak-hash))
+    ! (define k (list 1 2))
+    ! (hash-set! h k 'a)
+    ! (hash-set! h 3 'b)
+    > (hash-ref h (list 1 2))
+    'a
+    > (hash-count h)
+    2
+    > (hash-weak? h)
+    #t
+    > (hash-weak? (make-hash))
+    #f
+    > (hash-ref (make-weak-hasheqv '((1.0 . x))) 1.0)
+    'x
+    """
+
+def test_weak_hash_collects_keys():
+    import gc
+    from pycket.hash.weak import (W_WeakEqHashTable, W_WeakEqualHashTable,
+                                  make_weak_table)
+    from pycket.interpreter import App, ModuleVar, Quote, interpret_one
+    sym = values.W_Symbol.make
+
+    def call(name, *args):
+        prim = ModuleVar(sym(name), "#%kernel", sym(name))
+        return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+
+    for cls in [W_WeakEqHashTable, W_WeakEqualHashTable]:
+        kept = [values.W_MCons(values.W_Fixnum(i), values.w_null) for i in range(5)]
+        table = make_weak_table(cls, kept, kept)
+        for i in range(100):
+            call("hash-set!", table, values.W_MCons(values.W_Fixnum(i), values.w_null), sym("x"))
+        # fixnum keys are never collected
+        call("hash-set!", table, values.W_Fixnum(1000), sym("y"))
+        gc.collect()
+        assert len(table.hash_items()) == 6
+        table.sweep()
+        assert call("hash-count", table).value == 6
+        assert call("hash-ref", table, kept[3]) is kept[3]
+        assert call("hash-ref", table, values.W_Fixnum(1000)) is sym("y")
+        call("hash-remove!", table, kept[3])
+        assert call("hash-count", table).value == 5
+        assert sorted([v.tostring() for _, v in table.hash_items()])[0] == "'y"
+
+    # inserting new keys keeps the table proportional to the live keys
+    table = W_WeakEqHashTable()
+    for i in range(1000):
+        table._set(values.W_MCons(values.W_Fixnum(i), values.w_null), sym("x"))
+    assert len(table.entries) < 20
+
+def test_weak_hash_count_keeps_positions():
+    from pycket.hash.weak import W_WeakEqHashTable, W_WeakEqualHashTable
+    sym = values.W_Symbol.make
+    for cls in [W_WeakEqHashTable, W_WeakEqualHashTable]:
+        table = cls()
+        keys = [values.W_Fixnum(i) for i in range(5)]
+        for w_key in keys:
+            table._set(w_key, sym("x"))
+        table._remove_at(table._find(keys[1]))
+        assert table.length() == 4
+        assert len(table.entries) == 5
+        assert table.get_item(4)[0] is keys[4]
+        assert table._position_of(table.hash_code(keys[3]), keys[3]) == 3
+        assert table._position_of(table.hash_code(keys[1]), keys[1]) == -1
+
+def test_weak_hash_iterate_after_removing_first_key():
+    from pycket.hash.weak import W_WeakEqHashTable, make_weak_table
+    from pycket.interpreter import App, ModuleVar, Quote, interpret_one
+    sym = values.W_Symbol.make
+
+    def call(name, *args):
+        prim = ModuleVar(sym(name), "#%kernel", sym(name))
+        return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+
+    keys = [sym("a"), sym("b"), sym("c")]
+    table = make_weak_table(W_WeakEqHashTable, keys, keys)
+    call("hash-remove!", table, keys[0])
+    pos = call("hash-iterate-first", table)
+    assert call("hash-iterate-key", table, pos) is keys[1]
+    pos = call("hash-iterate-next", table, pos)
+    assert call("hash-iterate-key", table, pos) is keys[2]
+    assert call("hash-iterate-next", table, pos) is values.w_false
+    call("hash-remove!", table, keys[1])
+    call("hash-remove!", table, keys[2])
+    assert call("hash-iterate-first", table) is values.w_false
+
+def test_ephemeron_dead_key():
+    import gc
+    key = values.W_MCons(values.w_null, values.w_null)
+    eph = values.W_Ephemeron(key, values.W_Fixnum(1))
+    assert eph.get().value == 1
+    del key
+    gc.collect()
+    assert eph.get() is None
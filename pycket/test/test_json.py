@@ -1,6 +1,6 @@
 
 import pytest
-from pycket.pycket_json import loads
+from pycket.pycket_json import loads, JsonReader
 import json as pyjson
 
 def _compare(string, expected):
@@ -44,3 +44,72 @@ def test_bug():
             [{"quote" : { "string": "\\" }},{"quote" : { "string": "Hi" }}])
 
     _compare(r'{"string" : "\\\\"}', {"string": "\\\\"})
+
+def test_unicode_escapes():
+    _compare('"\\u00e9"', u"\xe9".encode("utf-8"))
+    _compare('"a\\u03bbb"', u"a\u03bbb".encode("utf-8"))
+    _compare('"\\ud83d\\ude00"', u"\U0001f600".encode("utf-8"))
+
+def test_numbers():
+    _compare("-12", -12)
+    _compare("1e3", 1000.0)
+    _compare("123456789012345678901234567890", 123456789012345678901234567890.0)
+    _compare("[true, false, null]", [True, False, None])
+
+def test_errors():
+    for s in ["[1, 2", "[1 2]", "{\"a\" 1}", "\"abc", "[1,]", "1 2", "tru"]:
+        with pytest.raises(ValueError):
+            loads(s)
+
+def test_reader_streaming():
+    reader = JsonReader('{"a": [1, {"skip": [2, "x]"]}, 3], "b": "c"}')
+    reader.start_object()
+    assert reader.next_key() == "a"
+    reader.start_array()
+    assert reader.next_element()
+    assert reader.read_value()._unpack_deep() == 1
+    assert reader.next_element()
+    reader.skip_value()
+    assert reader.next_element()
+    assert reader.read_value()._unpack_deep() == 3
+    assert not reader.next_element()
+    assert reader.next_key() == "b"
+    assert reader.read_string() == "c"
+    assert reader.next_key() is None
+    assert reader.at_end()
+
+def test_reader_interns_strings():
+    json = loads('[{"lexical": "x"}, {"lexical": "x"}]')
+    first, second = json.value_array()
+    assert first.value_object()["lexical"].value_string() is second.value_object()["lexical"].value_string()
+
+def test_read_module():
+    from pycket.expand import JsonLoader
+    s = ('{"body-forms": [{"define-values": ["x"], "define-values-names": ["x"],'
+         '                 "define-values-body": {"quote": {"number": {"integer": "42"}}}}],'
+         ' "module-name": "m", "language": ["#%kernel"], "config": {"k": "v"}}')
+    streamed = JsonLoader().read_module(JsonReader(s))
+    tree = JsonLoader().to_module(loads(s))
+    assert streamed.tostring() == tree.tostring() == "(module m (define-values [x] 42))"
+    assert streamed.config == tree.config == {"k": "v"}
+
+def test_module_map(tmpdir):
+    from pycket.expand import JsonLoader, ModuleMap
+    a = ('{"module-name": "a", "language": ["#%kernel"],'
+         ' "body-forms": [{"quote": {"number": {"integer": "1"}}}]}')
+    b = '{"module-name": "b", "language": ["#%kernel"], "body-forms": []}'
+    index = "0 %d /x/a.rkt\n%d %d /x/b c.rkt\n" % (len(a), len(a), len(b))
+    bundle = tmpdir / "bundle.json"
+    bundle.write("pycket-bundle 1 2\n" + index + a + b + "\n")
+    # the format written before bundles were indexed
+    plain = tmpdir / "plain.json"
+    plain.write('{"/x/a.rkt": %s, "/x/b c.rkt": %s}\n' % (a, b))
+    for f in [bundle, plain]:
+        mod_map = ModuleMap(str(f))
+        mod = JsonLoader().read_module(mod_map.get_mod("/x/b c.rkt"))
+        assert mod.tostring() == "(module b )"
+        mod = JsonLoader().read_module(mod_map.get_mod("/x/a.rkt"))
+        assert mod.tostring() == "(module a 1)"
+        with pytest.raises(ValueError):
+            mod_map.get_mod("/x/c.rkt")
+        mod_map.close()
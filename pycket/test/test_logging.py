@@ -0,0 +1,95 @@
+import pytest
+from pycket                 import values, values_logger, values_string
+from pycket.values_logger   import W_Logger, W_LogReceiver, LevelFilter
+from pycket.error           import SchemeException
+from pycket.interpreter     import App, ModuleVar, Quote, interpret_one
+
+sym = values.W_Symbol.make
+
+def call(name, *args):
+    prim = ModuleVar(sym(name), "#%kernel", sym(name))
+    return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+
+def string(s):
+    return values_string.W_String.fromstr_utf8(s)
+
+def test_log_receiver(doctest):
+    """
+    ! (define l (make-logger 'app))
+    ! (define r (make-log-receiver l 'info))
+    > (log-level? l 'info)
+    #t
+    > (log-level? l 'debug)
+    #f
+    > (log-max-level l)
+    'info
+    > (begin (log-message l 'info "hello" 42) (sync r))
+    '#(info "app: hello" 42 app)
+    > (begin (log-message l 'debug "dropped" 0) (log-message l 'error 'db "x" 1 #f) (sync r))
+    '#(error "x" 1 db)
+    > (sync/timeout 0 r)
+    #f
+    > (log-receiver? r)
+    #t
+    """
+
+def test_levels_are_cached():
+    w_root = W_Logger(values.w_false, None, values_logger.ALL_LEVELS)
+    w_child = W_Logger(sym("child"), w_root,
+                       LevelFilter([], [], values_logger.WARNING))
+    assert w_child.max_level() == values_logger.NONE
+    version = values_logger.state.version
+    assert w_child.cached_version is version
+    assert not w_child.is_level(values_logger.FATAL, values.w_false)
+
+    w_root.add_receiver(values_logger.QueueReceiver(
+        LevelFilter([sym("db")], [values_logger.DEBUG], values_logger.ERROR)))
+    assert values_logger.state.version is not version
+    # propagation to the parent stops after warning
+    assert w_child.max_level() == values_logger.WARNING
+    assert w_root.max_level() == values_logger.DEBUG
+    assert w_child.is_level(values_logger.WARNING, sym("db"))
+    assert not w_child.is_level(values_logger.WARNING, sym("web"))
+    assert w_root.is_level(values_logger.DEBUG, sym("db"))
+    assert not w_root.is_level(values_logger.DEBUG, values.w_false)
+
+def test_ring_buffer():
+    w_logger = call("make-logger")
+    w_receiver = W_LogReceiver(LevelFilter([], [], values_logger.DEBUG), 3)
+    w_logger.add_receiver(w_receiver.receiver)
+    for i in range(5):
+        call("log-message", w_logger, sym("info"), string("m%d" % i),
+             values.W_Fixnum(i))
+    # the oldest events were dropped
+    for i in range(2, 5):
+        w_event = w_receiver.try_sync()
+        assert w_event.ref(2).value == i
+    assert w_receiver.try_sync() is None
+
+def test_bad_arguments():
+    with pytest.raises(SchemeException):
+        values_logger.level_from_symbol(sym("verbose"), "log-level?")
+    with pytest.raises(SchemeException):
+        values_logger.parse_filter([sym("info"), values.W_Fixnum(1)],
+                                   "make-log-receiver")
+
+def test_file_receiver(tmpdir, monkeypatch):
+    monkeypatch.setattr(values_logger.FileReceiver, "BATCH_SIZE", 20)
+    path = str(tmpdir.join("log.txt"))
+    w_logger = W_Logger(values.w_false, None, values_logger.ALL_LEVELS)
+    w_logger.add_receiver(values_logger.FileReceiver(
+        values_logger.parse_spec("error info@db"), path))
+    w_logger.log(values_logger.INFO, sym("db"), string("db: query"), values.w_false)
+    w_logger.log(values_logger.INFO, sym("web"), string("web: get"), values.w_false)
+    receiver = w_logger.receivers[0]
+    # written once a batch is full
+    assert not tmpdir.join("log.txt").check()
+    w_logger.log(values_logger.ERROR, sym("web"), string("web: fail"), values.w_false)
+    receiver.flush()
+    assert tmpdir.join("log.txt").read() == "db: query\nweb: fail\n"
+
+def test_parse_spec():
+    filter = values_logger.parse_spec("  warning debug@GC ")
+    assert filter.default == values_logger.WARNING
+    assert filter.level_for(sym("GC")) == values_logger.DEBUG
+    assert values_logger.parse_spec("loud") is None
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the AST optimizer
+#
+from pycket                import config, values
+from pycket.expand         import convert_module
+from pycket.interpreter    import *
+from pycket.optimizer      import PURE_PRIMITIVES, optimize_module
+from pycket.prims.expose   import prim_env
+from pycket.test.testhelper import (define, local, num, prim, procedure,
+                                    run_module, sym)
+
+def optimized(*body):
+    module = Context.normalize_term(Module("m", list(body), {}))
+    return optimize_module(module)
+
+def rhs(module, i):
+    form = module.body[i]
+    assert isinstance(form, DefineValues)
+    return form.rhs
+
+def test_pure_primitives_can_be_folded():
+    for w_name in PURE_PRIMITIVES:
+        w_prim = prim_env[w_name]
+        assert isinstance(w_prim, values.W_Prim)
+        assert w_prim.simple_func is not None
+
+def test_fold_primitives():
+    module = optimized(define("x", App.make(prim("+"), [num(1), num(2), num(3)])),
+                       define("y", App.make(prim("car"), [Quote(values.w_null)])))
+    x = rhs(module, 0)
+    assert isinstance(x, Quote) and x.w_val.value == 6
+    # errors are left to the run time
+    assert not isinstance(rhs(module, 1), Quote)
+
+def test_constant_branch():
+    test = App.make(prim("<"), [num(1), num(2)])
+    module = optimized(define("x", If(test, Quote(sym("a")), Quote(sym("b")))))
+    x = rhs(module, 0)
+    assert isinstance(x, Quote) and x.w_val is sym("a")
+
+def test_inline_and_fold():
+    a = sym("a")
+    module = optimized(
+        define("f", procedure(["a"], [App.make(prim("+"), [LexicalVar(a), num(1)])])),
+        define("x", App.make(local("f"), [num(41)])))
+    x = rhs(module, 1)
+    assert isinstance(x, Quote) and x.w_val.value == 42
+    assert run_module(module).defs[sym("x")].value == 42
+
+def test_inline_renames_variables():
+    a, b, n = sym("a"), sym("b"), sym("n")
+    body = [make_let([[b]], [App.make(prim("car"), [LexicalVar(a)])],
+                     [App.make(prim("cons"), [LexicalVar(b), LexicalVar(b)])])]
+    module = optimized(
+        define("f", procedure(["a"], body)),
+        define("x", make_let([[b]], [Quote(values.to_list([num(1).w_val]))],
+                             [App.make(local("f"), [LexicalVar(b)])])))
+    x = rhs(module, 1)
+    assert "(f " not in x.tostring()
+    w_x = run_module(module).defs[sym("x")]
+    assert w_x.car().value == 1 and w_x.cdr().value == 1
+
+def test_recursive_procedures_are_not_inlined():
+    n = sym("n")
+    module = optimized(
+        define("loop", procedure(["n"], [App.make(local("loop"), [LexicalVar(n)])])),
+        define("x", App.make(local("loop"), [num(1)])))
+    x = rhs(module, 1)
+    assert isinstance(x, App) and x.rator.srcsym is sym("loop")
+
+def test_mutated_procedures_are_not_inlined():
+    module = optimized(
+        define("f", procedure([], [num(1)])),
+        SetBang(local("f"), procedure([], [num(2)])),
+        define("x", App.make(local("f"), [])))
+    assert isinstance(rhs(module, 2), App)
+
+def test_calls_before_the_definition_are_not_inlined():
+    module = optimized(
+        define("x", App.make(local("f"), [])),
+        define("f", procedure([], [num(1)])))
+    assert isinstance(rhs(module, 0), App)
+
+def test_size_budget(monkeypatch):
+    a = sym("a")
+    body = [App.make(prim("+"), [LexicalVar(a)] * 10)]
+    monkeypatch.setattr(config, "inline_size", 5)
+    module = optimized(define("f", procedure(["a"], body)),
+                       define("x", App.make(local("f"), [num(1)])))
+    assert isinstance(rhs(module, 1), App)
+
+def test_dead_bindings():
+    a, b = sym("a"), sym("b")
+    let = make_let([[a], [b]], [num(1), prim("car")],
+                   [App.make(prim("display"), [Quote(values.w_void)])])
+    module = optimized(define("x", let))
+    assert not isinstance(rhs(module, 0), Let)
+
+def test_switch(monkeypatch):
+    module = Context.normalize_term(
+        Module("m", [define("x", App.make(prim("+"), [num(1), num(2)]))], {}))
+    monkeypatch.setattr(config, "ast_optimizer", False)
+    module = convert_module(module)
+    assert not isinstance(rhs(module, 0), Quote)
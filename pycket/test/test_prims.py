@@ -184,6 +184,59 @@ def test_random():
 def test_random_seed():
     run("(begin (random-seed 142) (let ((x (random))) (random-seed 142) (= (random) x)))", w_true)
 
+def test_pseudo_random_generators(doctest):
+    """
+    ! (define g (make-pseudo-random-generator))
+    ! (define v (pseudo-random-generator->vector g))
+    ! (define xs (for/list ([i 5]) (random 100 g)))
+    > (pseudo-random-generator-vector? v)
+    #t
+    > (equal? xs (for/list ([i 5]) (random 100 (vector->pseudo-random-generator v))))
+    #t
+    > (parameterize ([current-pseudo-random-generator (vector->pseudo-random-generator v)])
+        (equal? xs (for/list ([i 5]) (random 100))))
+    #t
+    > (let ([r (random 10 20 g)]) (and (<= 10 r) (< r 20)))
+    #t
+    > (pseudo-random-generator-vector? (vector 0 0 0 1 1 1))
+    #f
+    """
+
+def test_random_generator_state():
+    from pycket.prims.random import vector_state
+    gen = values.W_PseudoRandomGenerator(42)
+    state = gen.get_state()
+    xs = [gen.random_int(1000) for i in range(100)]
+    assert all([0 <= x < 1000 for x in xs])
+    assert len(set(xs)) > 50
+    other = values.W_PseudoRandomGenerator()
+    other.set_state(state)
+    assert [other.random_int(1000) for i in range(100)] == xs
+    for i in range(100):
+        assert 0.0 < gen.random() < 1.0
+    # the first output of MRG32k3a seeded with 12345 everywhere
+    ref = values.W_PseudoRandomGenerator()
+    ref.set_state([12345.0] * 6)
+    x = ref.next_value()
+    assert x == 545508589.0
+    assert vector_state(values.w_null) is None
+
+def test_random_fill():
+    from pycket import vector as values_vector
+    from pycket.interpreter import App, ModuleVar, Quote, interpret_one
+    def call(name, *args):
+        sym = values.W_Symbol.make(name)
+        prim = ModuleVar(sym, "#%kernel", sym)
+        return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+    gen = values.W_PseudoRandomGenerator(7)
+    flv = values_vector.W_FlVector.fromelement(values.W_Flonum(0.0), 50)
+    assert call("flrandom-fill!", flv, gen) is flv
+    assert all([0.0 < flv.ref(i).value < 1.0 for i in range(50)])
+    vec = values_vector.W_Vector.fromelement(values.w_false, 50)
+    call("random-fill!", vec, values.W_Fixnum(6), gen)
+    assert vec.get_strategy() is values_vector.FixnumVectorStrategy.singleton
+    assert set([vec.ref(i).value for i in range(50)]) == set(range(6))
+
 #############################################################################
 def test_byte_huh(doctest):
     """
@@ -670,6 +723,80 @@ def test_peek_bug(tmpdir):
     assert c == ''
     w_p.close()
 
+def test_port_count_lines(doctest):
+    r"""
+    ! (define sp (open-input-string "ab\nc\u03BBd e"))
+    ! (port-count-lines! sp)
+    ! (read-line sp)
+    ! (read-char sp)
+    ! (read-char sp)
+    > (call-with-values (lambda () (port-next-location sp)) list)
+    '(2 2 6)
+    > (read sp)
+    'd
+    > (call-with-values (lambda () (port-next-location sp)) list)
+    '(2 3 7)
+    > (call-with-values (lambda () (port-next-location (open-input-string "x"))) list)
+    '(#f #f 1)
+    """
+
+def test_buffered_file_port(tmpdir, monkeypatch):
+    from pycket.prims.input_output import open_infile, read_stream
+    from pycket import values_string
+    monkeypatch.setattr(values.W_FileInputPort, "BLOCK_SIZE", 3)
+    s = "(define (f x) ; comment\n  \"str\\\"ing\")\n\xce\xbb\n123 abc"
+    f = tmpdir.join("example.rkt")
+    f.write(s, mode="wb")
+    w_n = values_string.W_String.fromstr_utf8(str(f))
+    w_p = open_infile(w_n, "r")
+    w_p.count_lines()
+    w_datum = read_stream(w_p)
+    items = values.from_list(w_datum)
+    assert values.to_list(items[:2]).tostring() == "('define ('f 'x))"
+    assert items[2].as_str_utf8() == 'str"ing'
+    assert w_p.tell() == s.index("\n\xce")
+    assert w_p.next_location() == (2, 13, 38)
+    assert w_p.readline() == "\n"
+    # a character split over two blocks
+    assert w_p.read_char(peek=True) == u"\u03bb"
+    assert w_p.read_char() == u"\u03bb"
+    assert w_p.next_location() == (3, 1, 40)
+    assert w_p.read_char(peek=True, skip=1) == u"1"
+    assert read_stream(w_p).tostring() == "123"
+    # put back more than the buffer holds
+    w_p.unread("x\n123")
+    assert w_p.next_location() == (3, 0, 39)
+    assert w_p.read(2) == "x\n"
+    assert w_p.readline() == "123 abc"
+    assert w_p.next_location() == (4, 7, 48)
+    assert w_p.read_char() is None
+    assert read_stream(w_p) is values.eof_object
+    w_p.close()
+
+def test_file_port_long_lines(tmpdir, monkeypatch):
+    from pycket.prims.input_output import open_infile
+    from pycket import values_string
+    monkeypatch.setattr(values.W_FileInputPort, "BLOCK_SIZE", 3)
+    line = "x" * 100 + "\n"
+    f = tmpdir.join("lines.txt")
+    f.write(line * 2 + "end", mode="wb")
+    w_p = open_infile(values_string.W_String.fromstr_utf8(str(f)), "r")
+    # the blocks of a long stretch of input are joined once
+    appends = []
+    append_blocks = w_p._append_blocks
+    def counting_append_blocks(blocks):
+        appends.append(len(blocks))
+        append_blocks(blocks)
+    monkeypatch.setattr(w_p, "_append_blocks", counting_append_blocks)
+    assert w_p.readline() == line
+    assert appends == [34]
+    assert w_p.ensure(1000) == len(line) + len("end")
+    assert len(appends) == 2
+    assert w_p.read(101) == line
+    assert w_p.readline() == "end"
+    assert w_p.readline() == ""
+    w_p.close()
+
 def test_listp(doctest):
     """
     > (list? '(1 2))
@@ -822,6 +949,62 @@ def test_dynamic_wind4():
     equal = m.defs[values.W_Symbol.make("equal")]
     assert equal is values.w_true
 
+def test_parameterization_cache():
+    from pycket.cont import Cont, NilCont
+    from pycket.values_parameter import top_level_config
+    class Frame(Cont):
+        def _clone(self):
+            return Frame(self.env, self.prev)
+    key = values.parameterization_key
+    cont = NilCont()
+    cont.update_cm(key, top_level_config)
+    frames = []
+    for i in range(100):
+        cont = Frame(None, cont)
+        cont.update_cm(values.W_Symbol.make("k"), values.W_Fixnum(i))
+        frames.append(cont)
+    assert frames[-1].get_parameterization() is top_level_config
+    # the lookup filled the cache all the way up
+    assert frames[-1].marks.next.paramz is top_level_config
+    assert frames[0].marks.next.paramz is top_level_config
+
+    paramz = top_level_config.extend([], [])
+    frames[50].update_cm(key, paramz)
+    for frame in frames:
+        assert frame.get_parameterization() is frame.get_mark_first(key)
+    assert frames[-1].get_parameterization() is paramz
+    assert frames[49].get_parameterization() is top_level_config
+    # continuations cloned on capture share the ForwardLinks
+    clone = frames[-1].clone()
+    assert clone.get_parameterization() is paramz
+
+def test_parameterize_in_deep_recursion():
+    from pycket.cont import Cont, NilCont, paramz_epoch
+    from pycket.values_parameter import top_level_config
+    class Frame(Cont):
+        def _clone(self):
+            return Frame(self.env, self.prev)
+    key = values.parameterization_key
+    cont = NilCont()
+    cont.update_cm(key, top_level_config)
+    for i in range(1000):
+        cont = Frame(None, cont)
+        cont.update_cm(values.W_Symbol.make("k"), values.W_Fixnum(i))
+    bottom = cont
+    assert bottom.get_parameterization() is top_level_config
+    epoch = paramz_epoch.value
+    for i in range(10):
+        # what with-continuation-mark does for a parameterize at the bottom
+        paramz = top_level_config.extend([], [])
+        inner = bottom.clone()
+        inner.update_cm(key, paramz)
+        body = Frame(None, inner)
+        assert body.get_parameterization() is paramz
+        # the lookups below the parameterize stay cached
+        assert paramz_epoch.value == epoch
+        assert bottom.marks.next.paramz_epoch == epoch
+        assert bottom.get_parameterization() is top_level_config
+
 def test_bytes_conversions():
     m = run_mod(
     """
@@ -0,0 +1,79 @@
+from pycket                 import values
+from pycket                 import vector as values_vector
+from pycket.printer         import print_to_port, tostring, CHUNK_SIZE
+
+def fix(n):
+    return values.W_Fixnum(n)
+
+def lst(*items):
+    return values.to_list(list(items))
+
+def test_print_graph(doctest):
+    """
+    ! (define v (vector 1 2))
+    ! (vector-set! v 1 v)
+    ! (define b (box 0))
+    ! (define l (list b b))
+    > (format "~a" v)
+    "#0=#(1 #0#)"
+    > (format "~a" l)
+    "('#&0 '#&0)"
+    > (parameterize ([print-graph #t]) (format "~a" l))
+    "(#0='#&0 #0#)"
+    """
+
+def test_same_as_tostring():
+    sym = values.W_Symbol.make
+    w_values = [
+        lst(fix(1), lst(fix(2), fix(3)), values.w_null),
+        values.W_Cons.make(fix(1), values.W_Cons.make(fix(2), fix(3))),
+        values.W_MCons(fix(1), lst(sym("a"))),
+        values.W_MBox(values.W_IBox(values.W_Flonum(1.5))),
+        values_vector.W_Vector.fromelements([fix(1), lst(), values.w_true]),
+        values_vector.W_Vector.fromelements([]),
+        fix(42),
+    ]
+    for w_value in w_values:
+        assert tostring(w_value) == w_value.tostring()
+
+def test_print_in_chunks():
+    class Port(values.W_OutputPort):
+        def __init__(self):
+            self.chunks = []
+        def write(self, s):
+            self.chunks.append(s)
+    w_list = values.to_list([fix(i) for i in range(10000)])
+    port = Port()
+    print_to_port(w_list, port)
+    assert len(port.chunks) > 1
+    assert max([len(s) for s in port.chunks]) < 2 * CHUNK_SIZE
+    assert "".join(port.chunks) == w_list.tostring()
+
+def test_deep_nesting():
+    w_value = values.w_null
+    for i in range(100000):
+        w_value = values.W_Cons.make(w_value, values.w_null)
+    s = tostring(w_value)
+    assert s == "(" * 100001 + ")" * 100001
+
+def test_cycles():
+    w_mcons = values.W_MCons(fix(1), values.w_null)
+    w_mcons._cdr = w_mcons
+    assert tostring(w_mcons) == "#0=(mcons 1 #0#)"
+
+    w_box = values.W_MBox(values.w_false)
+    w_vector = values_vector.W_Vector.fromelements([fix(1), w_box])
+    w_box.value = lst(w_vector)
+    assert tostring(w_vector) == "#0=#(1 '#&(#0#))"
+
+    # a cycle through the tail of a list
+    w_cons = values.W_WrappedConsMaybe(fix(1), values.w_null)
+    w_cons._cdr = values.W_Cons.make(fix(2), w_cons)
+    assert tostring(w_cons) == "#0=(1 2 . #0#)"
+
+def test_sharing():
+    w_shared = lst(fix(1), fix(2))
+    w_value = lst(values.W_Cons.make(fix(0), w_shared),
+                  values.W_Cons.make(fix(5), w_shared))
+    assert tostring(w_value) == "((0 1 2) (5 1 2))"
+    assert tostring(w_value, graph=True) == "((0 . #0=(1 2)) (5 . #0#))"
@@ -127,6 +127,56 @@ def test_regex_match_port(doctest):
     #\x
     """
 
+def test_regex_match_positions_port(doctest):
+    r"""
+    ! (define s (open-input-string "xxhello world"))
+    > (read-char s)
+    #\x
+    > (regexp-match-positions #rx"o (w)" s)
+    '((5 . 8) (7 . 8))
+    > (read-char s)
+    #\o
+    > (regexp-match-positions #rx"z" s)
+    #f
+    > (eof-object? (read-char s))
+    #t
+    """
+
+def test_regex_match_pipe():
+    import os
+    from rpython.rlib import streamio
+    from pycket import values, values_regex
+
+    def pipe_port(data):
+        r, w = os.pipe()
+        os.write(w, data)
+        os.close(w)
+        return values.W_FileInputPort(streamio.fdopen_as_stream(r, "r"))
+
+    old_size = values_regex.PortBuffer.BLOCK_SIZE
+    values_regex.PortBuffer.BLOCK_SIZE = 4
+    try:
+        # matches spanning several blocks, only the match is consumed
+        port = pipe_port("xxxxxxxxxxabcabcdef tail")
+        assert values_regex.W_Regexp("(abc)+d").match_port(port) == ["abcabcd", "abc"]
+        assert port.read(100) == "ef tail"
+        port = pipe_port("hello world")
+        assert values_regex.W_Regexp("o w").match_port_positions(port) == [(4, 7)]
+        assert port.readline() == "orld"
+        # end of input assertions hold once the pipe is exhausted
+        assert values_regex.W_Regexp("a+$").match_port(pipe_port("baaaaaaaaab")) is None
+        assert values_regex.W_Regexp("a+$").match_port(pipe_port("baaaaaaaaa")) == ["aaaaaaaaa"]
+        # start and end limit the search
+        port = pipe_port("0123456789")
+        assert values_regex.W_Regexp("[0-9]+").match_port_positions(port, 3, 8) == [(3, 8)]
+        assert port.read(100) == "89"
+        # without a match, everything searched is consumed
+        port = pipe_port("hello")
+        assert values_regex.W_Regexp("z").match_port(port) is None
+        assert port.read(100) == ""
+    finally:
+        values_regex.PortBuffer.BLOCK_SIZE = old_size
+
 def test_regex_result_types(doctest):
     r"""
     > (regexp-match #rx"a" "bca")
@@ -220,3 +270,31 @@ def test_regexp_replace_star(doctest):
     #t
     """
 
+
+def test_regexp_cache_stats(doctest):
+    """
+    ! (define before (regexp-cache-stats))
+    > (regexp-match (regexp (string-append "ca" "che")) "a cache")
+    '("cache")
+    > (regexp-match (regexp (string-append "ca" "che")) "a cache")
+    '("cache")
+    > (>= (- (vector-ref (regexp-cache-stats) 0) (vector-ref before 0)) 1)
+    #t
+    > (vector-length before)
+    5
+    """
+
+def test_regexp_cache_eviction():
+    from pycket.regexp import RegexpCache, compile
+    cache = RegexpCache(max_size=2)
+    a = compile(cache, "a", 0, 0)
+    b = compile(cache, "b", 0, 0)
+    assert compile(cache, "a", 0, 0) is a
+    # b is the least recently used and gets evicted
+    compile(cache, "c", 0, 0)
+    assert cache.size() == 2
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+    assert compile(cache, "a", 0, 0) is a
+    assert compile(cache, "b", 0, 0) is not b
+    # the kind of regexp is part of the key
+    assert compile(cache, "b", 0, 1) is not compile(cache, "b", 0, 0)
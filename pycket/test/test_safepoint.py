@@ -0,0 +1,56 @@
+from pycket                 import safepoint, values
+from pycket.interpreter     import App, ModuleVar, Quote, interpret_one
+
+class Recorder(safepoint.SafepointHandler):
+    """ Captures the continuation at every safepoint """
+    def __init__(self):
+        self.states = []
+
+    def safepoint(self, ast, env, cont):
+        self.states.append((ast, env, cont))
+        return ast, env, cont
+
+class Replacer(safepoint.SafepointHandler):
+    def safepoint(self, ast, env, cont):
+        return "ast", "env", "cont"
+
+def test_inactive_without_handlers():
+    safepoints = safepoint.Safepoints(interval=2)
+    assert not safepoints.tick()
+    safepoints.count()
+    assert safepoints.fuel == 2
+
+def test_handlers_run_after_interval():
+    safepoints = safepoint.Safepoints(interval=3)
+    recorder = Recorder()
+    safepoints.register(recorder)
+    safepoints.register(recorder)
+    assert safepoints.handlers == [recorder]
+    safepoints.count()
+    assert not safepoints.tick()
+    assert safepoints.tick()
+    state = safepoints.run_handlers("ast", "env", "cont")
+    assert state == ("ast", "env", "cont")
+    assert recorder.states == [state]
+    assert safepoints.fuel == 3
+    safepoints.unregister(recorder)
+    assert not safepoints.active
+    assert not safepoints.tick()
+
+def test_handlers_can_switch_the_state():
+    safepoints = safepoint.Safepoints()
+    recorder = Recorder()
+    safepoints.register(Replacer())
+    safepoints.register(recorder)
+    assert safepoints.run_handlers(1, 2, 3) == ("ast", "env", "cont")
+    # the later handlers see the state the earlier ones returned
+    assert recorder.states == [("ast", "env", "cont")]
+
+def test_applications_count(monkeypatch):
+    safepoints = safepoint.Safepoints(interval=100)
+    monkeypatch.setattr(safepoint, "safepoints", safepoints)
+    safepoints.register(Recorder())
+    sym = values.W_Symbol.make
+    prim = ModuleVar(sym("list"), "#%kernel", sym("list"))
+    interpret_one(App.make(prim, [Quote(values.W_Fixnum(1))]))
+    assert safepoints.fuel == 99
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Tests for the server mode
+#
+import pytest
+
+from pycket                import values, values_thread
+from pycket.assign_convert import assign_convert
+from pycket.env            import ToplevelEnv
+from pycket.expand         import JsonLoader
+from pycket.interpreter    import *
+from pycket.server         import (ProtocolError, Server, read_request,
+                                   write_response)
+from pycket.test.testhelper import prim, sym
+
+class ModuleLoader(object):
+    """ Loads a new copy of a module that displays the number it reads and
+    the number of its arguments, or of one that fails """
+    def __init__(self):
+        self.loaded = 0
+        self.last = None
+
+    def expand_file_cached(self, fname):
+        self.loaded += 1
+        x = sym("x")
+        if fname.endswith("fail.rkt"):
+            body = [App.make(prim("no-such-primitive"), [])]
+        elif fname.endswith("missing.rkt"):
+            raise ValueError("Cannot access file %s" % fname)
+        elif fname.endswith("thread.rkt"):
+            # (thread (lambda () (display 9)))
+            thunk = CaseLambda([make_lambda([], None,
+                                            [App.make(prim("display"),
+                                                      [Quote(values.W_Fixnum(9))])])])
+            body = [App.make(prim("thread"), [thunk])]
+        elif fname.endswith("blocked.rkt"):
+            # (define started (make-semaphore 0))
+            # (define blocked (make-semaphore 0))
+            # (define t (thread (lambda () (semaphore-post started)
+            #                              (semaphore-wait blocked)
+            #                              (display 9))))
+            # (semaphore-wait started)
+            started, blocked, t = sym("started"), sym("blocked"), sym("t")
+            zero = Quote(values.W_Fixnum(0))
+            thunk = CaseLambda([make_lambda([], None, [
+                App.make(prim("semaphore-post"), [ModuleVar(started, None, started)]),
+                App.make(prim("semaphore-wait"), [ModuleVar(blocked, None, blocked)]),
+                App.make(prim("display"), [Quote(values.W_Fixnum(9))])])])
+            body = [DefineValues([started], App.make(prim("make-semaphore"), [zero]), [started]),
+                    DefineValues([blocked], App.make(prim("make-semaphore"), [zero]), [blocked]),
+                    DefineValues([t], App.make(prim("thread"), [thunk]), [t]),
+                    App.make(prim("semaphore-wait"), [ModuleVar(started, None, started)])]
+        else:
+            body = [DefineValues([x], App.make(prim("read"), []), [x]),
+                    App.make(prim("display"), [ModuleVar(x, None, x)]),
+                    App.make(prim("display"),
+                             [App.make(prim("vector-length"),
+                                       [App.make(prim("current-command-line-arguments"), [])])])]
+        module = assign_convert(Context.normalize_term(Module("m", body, {})))
+        self.last = module
+        return module
+
+def requests(text):
+    return values.W_StringInputPort(text)
+
+def test_read_request():
+    port = requests("run /tmp/a.rkt\n2\n-v\nx y\n5\nhello")
+    request = read_request(port)
+    assert request.path == "/tmp/a.rkt"
+    assert request.args == ["-v", "x y"]
+    assert request.payload == "hello"
+    assert read_request(port) is None
+
+def test_malformed_requests():
+    for text in ["go /tmp/a.rkt\n", "run a.rkt\n", "run a.rkt\nx\n",
+                 "run a.rkt\n1\n", "run a.rkt\n0\n10\nshort"]:
+        with pytest.raises(ProtocolError):
+            read_request(requests(text))
+
+def test_write_response():
+    port = values.W_StringOutputPort()
+    write_response(port, "ok", "42\n")
+    assert port.contents() == "ok 3\n42\n"
+
+def test_serve():
+    loader = ModuleLoader()
+    out = values.W_StringOutputPort()
+    server = Server(loader, ToplevelEnv(),
+                    requests("run /tmp/a.rkt\n1\nx\n3\n41\n"
+                             "run /tmp/a.rkt\n0\n2\n7\n"),
+                    out)
+    assert server.serve() == 2
+    assert out.contents() == "ok 3\n411ok 2\n70"
+    # the main module is loaded again for every request
+    assert loader.loaded == 2
+
+def test_error_response():
+    out = values.W_StringOutputPort()
+    server = Server(ModuleLoader(), ToplevelEnv(),
+                    requests("run /tmp/fail.rkt\n0\n0\nrun /tmp/a.rkt\n0\n2\n5\n"),
+                    out)
+    assert server.serve() == 2
+    contents = out.contents()
+    assert contents.startswith("error ")
+    assert "ERROR:" in contents
+    assert contents.endswith("ok 2\n50")
+
+def test_protocol_error_skips_to_the_next_request():
+    out = values.W_StringOutputPort()
+    server = Server(ModuleLoader(), ToplevelEnv(), requests("hello\n"), out)
+    assert server.serve() == 0
+    assert out.contents().startswith("error ")
+    out = values.W_StringOutputPort()
+    server = Server(ModuleLoader(), ToplevelEnv(),
+                    requests("hello\nworld\nrun a.rkt\nx\nrun /tmp/a.rkt\n0\n2\n5\n"),
+                    out)
+    assert server.serve() == 1
+    contents = out.contents()
+    assert contents.count("error ") == 2
+    assert contents.endswith("ok 2\n50")
+
+def test_unreadable_module():
+    out = values.W_StringOutputPort()
+    server = Server(ModuleLoader(), ToplevelEnv(),
+                    requests("run /tmp/missing.rkt\n0\n0\nrun /tmp/a.rkt\n0\n2\n5\n"),
+                    out)
+    assert server.serve() == 2
+    contents = out.contents()
+    assert contents.startswith("error ")
+    assert "/tmp/missing.rkt" in contents
+    assert contents.endswith("ok 2\n50")
+
+def test_missing_file_with_json_loader(tmpdir):
+    out = values.W_StringOutputPort()
+    path = str(tmpdir / "missing.rkt")
+    server = Server(JsonLoader(), ToplevelEnv(),
+                    requests("run %s\n0\n0\n" % path), out)
+    assert server.serve() == 1
+    assert out.contents().startswith("error ")
+
+def test_expansion_messages_go_to_stderr(tmpdir, capfd):
+    source = tmpdir / "prog.rkt"
+    source.write("#lang pycket\n(display 1)\n")
+    out = values.W_StringOutputPort()
+    server = Server(JsonLoader(), ToplevelEnv(),
+                    requests("run %s\n0\n0\n" % source), out)
+    assert server.serve() == 1
+    stdout, stderr = capfd.readouterr()
+    assert stdout == ""
+    assert "Expanding %s" % source in stderr
+    # racket is not needed for this test, expanding may fail
+    assert out.contents().split(" ")[0] in ["ok", "error"]
+
+def test_threads_do_not_outlive_their_request():
+    scheduler = values_thread.get_scheduler()
+    out = values.W_StringOutputPort()
+    server = Server(ModuleLoader(), ToplevelEnv(),
+                    requests("run /tmp/thread.rkt\n0\n0\nrun /tmp/a.rkt\n0\n2\n5\n"),
+                    out)
+    assert server.serve() == 2
+    assert out.contents().endswith("ok 2\n50")
+    assert scheduler.runnable == []
+    assert scheduler.sleepers == []
+    assert scheduler.current is scheduler.main
+
+def test_blocked_threads_do_not_outlive_their_request():
+    loader = ModuleLoader()
+    out = values.W_StringOutputPort()
+    server = Server(loader, ToplevelEnv(), requests("run /tmp/blocked.rkt\n0\n0\n"), out)
+    assert server.serve() == 1
+    assert out.contents() == "ok 0\n"
+    defs = loader.last.defs
+    thread = defs[sym("t")]
+    assert thread.dead
+    # posting the semaphore later does not wake it up
+    defs[sym("blocked")].post()
+    assert values_thread.get_scheduler().runnable == []
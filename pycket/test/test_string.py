@@ -1,4 +1,5 @@
 # coding: utf-8
+from pycket import values
 
 def test_string_set_bang(doctest):
     """
@@ -436,3 +437,92 @@ def test_string_to_number(doctest):
     > (string->number "1111111112983718926391623986912350912395612093409182368590812")
     1111111112983718926391623986912350912395612093409182368590812
     """
+
+def test_long_substring_and_append(doctest):
+    """
+    ! (define s (make-string 40 #\\a))
+    ! (define t (substring s 2 38))
+    ! (define u (string-append t s t))
+    > (string-length u)
+    112
+    > (string-set! t 0 #\\b)
+    > (string-ref t 0)
+    #\\b
+    > (string-ref u 0)
+    #\\a
+    > (string-ref s 2)
+    #\\a
+    > (equal? (substring u 0 36) (make-string 36 #\\a))
+    #t
+    """
+
+def test_slice_strategy():
+    from pycket.values_string import W_String, SliceStringStrategy
+    w_base = W_String.fromascii("0123456789" * 10, immutable=True)
+    w_slice = w_base.getslice(10, 60)
+    assert w_slice.get_strategy() is SliceStringStrategy.singleton
+    assert w_slice.length() == 50
+    assert w_slice.getitem(1) == u"1"
+    w_sub = w_slice.getslice(5, 45)
+    assert w_sub.get_strategy() is SliceStringStrategy.singleton
+    assert w_sub.as_str_utf8() == ("0123456789" * 10)[15:55]
+    # short slices are copied
+    assert w_slice.getslice(0, 3).as_str_utf8() == "012"
+    assert w_slice.get_strategy() is SliceStringStrategy.singleton
+    assert w_slice.equal(W_String.fromascii(("0123456789" * 10)[10:60]))
+    # mutation copies the characters
+    w_slice.setitem(0, values.W_Character(u"x"))
+    assert w_slice.getitem(0) == u"x"
+    assert w_base.getitem(10) == u"0"
+    assert w_sub.getitem(0) == u"5"
+
+def test_rope_strategy():
+    from pycket.values_string import W_String, RopeStringStrategy
+    w_piece = W_String.fromascii("abcdefghij" * 4)
+    w_acc = W_String.fromascii("")
+    for i in range(1000):
+        w_acc = W_String.make_rope([w_acc, w_piece]) or w_piece
+    assert w_acc.get_strategy() is RopeStringStrategy.singleton
+    assert w_acc.length() == 40000
+    w_shared = W_String.make_rope([w_acc, w_piece])
+    assert w_acc.getitem(39999) == u"j"
+    assert w_acc.get_strategy() is not RopeStringStrategy.singleton
+    assert w_acc.as_str_utf8() == "abcdefghij" * 4000
+    assert w_shared.as_str_utf8() == "abcdefghij" * 4004
+    # the pieces are snapshots, mutating them afterwards does not matter
+    w_piece.setitem(0, values.W_Character(u"x"))
+    w_rope = W_String.make_rope([w_piece, w_piece])
+    w_piece.setitem(0, values.W_Character(u"y"))
+    assert w_rope.as_str_utf8() == "x" + "bcdefghij" + "abcdefghij" * 3 + "x" + "bcdefghij" + "abcdefghij" * 3
+    w_uni = W_String.make_rope([w_shared, W_String.fromunicode(u"\u03bb")])
+    assert w_uni.length() == 40041
+    assert w_uni.as_unicode()[-2:] == u"j\u03bb"
+    assert W_String.make_rope([w_piece, W_String.fromascii("")]) is None
+
+def test_string_literal_cache_size(doctest):
+    """
+    > (exact-nonnegative-integer? (string-literal-cache-size))
+    #t
+    """
+
+def test_literal_cache(monkeypatch):
+    import gc
+    from pycket import values_string
+    from pycket.values_string import W_String, LiteralCache
+    monkeypatch.setattr(values_string, "literal_cache", LiteralCache())
+    monkeypatch.setattr(LiteralCache, "MIN_PRUNE_AT", 4)
+    cache = values_string.literal_cache
+    cache.prune_at = 4
+    w_a = W_String.make("a")
+    assert W_String.make("a") is w_a
+    assert w_a.immutable()
+    for i in range(10):
+        W_String.make("tmp%d" % i)
+    gc.collect()
+    # the keys of collected strings are dropped when the keys double
+    assert len(cache.keys) < 11
+    assert cache.size() == 1
+    assert W_String.make("a") is w_a
+    del w_a
+    gc.collect()
+    assert cache.size() == 0
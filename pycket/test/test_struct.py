@@ -668,3 +668,57 @@ def test_procedure_extract_target(doctest):
     > (procedure-extract-target proc)
     +
     """
+
+def test_mutable_fields(doctest):
+    """
+    > (define-values (struct:m make-m m? m-ref m-set!)
+        (make-struct-type 'm #f 3 0 #f null #f #f '(1)))
+    > (define a-m (make-m 1 'x 2))
+    > (m-set! a-m 0 10)
+    > (m-ref a-m 0)
+    10
+    > (m-set! a-m 2 2.5)
+    > (list (m-ref a-m 0) (m-ref a-m 1) (m-ref a-m 2))
+    '(10 x 2.5)
+    E (m-set! a-m 1 'y)
+    """
+
+def test_mutable_field_strategies():
+    from pycket import values_struct
+    from pycket.vector import W_Vector
+    key = to_list([W_Symbol.make("p"),
+                   W_Vector.fromelements([W_Fixnum(0), W_Fixnum(2)])])
+    w_a = W_Symbol.make("a")
+    s = values_struct.W_Struct.make_prefab(key, [W_Fixnum(1), w_a, W_Fixnum(3)])
+    assert isinstance(s, values_struct.W_MutableStruct)
+    assert s._get_size_list() == 1
+    assert s.mutable_strategy is values_struct.FixnumFieldStrategy.singleton
+    storage = s.mutable_storage
+    s._set(2, W_Fixnum(5))
+    # written in place
+    assert s.mutable_storage is storage
+    assert [v.value for v in (s._ref(0), s._ref(2))] == [1, 5]
+    assert s._ref(1) is w_a
+    s._set(0, W_Flonum(1.5))
+    assert s.mutable_strategy is values_struct.ObjectFieldStrategy.singleton
+    assert s._ref(0).value == 1.5
+    assert s._ref(2).value == 5
+    with pytest.raises(SchemeException):
+        s._set(1, w_a)
+
+    s = values_struct.W_Struct.make_prefab(key, [W_Flonum(1.0), w_a, W_Flonum(2.0)])
+    assert s.mutable_strategy is values_struct.FlonumFieldStrategy.singleton
+    s._set(2, W_Flonum(4.0))
+    assert s.mutable_strategy is values_struct.FlonumFieldStrategy.singleton
+    assert s._ref(2).value == 4.0
+
+def test_blank_struct():
+    from pycket import values_struct
+    from pycket.vector import W_Vector
+    key = to_list([W_Symbol.make("p"), W_Vector.fromelements([W_Fixnum(1)])])
+    s = values_struct.W_Struct.make_prefab(key, [W_Fixnum(1), W_Fixnum(2)])
+    p = values_struct.make_blank_struct(s.struct_type())
+    p._init_field(0, W_Fixnum(3))
+    p._init_field(1, p)
+    assert p._ref(0).value == 3
+    assert p._ref(1) is p
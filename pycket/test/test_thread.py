@@ -0,0 +1,113 @@
+import pytest
+from pycket                 import safepoint, values, values_thread
+from pycket.arity           import Arity
+from pycket.error           import SchemeException
+from pycket.prims.expose    import prim_env
+from pycket.interpreter     import App, ModuleVar, Quote, interpret_one
+
+sym = values.W_Symbol.make
+
+def call(name, *args):
+    prim = ModuleVar(sym(name), "#%kernel", sym(name))
+    return interpret_one(App.make(prim, [Quote(arg) for arg in args]))
+
+def thunk(name, *args):
+    """ A procedure of no arguments that calls the primitive `name` """
+    def code(_args, env, cont, _info):
+        return prim_env[sym(name)].call(list(args), env, cont)
+    return values.W_Prim("thunk", code, Arity.ZERO)
+
+def setup_function(function):
+    values_thread._holder.scheduler = values_thread.Scheduler()
+
+def test_threads(doctest):
+    """
+    ! (define ch (make-channel))
+    ! (define t (thread (lambda () (channel-put ch (+ 1 2)))))
+    > (thread? t)
+    #t
+    > (channel-get ch)
+    3
+    > (begin (thread-wait t) (thread-dead? t))
+    #t
+    """
+
+def test_semaphores(doctest):
+    """
+    ! (define s (make-semaphore))
+    ! (define b (box '()))
+    ! (for ([i 3]) (thread (lambda () (semaphore-wait s) (set-box! b (cons i (unbox b))))))
+    > (begin (for ([i 3]) (semaphore-post s)) (sleep 0.01) (sort (unbox b) <))
+    '(0 1 2)
+    > (sync/timeout 0 (make-semaphore))
+    #f
+    > (let ([s (make-semaphore 1)]) (eq? (sync s) s))
+    #t
+    > (call-with-semaphore (make-semaphore 1) (lambda (x) (+ x 1)) #f 41)
+    42
+    """
+
+def test_channel_handoff():
+    ch = values_thread.W_Channel()
+    w_thread = call("thread", thunk("channel-put", ch, values.W_Fixnum(42)))
+    assert isinstance(w_thread, values_thread.W_Thread)
+    assert call("thread-running?", w_thread) is values.w_true
+    assert call("channel-try-get", ch) is values.w_false
+    # the main thread blocks, the other one runs and hands over the value
+    assert call("channel-get", ch).value == 42
+    assert call("thread-dead?", w_thread) is values.w_true
+    assert values_thread.get_scheduler().current is values_thread.get_scheduler().main
+
+def test_semaphore_wakes_waiters_in_order():
+    sema = values_thread.W_Semaphore(0)
+    done = values_thread.W_Semaphore(0)
+    threads = [call("thread", thunk("semaphore-wait", sema)) for _ in range(3)]
+    call("thread", thunk("semaphore-post", done))
+    call("semaphore-wait", done)
+    assert [t.dead for t in threads] == [False] * 3
+    call("semaphore-post", sema)
+    call("semaphore-post", sema)
+    call("thread-wait", threads[0])
+    call("thread-wait", threads[1])
+    assert not threads[2].dead
+    assert sema.n == 0
+    call("kill-thread", threads[2])
+    assert threads[2].dead
+    call("semaphore-post", sema)
+    assert sema.n == 1
+    assert call("semaphore-try-wait?", sema) is values.w_true
+    assert call("semaphore-try-wait?", sema) is values.w_false
+
+def test_sync_and_deadlock():
+    ch = values_thread.W_Channel()
+    sema = values_thread.W_Semaphore(0)
+    call("thread", thunk("semaphore-post", sema))
+    assert call("sync", ch, sema) is sema
+    w_evt = call("semaphore-peek-evt", sema)
+    assert call("sync/timeout", values.W_Flonum(0.001), w_evt) is values.w_false
+    call("semaphore-post", sema)
+    assert call("sync", w_evt) is w_evt
+    assert sema.n == 1
+    # nothing will ever put a value on the channel
+    with pytest.raises(SchemeException):
+        call("channel-get", ch)
+    assert values_thread.get_scheduler().current is values_thread.get_scheduler().main
+
+def test_preemption():
+    ch = values_thread.W_Channel()
+    scheduler = values_thread.get_scheduler()
+    w_thread = call("thread", thunk("channel-put", ch, values.w_true))
+    assert scheduler.runnable == [w_thread]
+    assert values_thread.thread_switch in safepoint.safepoints.handlers
+    # an exhausted time slice switches to the waiting thread
+    safepoint.safepoints.fuel = 1
+    scheduler.depth = 1
+    assert safepoint.tick()
+    safepoint.run_handlers(None, None, None)
+    assert scheduler.current is w_thread
+    assert scheduler.runnable == [scheduler.main]
+    assert safepoint.safepoints.fuel == safepoint.INTERVAL
+    # but not in a nested interpreter loop
+    scheduler.depth = 2
+    safepoint.run_handlers(None, None, None)
+    assert scheduler.current is w_thread
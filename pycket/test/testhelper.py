@@ -27,6 +27,35 @@ def run_ast(ast):
     mod = interpret_module(ast, env)
     return mod
 
+#
+# ASTs built by hand, for tests that do not need racket
+#
+
+sym = values.W_Symbol.make
+
+def prim(name):
+    return ModuleVar(sym(name), "#%kernel", sym(name))
+
+def local(name):
+    """ A variable defined in the module itself """
+    return ModuleVar(sym(name), None, sym(name))
+
+def num(n):
+    return Quote(values.W_Fixnum(n))
+
+def define(name, rhs):
+    return DefineValues([sym(name)], rhs, [sym(name)])
+
+def procedure(formals, body):
+    return CaseLambda([make_lambda([sym(f) for f in formals], None, body)])
+
+def run_module(module):
+    """ Assignment converts and instantiates a normalized module """
+    from pycket.assign_convert import assign_convert
+    module = assign_convert(module)
+    module.interpret_mod(ToplevelEnv())
+    return module
+
 def expand_from_bytecode(m, srcloc):
     with NamedTemporaryFile(delete=delete_temp_files) as f:
         f.write(m.encode("utf-8"))
@@ -11,6 +11,8 @@ from pycket.prims.expose      import make_call_method
 from pycket.small_list        import inline_small_list
 from pycket.util              import add_copy_method, memoize_constructor
 
+import math
+
 from rpython.tool.pairtype    import extendabletype
 from rpython.rlib             import jit, runicode, rarithmetic, rweaklist
 from rpython.rlib.rstring     import StringBuilder
@@ -149,21 +151,6 @@ class W_ResolvedModulePath(W_Object):
     def tostring(self):
         return "#<resolved-module-path:%s>" % self.name
 
-class W_Logger(W_Object):
-    errorname = "logger"
-
-    _immutable_fields_ = ['topic', 'parent', 'propagate_level', 'propagate_topic[*]']
-    _attrs_ = ['topic', 'parent', 'propagate_level', 'propagate_topic']
-
-    def __init__(self, topic, parent, propagate_level, propagate_topic):
-        self.topic           = topic
-        self.parent          = parent
-        self.propagate_level = propagate_level
-        self.propagate_topic = propagate_topic
-
-    def tostring(self):
-        return "#<logger>"
-
 class W_ContinuationPromptTag(W_Object):
     errorname = "continuation-prompt-tag"
     _attrs_ = _immutable_fields_ = ["name"]
@@ -400,6 +387,7 @@ class W_WrappedConsProper(W_WrappedCons):
     def is_proper_list(self):
         return True
 
+@add_copy_method(copy_method="clone")
 class W_WrappedConsMaybe(W_WrappedCons):
     def is_proper_list(self):
         return self._cdr.is_proper_list()
@@ -485,7 +473,10 @@ class W_Ephemeron(W_Object):
         self.mapping.set(key, value)
 
     def get(self):
-        return self.mapping.get(self.key())
+        key = self.key()
+        if key is None:
+            return None
+        return self.mapping.get(key)
 
     def tostring(self):
         return "#<ephemeron>"
@@ -811,46 +802,107 @@ class W_Character(W_Object):
         return self.hash_eqv()
 
 
-class W_Thread(W_Object):
-    errorname = "thread"
-    _attrs_ = []
-    def __init__(self):
-        pass
-    def tostring(self):
-        return "#<thread>"
-
-class W_Semaphore(W_Object):
-    errorname = "semaphore"
-    _attrs_ = ['n']
-    def __init__(self, n):
-        self.n = n
-    def post(self):
-        self.n += 1
-    def wait(self):
-        if self.n >= 1:
-            return
-        else:
-            raise SchemeException("Waiting for a semaphore will never finish")
-    def tostring(self):
-        return "#<semaphore>"
-
+# Threads, semaphores and channels are in values_thread.py
 class W_Evt(W_Object):
     errorname = "evt"
     _attrs_ = []
 
-class W_SemaphorePeekEvt(W_Evt):
-    errorname = "semaphore-peek-evt"
-    _attrs_ = _immutable_fields_ = ["sema"]
-    def __init__(self, sema):
-        self.sema = sema
-    def tostring(self):
-        return "#<semaphore-peek-evt>"
+    def try_sync(self):
+        """ The result of synchronizing on the event if it is ready, or
+        None """
+        raise NotImplementedError("abstract base class")
+
+    def register(self, waiter, w_result):
+        """ Asks the event to wake `waiter` when it becomes ready """
+        raise NotImplementedError("abstract base class")
 
 class W_PseudoRandomGenerator(W_Object):
+    """ Racket's generator, MRG32k3a: the combination of two multiplicative
+    recursive generators of order three. Every generator has a state of its
+    own, so that its stream of numbers is reproducible from the state. The
+    arithmetic is done on floats, which hold the products exactly. """
     errorname = "pseudo-random-generator"
-    _attrs_ = []
-    def __init__(self):
-        pass
+    _attrs_ = ["x10", "x11", "x12", "x20", "x21", "x22"]
+
+    M1 = 4294967087.0
+    M2 = 4294944443.0
+    A12 = 1403580.0
+    A13N = 810728.0
+    A21 = 527612.0
+    A23N = 1370589.0
+
+    def __init__(self, seed=0):
+        self.seed(seed)
+
+    def seed(self, seed):
+        """ Derives the state from a seed in [0, 2^31 - 1] with a linear
+        congruential generator """
+        x = rarithmetic.r_uint(seed)
+        state = [0.0] * 6
+        for i in range(6):
+            x = x * rarithmetic.r_uint(69069) + rarithmetic.r_uint(1)
+            x &= rarithmetic.r_uint(0xFFFFFFFF)
+            m = self.M1 if i < 3 else self.M2
+            state[i] = math.fmod(float(x), m)
+        if state[0] == 0.0 and state[1] == 0.0 and state[2] == 0.0:
+            state[0] = 1.0
+        if state[3] == 0.0 and state[4] == 0.0 and state[5] == 0.0:
+            state[3] = 1.0
+        self.set_state(state)
+
+    def get_state(self):
+        return [self.x10, self.x11, self.x12, self.x20, self.x21, self.x22]
+
+    def set_state(self, state):
+        self.x10, self.x11, self.x12 = state[0], state[1], state[2]
+        self.x20, self.x21, self.x22 = state[3], state[4], state[5]
+
+    @staticmethod
+    def is_valid_state(state):
+        if len(state) != 6:
+            return False
+        for i in range(6):
+            m = W_PseudoRandomGenerator.M1 if i < 3 else W_PseudoRandomGenerator.M2
+            if not (0.0 <= state[i] < m):
+                return False
+        return (state[0] != 0.0 or state[1] != 0.0 or state[2] != 0.0) and (
+                state[3] != 0.0 or state[4] != 0.0 or state[5] != 0.0)
+
+    def next_value(self):
+        """ The next number of the stream, an integer in [0, M1) """
+        x10 = self.A12 * self.x11 - self.A13N * self.x12
+        x10 -= math.floor(x10 / self.M1) * self.M1
+        self.x12 = self.x11
+        self.x11 = self.x10
+        self.x10 = x10
+
+        x20 = self.A21 * self.x20 - self.A23N * self.x22
+        x20 -= math.floor(x20 / self.M2) * self.M2
+        self.x22 = self.x21
+        self.x21 = self.x20
+        self.x20 = x20
+
+        y = x10 - x20
+        if y < 0.0:
+            y += self.M1
+        return y
+
+    def random(self):
+        """ A float in (0, 1) """
+        return (self.next_value() + 1.0) / (self.M1 + 1.0)
+
+    def random_int(self, n):
+        """ An integer in [0, n), for 0 < n < M1, by rejecting the numbers of
+        the last incomplete range """
+        q = math.floor(self.M1 / float(n))
+        qn = q * float(n)
+        x = self.next_value()
+        while x >= qn:
+            x = self.next_value()
+        return int(x / q)
+
+    def tostring(self):
+        return "#<pseudo-random-generator>"
 
 class W_Path(W_Object):
     errorname = "path"
@@ -1266,9 +1318,10 @@ class W_ThunkProcCMK(W_Procedure):
 
 
 class W_Prim(W_Procedure):
-    _attrs_ = _immutable_fields_ = ["name", "code", "arity", "result_arity", "simple1", "simple2"]
+    _attrs_ = _immutable_fields_ = ["name", "code", "arity", "result_arity", "simple1", "simple2", "simple_func"]
 
-    def __init__ (self, name, code, arity=Arity.unknown, result_arity=None, simple1=None, simple2=None):
+    def __init__ (self, name, code, arity=Arity.unknown, result_arity=None, simple1=None, simple2=None,
+                  simple_func=None):
         self.name = W_Symbol.make(name)
         self.code = code
         assert isinstance(arity, Arity)
@@ -1276,6 +1329,8 @@ class W_Prim(W_Procedure):
         self.result_arity = result_arity
         self.simple1 = simple1
         self.simple2 = simple2
+        # for simple primitives: the function on the list of arguments
+        self.simple_func = simple_func
 
     def get_arity(self, promote=False):
         if promote:
@@ -1674,6 +1729,8 @@ class W_StringOutputPort(W_OutputPort):
         self.str = StringBuilder()
     def write(self, s):
         self.str.append(s)
+    def flush(self):
+        pass
     def contents(self):
         return self.str.build()
     def seek(self, offset, end=False):
@@ -1690,20 +1747,157 @@ class W_StringOutputPort(W_OutputPort):
     def tell(self):
         return self.str.getlength()
 
+class PortLocation(object):
+    """ Line counting state of an input port (port-count-lines!). The location
+    is known at index `counted` of the port's buffer, and the location at
+    index `base_index` is kept to count again when the port moves back. """
+    _attrs_ = ["line", "column", "position", "counted",
+               "base_index", "base_line", "base_column", "base_position"]
+
+    def __init__(self, index, position):
+        self.line = 1
+        self.column = 0
+        self.position = position
+        self.counted = index
+        self.rebase(index)
+
+    def rebase(self, index):
+        self.base_index = index
+        self.base_line = self.line
+        self.base_column = self.column
+        self.base_position = self.position
+
+    def count(self, buf, start, stop):
+        line = self.line
+        column = self.column
+        position = self.position
+        for i in range(start, stop):
+            c = buf[i]
+            if c == '\n':
+                line += 1
+                column = 0
+                position += 1
+            elif ord(c) & 0xC0 != 0x80:
+                # not a continuation byte of a UTF-8 encoded character
+                column += 1
+                position += 1
+        self.line = line
+        self.column = column
+        self.position = position
+
+    def sync(self, buf, pos):
+        """ Brings the location up to index `pos` of the buffer """
+        if pos < self.counted:
+            # the port moved back, count again from the base
+            self.line = self.base_line
+            self.column = self.base_column
+            self.position = self.base_position
+            self.counted = self.base_index
+            if pos < self.counted:
+                self.counted = pos
+                self.base_index = pos
+        self.count(buf, self.counted, pos)
+        self.counted = pos
+
+    def uncount(self, s):
+        """ Moves the location back over `s`, which is no longer in the
+        buffer. The column is only approximated when `s` spans lines. """
+        for i in range(len(s)):
+            c = s[i]
+            if c == '\n':
+                self.line -= 1
+                self.column = 0
+                self.position -= 1
+            elif ord(c) & 0xC0 != 0x80:
+                self.column = max(self.column - 1, 0)
+                self.position -= 1
+
+INVALID_UTF8 = "input port: string is not a well-formed UTF-8 encoding"
+
 class W_InputPort(W_Port):
+    """ Input ports read from a buffer, which is refilled by `fill`. The
+    reader and the character level primitives work on the buffer directly. """
     errorname = "input-port"
-    _attrs_ = []
+    _attrs_ = ['location']
+
+    def get_buffer(self):
+        raise NotImplementedError("abstract class")
+    def get_pos(self):
+        raise NotImplementedError("abstract class")
+    def set_pos(self, pos):
+        raise NotImplementedError("abstract class")
+    def fill(self):
+        """ Reads more input into the buffer. The buffer and the position in
+        it may change. Returns False at the end of the input. """
+        raise NotImplementedError("abstract class")
+
     def read(self, n):
         raise NotImplementedError("abstract class")
     def peek(self):
         raise NotImplementedError("abstract class")
     def readline(self):
         raise NotImplementedError("abstract class")
+    def unread(self, s):
+        """ Puts `s`, which was just read from this port, back in front of the
+        remaining input """
+        raise NotImplementedError("abstract class")
     def tostring(self):
         return "#<input-port>"
     def _length_up_to_end(self):
         raise NotImplementedError("abstract class")
 
+    def ensure(self, n):
+        """ Tries to have `n` bytes in the buffer after the position, returns
+        the number of bytes available """
+        while len(self.get_buffer()) - self.get_pos() < n:
+            if not self.fill():
+                break
+        return len(self.get_buffer()) - self.get_pos()
+
+    def read_char(self, peek=False, skip=0):
+        """ Decodes the UTF-8 encoded character `skip` bytes ahead, consuming
+        it unless `peek` is set. Returns None at the end of the input. """
+        if self.ensure(skip + 1) <= skip:
+            return None
+        start = self.get_pos() + skip
+        needed = utf8_code_length(ord(self.get_buffer()[start]))
+        if self.ensure(skip + needed) < skip + needed:
+            raise SchemeException(INVALID_UTF8)
+        buf = self.get_buffer()
+        start = self.get_pos() + skip
+        stop = start + needed
+        if needed == 1:
+            c = unichr(ord(buf[start]))
+        else:
+            try:
+                u, _ = runicode.str_decode_utf_8(buf[start:stop], needed, "strict")
+            except UnicodeDecodeError:
+                raise SchemeException(INVALID_UTF8)
+            if len(u) != 1:
+                raise SchemeException(INVALID_UTF8)
+            c = u[0]
+        if not peek:
+            self.set_pos(stop)
+        return c
+
+    def count_lines(self):
+        if self.location is None:
+            self.location = PortLocation(self.get_pos(), self.tell() + 1)
+
+    def next_location(self):
+        """ (line, column, position) of the next character to read, line and
+        column are -1 if lines are not counted """
+        location = self.location
+        if location is None:
+            return -1, -1, self.tell() + 1
+        location.sync(self.get_buffer(), self.get_pos())
+        return location.line, location.column, location.position
+
+def utf8_code_length(i):
+    if i < 0x80:
+        return 1
+    return ord(runicode._utf8_code_length[i - 0x80])
+
 class W_StringInputPort(W_InputPort):
     errorname = "input-port"
     _immutable_fields_ = ["str"]
@@ -1713,6 +1907,19 @@ class W_StringInputPort(W_InputPort):
         self.closed = False
         self.str = str
         self.ptr = 0
+        self.location = None
+
+    def get_buffer(self):
+        return self.str
+
+    def get_pos(self):
+        return self.ptr
+
+    def set_pos(self, pos):
+        self.ptr = pos
+
+    def fill(self):
+        return False
 
     def readline(self):
         from rpython.rlib.rstring import find
@@ -1761,40 +1968,162 @@ class W_StringInputPort(W_InputPort):
     def tell(self):
         return self.ptr
 
+    def unread(self, s):
+        ptr = self.ptr - len(s)
+        assert ptr >= 0
+        self.ptr = ptr
+
     def _length_up_to_end(self):
         return len(self.str) - self.ptr
 
 class W_FileInputPort(W_InputPort):
+    """ Input is read from the file in blocks into `buffer`, whose first `pos`
+    bytes are consumed """
     errorname = "input-port"
     _immutable_fields_ = ["file"]
-    _attrs_ = ['closed', 'file']
+    _attrs_ = ['closed', 'file', 'buffer', 'pos']
+
+    BLOCK_SIZE = 4096
 
     def __init__(self, f):
         self.closed = False
         self.file = f
+        self.buffer = ""
+        self.pos = 0
+        self.location = None
 
     def close(self):
         self.closed = True
         self.file.close()
         #self.file = None
 
+    def get_buffer(self):
+        return self.buffer
+
+    def get_pos(self):
+        return self.pos
+
+    def set_pos(self, pos):
+        self.pos = pos
+
+    def _read_block(self):
+        # take what the stream has buffered, so that reading from a terminal
+        # or a pipe does not wait for a whole block
+        offset, string = self.file.peek()
+        available = len(string) - offset
+        if available > 0:
+            return self.file.read(min(available, self.BLOCK_SIZE))
+        block = self.file.read(1)
+        if not block:
+            return block
+        offset, string = self.file.peek()
+        available = min(len(string) - offset, self.BLOCK_SIZE - 1)
+        if available > 0:
+            block += self.file.read(available)
+        return block
+
+    def _drop_consumed(self):
+        pos = self.pos
+        location = self.location
+        if location is not None:
+            location.sync(self.buffer, pos)
+            location.counted = 0
+            location.rebase(0)
+        if pos > 0:
+            self.buffer = self.buffer[pos:]
+            self.pos = 0
+
+    def _append_blocks(self, blocks):
+        # joining the blocks once keeps reading a long stretch of input
+        # linear, appending each block would copy the buffer every time
+        self._drop_consumed()
+        blocks.insert(0, self.buffer)
+        self.buffer = "".join(blocks)
+
+    def fill(self):
+        block = self._read_block()
+        if not block:
+            return False
+        self._append_blocks([block])
+        return True
+
+    def ensure(self, n):
+        available = len(self.buffer) - self.pos
+        if available < n:
+            blocks = []
+            while available < n:
+                block = self._read_block()
+                if not block:
+                    break
+                blocks.append(block)
+                available += len(block)
+            if blocks:
+                self._append_blocks(blocks)
+        return available
+
     def read(self, n):
-        return self.file.read(n)
+        if n < 0:
+            self._drop_consumed()
+            result = self.buffer + self.file.read(-1)
+            self.buffer = ""
+            if self.location is not None:
+                self.location.count(result, 0, len(result))
+                self.location.rebase(0)
+            return result
+        self.ensure(n)
+        start = self.pos
+        stop = min(start + n, len(self.buffer))
+        assert start >= 0 and stop >= start
+        self.pos = stop
+        return self.buffer[start:stop]
 
     def readline(self):
-        return self.file.readline()
+        pos = self.buffer.find("\n", self.pos)
+        if pos < 0:
+            blocks = []
+            while True:
+                block = self._read_block()
+                if not block:
+                    break
+                blocks.append(block)
+                if block.find("\n") >= 0:
+                    break
+            if blocks:
+                self._append_blocks(blocks)
+            pos = self.buffer.find("\n", self.pos)
+        if pos >= 0:
+            stop = pos + 1
+        else:
+            stop = len(self.buffer)
+        start = self.pos
+        assert start >= 0 and stop >= start
+        self.pos = stop
+        return self.buffer[start:stop]
 
     def peek(self):
-        offset, string = self.file.peek()
-        if offset < len(string):
-            # fast path:
-            return string[offset]
-        pos = self.file.tell()
-        res = self.file.read(1)
-        self.file.seek(pos, 0)
-        return res
+        if self.ensure(1) == 0:
+            return ""
+        return self.buffer[self.pos]
+
+    def unread(self, s):
+        pos = self.pos - len(s)
+        if pos >= 0 and self.buffer[pos:self.pos] == s:
+            self.pos = pos
+            return
+        # the input is no longer in the buffer
+        self._drop_consumed()
+        if self.location is not None:
+            self.location.uncount(s)
+            self.location.rebase(0)
+        self.buffer = s + self.buffer
 
     def seek(self, offset, end=False):
+        if self.location is not None:
+            self.location.sync(self.buffer, self.pos)
+            self.location.counted = 0
+            self.location.rebase(0)
+        self.buffer = ""
+        self.pos = 0
         if end:
             self.file.seek(0, 2)
         else:
@@ -1802,7 +2131,7 @@ class W_FileInputPort(W_InputPort):
 
     def tell(self):
         # XXX this means we can only deal with 4GiB files on 32bit systems
-        return int(intmask(self.file.tell()))
+        return int(intmask(self.file.tell())) - (len(self.buffer) - self.pos)
 
     def _length_up_to_end(self):
         old_ptr = self.tell()
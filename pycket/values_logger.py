@@ -0,0 +1,339 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Loggers and log receivers. A message logged to a logger is delivered to the
+# receivers of the logger that are interested in its level and topic, and is
+# then propagated to the parent logger, as far as the propagation filter of
+# the logger lets it through.
+#
+# Whether anybody listens at all is answered by `log-level?` before a message
+# is even formatted, so the check is kept cheap: every logger caches the most
+# detailed level any receiver could want from it. The caches are invalidated
+# together, by a new version, whenever a receiver is added, which happens
+# rarely. The JIT constant-folds the version and the cached level, so that a
+# disabled log statement costs a comparison of two constants.
+#
+from pycket                 import values
+from pycket                 import values_string
+from pycket                 import vector as values_vector
+from pycket.error           import SchemeException
+from pycket.values_thread   import Registration
+from rpython.rlib           import jit
+from rpython.rlib           import streamio as sio
+from rpython.rlib.rstring   import StringBuilder
+
+# levels, from the least to the most detailed
+NONE    = 0
+FATAL   = 1
+ERROR   = 2
+WARNING = 3
+INFO    = 4
+DEBUG   = 5
+
+LEVEL_NAMES = ["none", "fatal", "error", "warning", "info", "debug"]
+W_LEVELS = [values.W_Symbol.make(name) for name in LEVEL_NAMES]
+
+def level_from_name(name):
+    for i in range(len(LEVEL_NAMES)):
+        if LEVEL_NAMES[i] == name:
+            return i
+    return -1
+
+@jit.elidable
+def _level_index(w_level):
+    for i in range(len(W_LEVELS)):
+        if W_LEVELS[i] is w_level:
+            return i
+    return -1
+
+def level_from_symbol(w_level, who):
+    level = _level_index(w_level)
+    if level >= 0:
+        return level
+    raise SchemeException("%s: expected a log level, got %s" %
+                          (who, w_level.tostring()))
+
+class LevelFilter(object):
+    """ The level wanted for every topic, as given to make-log-receiver and
+    make-logger: the level of a topic that is listed, `default` otherwise """
+    _attrs_ = _immutable_fields_ = ["topics[*]", "levels[*]", "default"]
+
+    def __init__(self, topics, levels, default):
+        self.topics = topics
+        self.levels = levels
+        self.default = default
+
+    @jit.unroll_safe
+    def level_for(self, w_topic):
+        if w_topic is not values.w_false:
+            for i in range(len(self.topics)):
+                if self.topics[i] is w_topic:
+                    return self.levels[i]
+        return self.default
+
+    @jit.unroll_safe
+    def max_level(self):
+        level = self.default
+        for i in range(len(self.levels)):
+            level = max(level, self.levels[i])
+        return level
+
+ALL_LEVELS = LevelFilter([], [], DEBUG)
+
+def parse_filter(args, who, default=NONE):
+    """ Parses `level topic ... level` arguments. A level without a topic is
+    the level for the topics that are not listed. """
+    topics = []
+    levels = []
+    i = 0
+    while i < len(args):
+        level = level_from_symbol(args[i], who)
+        w_topic = args[i + 1] if i + 1 < len(args) else values.w_false
+        if w_topic is values.w_false:
+            default = level
+        elif isinstance(w_topic, values.W_Symbol):
+            topics.append(w_topic)
+            levels.append(level)
+        else:
+            raise SchemeException("%s: expected a symbol or #f as topic, got %s" %
+                                  (who, w_topic.tostring()))
+        i += 2
+    return LevelFilter(topics[:], levels[:], default)
+
+def parse_spec(spec):
+    """ Parses a specification like the one of PLTSTDERR: levels separated by
+    whitespace, each one either for all topics or, as `level@topic`, for one
+    topic. Returns None if the specification is ill-formed. """
+    topics = []
+    levels = []
+    default = NONE
+    for part in spec.split(" "):
+        if not part:
+            continue
+        at = part.find("@")
+        if at < 0:
+            default = level_from_name(part)
+            if default < 0:
+                return None
+            continue
+        level = level_from_name(part[:at])
+        if level < 0:
+            return None
+        topics.append(values.W_Symbol.make(part[at + 1:]))
+        levels.append(level)
+    return LevelFilter(topics[:], levels[:], default)
+
+class LoggerVersion(object):
+    """ Changes whenever a receiver is added, which invalidates the levels
+    cached in the loggers """
+    _attrs_ = []
+
+class LoggerState(object):
+    _attrs_ = ["version"]
+    _immutable_fields_ = ["version?"]
+
+    def __init__(self):
+        self.version = LoggerVersion()
+
+    def invalidate(self):
+        self.version = LoggerVersion()
+
+state = LoggerState()
+
+class W_Logger(values.W_Object):
+    errorname = "logger"
+
+    _immutable_fields_ = ["topic", "parent", "propagate"]
+    _attrs_ = ["topic", "parent", "propagate", "receivers",
+               "cached_version", "cached_level"]
+
+    def __init__(self, topic, parent, propagate):
+        self.topic = topic
+        self.parent = parent
+        self.propagate = propagate
+        self.receivers = []
+        self.cached_version = None
+        self.cached_level = NONE
+
+    def add_receiver(self, receiver):
+        self.receivers.append(receiver)
+        state.invalidate()
+
+    def max_level(self):
+        """ The most detailed level some receiver may want from this logger,
+        constant for the JIT as long as no receiver is added """
+        version = state.version
+        return self._max_level(version)
+
+    @jit.elidable
+    def _max_level(self, version):
+        if self.cached_version is not version:
+            level = NONE
+            for receiver in self.receivers:
+                level = max(level, receiver.filter.max_level())
+            parent = self.parent
+            if parent is not None:
+                propagated = min(self.propagate.max_level(),
+                                 parent._max_level(version))
+                level = max(level, propagated)
+            self.cached_level = level
+            self.cached_version = version
+        return self.cached_level
+
+    def is_level(self, level, w_topic):
+        """ Whether a message of the level and topic would be received """
+        logger = jit.promote(self)
+        if level > logger.max_level():
+            return False
+        return logger.wants(level, w_topic)
+
+    @jit.dont_look_inside
+    def wants(self, level, w_topic):
+        logger = self
+        while logger is not None:
+            for receiver in logger.receivers:
+                if receiver.filter.level_for(w_topic) >= level:
+                    return True
+            if logger.propagate.level_for(w_topic) < level:
+                return False
+            logger = logger.parent
+        return False
+
+    @jit.dont_look_inside
+    def log(self, level, w_topic, w_message, w_data):
+        if level > self.max_level():
+            return
+        w_event = values_vector.W_Vector.fromelements(
+            [W_LEVELS[level], w_message, w_data, w_topic])
+        logger = self
+        while logger is not None:
+            for receiver in logger.receivers:
+                if receiver.filter.level_for(w_topic) >= level:
+                    receiver.receive(w_event, w_message)
+            if logger.propagate.level_for(w_topic) < level:
+                return
+            logger = logger.parent
+
+    def tostring(self):
+        return "#<logger>"
+
+class Receiver(object):
+    _attrs_ = _immutable_fields_ = ["filter"]
+
+    def receive(self, w_event, w_message):
+        raise NotImplementedError("abstract base class")
+
+class W_LogReceiver(values.W_Evt):
+    """ A synchronizable event whose result is the oldest message not
+    received yet. The messages that have not been received are kept in a
+    ring buffer, when it is full the oldest message is dropped. """
+    errorname = "log-receiver"
+    _attrs_ = _immutable_fields_ = ["receiver"]
+
+    def __init__(self, filter, capacity):
+        self.receiver = QueueReceiver(filter, capacity)
+
+    def try_sync(self):
+        return self.receiver.dequeue()
+
+    def register(self, waiter, w_result):
+        # the result is the message received
+        self.receiver.waiters.append(Registration(waiter, None))
+
+    def tostring(self):
+        return "#<log-receiver>"
+
+class QueueReceiver(Receiver):
+    _attrs_ = ["events", "start", "count", "waiters"]
+
+    CAPACITY = 1024
+
+    def __init__(self, filter, capacity=CAPACITY):
+        assert capacity > 0
+        self.filter = filter
+        self.events = [None] * capacity
+        self.start = 0
+        self.count = 0
+        self.waiters = []
+
+    def receive(self, w_event, w_message):
+        while self.waiters:
+            reg = self.waiters.pop(0)
+            if reg.fire(w_event):
+                return
+        capacity = len(self.events)
+        if self.count == capacity:
+            # drop the oldest event
+            self.start = (self.start + 1) % capacity
+            self.count -= 1
+        self.events[(self.start + self.count) % capacity] = w_event
+        self.count += 1
+
+    def dequeue(self):
+        if self.count == 0:
+            return None
+        w_event = self.events[self.start]
+        self.events[self.start] = None
+        self.start = (self.start + 1) % len(self.events)
+        self.count -= 1
+        return w_event
+
+def message_line(w_message):
+    assert isinstance(w_message, values_string.W_String)
+    return w_message.as_str_utf8() + "\n"
+
+class PortReceiver(Receiver):
+    """ Writes the messages to an output port, like the receiver for
+    PLTSTDERR """
+    _attrs_ = _immutable_fields_ = ["port"]
+
+    def __init__(self, filter, port):
+        self.filter = filter
+        self.port = port
+
+    def receive(self, w_event, w_message):
+        self.port.write(message_line(w_message))
+
+class FileReceiver(Receiver):
+    """ Appends the messages to a file. They are collected and written in
+    batches, so that logging does not wait for the file on every message. """
+    _attrs_ = ["path", "pending"]
+    _immutable_fields_ = ["path"]
+
+    BATCH_SIZE = 65536
+
+    def __init__(self, filter, path):
+        self.filter = filter
+        self.path = path
+        self.pending = StringBuilder()
+
+    def receive(self, w_event, w_message):
+        self.pending.append(message_line(w_message))
+        if self.pending.getlength() >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending.getlength() == 0:
+            return
+        contents = self.pending.build()
+        self.pending = StringBuilder()
+        stream = sio.open_file_as_stream(self.path, "a")
+        try:
+            stream.write(contents)
+        finally:
+            stream.close()
+
+class FileReceivers(object):
+    """ The file receivers to flush when the program ends """
+    _attrs_ = ["receivers"]
+
+    def __init__(self):
+        self.receivers = []
+
+    def flush(self):
+        for receiver in self.receivers:
+            receiver.flush()
+
+file_receivers = FileReceivers()
+
+w_root_logger = W_Logger(values.w_false, None, ALL_LEVELS)
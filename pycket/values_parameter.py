@@ -71,7 +71,7 @@ top_level_config = W_Parameterization(RootParameterization(), ParameterizationHa
 
 def find_param_cell(cont, param):
     assert isinstance(cont, BaseCont)
-    p = cont.get_mark_first(values.parameterization_key)
+    p = cont.get_parameterization()
     assert isinstance(p, W_Parameterization)
     assert isinstance(param, W_Parameter)
     v = p.get(param)
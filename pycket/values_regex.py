@@ -4,69 +4,95 @@ from pycket       import values, values_string
 from pycket       import regexp
 
 from rpython.rlib.rsre        import rsre_core, rsre_char, rsre_re
-from rpython.rlib             import buffer, jit, rstring
+from rpython.rlib             import jit, rstring
 from rpython.rlib.objectmodel import specialize
 import sys
 
 CACHE = regexp.RegexpCache()
 
-class PortBuffer(buffer.Buffer):
-    """match context for matching in a port."""
-    # XXX how to extend to unicode?
+class NeedMoreInput(Exception):
+    pass
 
-    _immutable_ = True
+class PortBuffer(object):
+    """ The input of a port as seen by the matcher. Input is read ahead in
+    blocks, doubling in size, as the matcher asks for it, so that ports of
+    unknown length such as pipes work as well.
 
-    def __init__(self, w_port):
-        self.w_port = w_port
-        l = w_port._length_up_to_end()
-        assert l >= 0
-        self.length = l
-        self.read_so_far = []
+    Until the port is exhausted, the match context is given an end a block
+    past the input read so far, and reading beyond that input raises
+    NeedMoreInput; the match is then retried with more input. Only the
+    assertions about the end of the input (`$`) are decided without reading,
+    so they only hold once the port is exhausted. """
+
+    BLOCK_SIZE = 4096
 
-    def getlength(self):
-        return self.length
+    def __init__(self, w_port, limit):
+        self.w_port = w_port
+        self.limit = limit
+        self.data = ""
+        self.eof = False
 
     def getitem(self, index):
-        if index >= len(self.read_so_far):
-            nchars = len(self.read_so_far) - index + 1
-            self.read_so_far.extend(list(self.w_port.read(nchars)))
-        ch = self.read_so_far[index]
-        return ch
+        if index >= len(self.data):
+            raise NeedMoreInput
+        return self.data[index]
+
+    def getslice(self, start, end):
+        assert 0 <= start <= end
+        return self.data[start:end]
+
+    def fill(self):
+        size = min(max(self.BLOCK_SIZE, len(self.data)), self.limit - len(self.data))
+        s = self.w_port.read(size) if size > 0 else ""
+        if not s:
+            self.eof = True
+        else:
+            self.data += s
+            if len(self.data) >= self.limit:
+                self.eof = True
+
+    def match_end(self):
+        if self.eof:
+            return len(self.data)
+        return len(self.data) + self.BLOCK_SIZE
 
+    def consume(self, end):
+        """ Leaves the port positioned after the first `end` characters """
+        assert 0 <= end <= len(self.data)
+        if end < len(self.data):
+            self.w_port.unread(self.data[end:])
 
 class W_AnyRegexp(W_Object):
-    _immutable_fields_ = ["source"]
-    _attrs_ = ["source", "code", "flags", "groupcount", "groupindex", "indexgroup", "group_offsets"]
+    _immutable_fields_ = ["source", "compiled?"]
+    _attrs_ = ["source", "compiled"]
     errorname = "regexp"
+    # distinguishes the kinds of regexp in the compiled regexp cache
+    kind = 0
     def __init__(self, source):
         self.source = source
-        self.code = None
+        self.compiled = None
 
     def ensure_compiled(self):
-        if self.code is None:
-            code, flags, groupcount, groupindex, indexgroup, group_offsets = regexp.compile(CACHE, self.source, 0)
-            self.code = code
-            self.flags = flags
-            self.groupcount = groupcount
-            self.groupindex = groupindex
-            self.indexgroup = indexgroup
-            self.group_offsets = group_offsets
+        # compiled is quasi-immutable, so the JIT only checks it once
+        if self.compiled is None:
+            self.compiled = regexp.compile(CACHE, self.source, 0, self.kind)
+        return self.compiled
 
     @specialize.argtype(1)
     def make_ctx(self, s, start, end):
-        self.ensure_compiled()
+        compiled = self.ensure_compiled()
         start, end = rsre_core._adjust(start, end, len(s))
         if isinstance(s, unicode):
-            return rsre_core.UnicodeMatchContext(self.code, s, start, end, self.flags)
+            return rsre_core.UnicodeMatchContext(compiled.code, s, start, end, compiled.flags)
         assert isinstance(s, str)
-        return rsre_core.StrMatchContext(self.code, s, start, end, self.flags)
+        return rsre_core.StrMatchContext(compiled.code, s, start, end, compiled.flags)
 
     @specialize.argtype(1)
     def match_string(self, s, start=0, end=sys.maxint):
         ctx = self.make_ctx(s, start, end)
         if not rsre_core.search_context(ctx):
             return None
-        return _extract_result(ctx, self.groupcount)
+        return _extract_result(ctx, self.compiled.groupcount)
 
     @specialize.call_location()
     def _match_all_strings(self, extract, s, start, end):
@@ -75,7 +101,7 @@ class W_AnyRegexp(W_Object):
         while ctx.match_start <= ctx.end:
             if not rsre_core.search_context(ctx):
                 break
-            match = extract(ctx, self.groupcount)
+            match = extract(ctx, self.compiled.groupcount)
             matchlist.append(match)
             # Advance starting point for next match
             no_progress = (ctx.match_start == ctx.match_end)
@@ -95,28 +121,71 @@ class W_AnyRegexp(W_Object):
         ctx = self.make_ctx(s, start, end)
         if not rsre_core.search_context(ctx):
             return None
-        return _extract_spans(ctx, self.groupcount)
+        return _extract_spans(ctx, self.compiled.groupcount)
+
+    def _search_port(self, w_port, start, end):
+        """ Searches the input of `w_port`, skipping the first `start`
+        characters and looking at most at `end` characters. The port is
+        advanced past the match, or to the end of what was searched if there
+        is none. Positions in the returned context are relative to the
+        position of the port when it was called. """
+        compiled = self.ensure_compiled()
+        buf = PortBuffer(w_port, end)
+        buf.fill()
+        while True:
+            match_start = min(start, len(buf.data))
+            ctx = rsre_core.BufMatchContext(compiled.code, buf, match_start,
+                                            buf.match_end(), compiled.flags)
+            try:
+                matched = rsre_core.search_context(ctx)
+            except NeedMoreInput:
+                buf.fill()
+                continue
+            if matched:
+                buf.consume(ctx.match_end)
+                return ctx
+            if buf.eof:
+                return None
+            buf.fill()
+
+    def _search_string_port(self, w_port, start, end):
+        """ Like _search_port, for string ports, whose input is at hand """
+        compiled = self.ensure_compiled()
+        base = w_port.ptr
+        length = len(w_port.str)
+        stop = length if end >= length - base else base + end
+        match_start = min(base + start, stop)
+        ctx = rsre_core.StrMatchContext(compiled.code, w_port.str, match_start,
+                                        stop, compiled.flags)
+        if not rsre_core.search_context(ctx):
+            w_port.ptr = stop
+            return None
+        w_port.ptr = ctx.match_end
+        return ctx
 
-    def match_port_positions(self, w_port):
-        raise NotImplementedError("match_port_position: not yet implemented")
+    def match_port_positions(self, w_port, start=0, end=sys.maxint):
+        if isinstance(w_port, values.W_StringInputPort):
+            base = w_port.ptr
+            ctx = self._search_string_port(w_port, start, end)
+            if ctx is None:
+                return None
+            return _shift_spans(_extract_spans(ctx, self.compiled.groupcount), base)
+        ctx = self._search_port(w_port, start, end)
+        if ctx is None:
+            return None
+        return _extract_spans(ctx, self.compiled.groupcount)
 
     def match_port(self, w_port, start=0, end=sys.maxint):
-        self.ensure_compiled()
         if isinstance(w_port, values.W_StringInputPort):
             # fast path
-            ctx = rsre_core.search(self.code, w_port.str, start=w_port.ptr)
-            if not ctx:
+            ctx = self._search_string_port(w_port, start, end)
+            if ctx is None:
                 return None
-            start, end = ctx.span(0) # the whole match
-            w_port.ptr = end
-            return _extract_result(ctx, self.groupcount)
-        buf = PortBuffer(w_port)
-        end = min(end, buf.getlength())
-        ctx = rsre_core.BufMatchContext(self.code, buf, 0, end, 0)
-        matched = rsre_core.search_context(ctx)
-        if not matched:
+            return _extract_result(ctx, self.compiled.groupcount)
+        ctx = self._search_port(w_port, start, end)
+        if ctx is None:
             return None
-        return _extract_result(ctx, self.groupcount)
+        return _extract_result(ctx, self.compiled.groupcount)
 
     def equal(self, other):
         if not isinstance(other, W_AnyRegexp):
@@ -133,6 +202,15 @@ class W_AnyRegexp(W_Object):
 def _extract_spans(ctx, groupcount):
     return [ctx.span(i) for i in range(groupcount + 1)]
 
+def _shift_spans(spans, offset):
+    result = []
+    for start, end in spans:
+        if start == -1 and end == -1:
+            result.append((start, end))
+        else:
+            result.append((start - offset, end - offset))
+    return result
+
 @rsre_core.specializectx
 @jit.unroll_safe
 def _extract_result(ctx, groupcount):
@@ -154,12 +232,16 @@ def _getslice(ctx, start, end):
     elif isinstance(ctx, rsre_core.UnicodeMatchContext):
         return ctx._unicodestr[start:end]
     else:
-        return ''.join([chr(ctx.str(j)) for j in range(start, end)])
-
-class W_Regexp(W_AnyRegexp): pass
-class W_PRegexp(W_AnyRegexp): pass
-class W_ByteRegexp(W_AnyRegexp): pass
-class W_BytePRegexp(W_AnyRegexp): pass
+        return ctx._buffer.getslice(start, end)
+
+class W_Regexp(W_AnyRegexp):
+    kind = 0
+class W_PRegexp(W_AnyRegexp):
+    kind = 1
+class W_ByteRegexp(W_AnyRegexp):
+    kind = 2
+class W_BytePRegexp(W_AnyRegexp):
+    kind = 3
 
 class ReplacementOption(object):
     _attrs_ = []
@@ -2,11 +2,17 @@ from pycket.base import W_Object, SingletonMeta
 from pycket.error import SchemeException
 from pycket import config
 
-from rpython.rlib import rerased, jit
+from rpython.rlib import rerased, rweakref, jit
 from rpython.rlib.objectmodel import compute_hash, we_are_translated
 from rpython.rlib.unicodedata import unicodedb_6_2_0 as unicodedb
 from rpython.rlib.rstring     import StringBuilder, UnicodeBuilder
 
+# Substrings at least this long share the characters of the string they
+# are taken from, and appending strings at least this long in total builds
+# a rope; shorter ones are cheaper to copy.
+SLICE_MIN_LENGTH = 32
+ROPE_MIN_LENGTH = 64
+
 @jit.unroll_safe
 def _is_ascii(s):
     if not jit.loop_unrolling_heuristic(s, len(s)):
@@ -64,18 +70,47 @@ class W_String(W_Object):
             cls = W_MutableString
         return cls(strategy, storage)
 
-    cache = {}
     @staticmethod
     def make(val):
-        lup = W_String.cache.get(val, None)
-        if lup is None:
-            lup = W_String.fromstr_utf8(val, immutable=True)
-            W_String.cache[val] = lup
-        return lup
+        return literal_cache.get(val)
+
+    @staticmethod
+    def make_slice(w_base, start, stop):
+        """ The characters from start to stop of w_base, a flat immutable
+        string, without copying them """
+        strategy = SliceStringStrategy.singleton
+        return W_MutableString(strategy, strategy.erase(StringSlice(w_base, start, stop)))
+
+    @staticmethod
+    @jit.unroll_safe
+    def make_rope(strings_w):
+        """ The concatenation of the strings as a rope, or None if copying
+        them is cheaper """
+        if not config.strategies:
+            return None
+        length = 0
+        pieces_w = []
+        for w_str in strings_w:
+            if w_str.length():
+                length += w_str.length()
+                pieces_w.append(w_str.snapshot())
+        if length < ROPE_MIN_LENGTH or len(pieces_w) < 2:
+            return None
+        strategy = RopeStringStrategy.singleton
+        w_result = pieces_w[0]
+        for i in range(1, len(pieces_w)):
+            rope = StringRope(w_result, pieces_w[i])
+            w_result = W_MutableString(strategy, strategy.erase(rope))
+        return w_result
 
     def make_immutable(self):
         raise NotImplementedError("abstract base class")
 
+    def snapshot(self):
+        """ A string with the current contents of self that is never
+        mutated, sharing the storage of self if it is immutable """
+        raise NotImplementedError("abstract base class")
+
     def get_strategy(self):
         raise NotImplementedError("abstract base class")
 
@@ -156,6 +191,50 @@ class W_String(W_Object):
         raise SchemeException("can't mutate string")
 
 
+class LiteralCache(object):
+    """ The immutable strings made by W_String.make, keyed on their utf-8
+    contents. The strings are held weakly, so that literals that are not used
+    any more can be collected. The dictionary cannot tell how many strings it
+    holds, so their keys are recorded as well; the keys of collected strings
+    are dropped whenever the number of keys has doubled. """
+    _attrs_ = ["strings", "keys", "prune_at"]
+
+    MIN_PRUNE_AT = 1024
+
+    def __init__(self):
+        self.strings = rweakref.RWeakValueDictionary(str, W_String)
+        self.keys = []
+        self.prune_at = self.MIN_PRUNE_AT
+
+    @jit.elidable
+    def get(self, val):
+        w_str = self.strings.get(val)
+        if w_str is None:
+            w_str = W_String.fromstr_utf8(val, immutable=True)
+            self.strings.set(val, w_str)
+            self.keys.append(val)
+            if len(self.keys) >= self.prune_at:
+                self.prune()
+        return w_str
+
+    def prune(self):
+        # a key is recorded again when its string was collected and made anew
+        keys = []
+        seen = {}
+        for key in self.keys:
+            if key not in seen and self.strings.get(key) is not None:
+                seen[key] = None
+                keys.append(key)
+        self.keys = keys
+        self.prune_at = max(self.MIN_PRUNE_AT, 2 * len(keys))
+
+    def size(self):
+        """ the number of strings alive in the cache """
+        self.prune()
+        return len(self.keys)
+
+literal_cache = LiteralCache()
+
 class W_MutableString(W_String):
 
     _attrs_ = ['storage', 'strategy']
@@ -185,6 +264,11 @@ class W_MutableString(W_String):
             storage = strategy.erase(s)
             return W_AsciiImmutableString(strategy, storage)
 
+    def snapshot(self):
+        if isinstance(self.get_strategy(), ImmutableStringStrategy):
+            return W_MutableString(self.get_strategy(), self.get_storage())
+        return self.make_immutable()
+
     def immutable(self):
         return False
 
@@ -211,6 +295,9 @@ class W_ImmutableString(W_String):
     def make_immutable(self):
         return self
 
+    def snapshot(self):
+        return self
+
     def immutable(self):
         return True
 
@@ -253,6 +340,10 @@ class StringStrategy(object):
     def as_unicharlist(self, w_str):
         raise NotImplementedError("abstract base class")
 
+    def is_ascii(self, w_str):
+        """ whether the string is stored as ascii """
+        return False
+
 
     # string operations
 
@@ -267,6 +358,11 @@ class StringStrategy(object):
         """ returns a W_String """
         raise NotImplementedError("abstract base class")
 
+    def copy_slice(self, w_str, start, stop):
+        """ returns a W_String with a copy of the characters, only for the
+        strategies of flat immutable strings """
+        raise NotImplementedError("abstract base class")
+
     def eq(self, w_str, w_other):
         # base implementations, subclasses should do better ones
         length = self.length(w_str)
@@ -391,6 +487,9 @@ class AsciiStringStrategy(ImmutableStringStrategy):
     def as_unicode(self, w_str):
         return unicode(self.unerase(w_str.get_storage())) # change strategy?
 
+    def is_ascii(self, w_str):
+        return True
+
 
     # string operations
 
@@ -401,6 +500,12 @@ class AsciiStringStrategy(ImmutableStringStrategy):
         return unichr(ord(self.unerase(w_str.get_storage())[index]))
 
     def getslice(self, w_str, start, stop):
+        if stop - start >= SLICE_MIN_LENGTH:
+            w_base = W_AsciiImmutableString(self, w_str.get_storage())
+            return W_String.make_slice(w_base, start, stop)
+        return self.copy_slice(w_str, start, stop)
+
+    def copy_slice(self, w_str, start, stop):
         v = self.unerase(w_str.get_storage())[start:stop]
         return W_MutableString(self, self.erase(v))
 
@@ -437,6 +542,9 @@ class AsciiMutableStringStrategy(MutableStringStrategy):
         return "".join(self.unerase(w_str.get_storage()))
     as_str_ascii = as_str_utf8
 
+    def is_ascii(self, w_str):
+        return True
+
     # string operations
 
     def length(self, w_str):
@@ -510,6 +618,12 @@ class UnicodeStringStrategy(ImmutableStringStrategy):
         return self.unerase(w_str.get_storage())[index]
 
     def getslice(self, w_str, start, stop):
+        if stop - start >= SLICE_MIN_LENGTH:
+            w_base = W_UnicodeImmutableString(self, w_str.get_storage())
+            return W_String.make_slice(w_base, start, stop)
+        return self.copy_slice(w_str, start, stop)
+
+    def copy_slice(self, w_str, start, stop):
         v = self.unerase(w_str.get_storage())[start:stop]
         return W_MutableString(self, self.erase(v))
 
@@ -598,3 +712,172 @@ class UnicodeMutableStringStrategy(MutableStringStrategy):
             builder.append(unichr(unicodedb.tolower(ord(ch))))
         return W_MutableString(self, self.erase(list(builder.build())))
 
+
+
+class StringSlice(object):
+    """ The storage of a slice: the characters from start to stop of a flat
+    immutable string, which are shared with it """
+    _attrs_ = _immutable_fields_ = ['w_base', 'start', 'stop']
+
+    def __init__(self, w_base, start, stop):
+        assert 0 <= start <= stop
+        self.w_base = w_base
+        self.start = start
+        self.stop = stop
+
+
+class FlattenedStringStrategy(ImmutableStringStrategy):
+    # base class of the strategies that store a string in pieces, all
+    # operations that need the characters in one piece flatten it first
+
+    def flatten(self, w_str):
+        """ switches w_str to the strategy of a flat string """
+        raise NotImplementedError("abstract base class")
+
+    def make_mutable(self, w_str):
+        self.flatten(w_str)
+        w_str.get_strategy().make_mutable(w_str)
+
+    def as_str_ascii(self, w_str):
+        self.flatten(w_str)
+        return w_str.as_str_ascii()
+
+    def as_str_utf8(self, w_str):
+        self.flatten(w_str)
+        return w_str.as_str_utf8()
+
+    def as_unicode(self, w_str):
+        self.flatten(w_str)
+        return w_str.as_unicode()
+
+    def eq(self, w_str, w_other):
+        self.flatten(w_str)
+        return w_str.equal(w_other)
+
+    def cmp(self, w_str, w_other):
+        self.flatten(w_str)
+        return w_str.cmp(w_other)
+
+    def cmp_case_insensitive(self, w_str, w_other):
+        self.flatten(w_str)
+        return w_str.cmp_case_insensitive(w_other)
+
+    def hash(self, w_str):
+        self.flatten(w_str)
+        return w_str.hash_equal()
+
+    def upper(self, w_str):
+        self.flatten(w_str)
+        return w_str.upper()
+
+    def lower(self, w_str):
+        self.flatten(w_str)
+        return w_str.lower()
+
+
+class SliceStringStrategy(FlattenedStringStrategy):
+    erase, unerase = rerased.new_static_erasing_pair("slice-string-strategy")
+
+    def flatten(self, w_str):
+        assert isinstance(w_str, W_MutableString)
+        slice = self.unerase(w_str.get_storage())
+        w_base = slice.w_base
+        w_flat = w_base.get_strategy().copy_slice(w_base, slice.start, slice.stop)
+        w_str.change_strategy(w_flat.get_strategy(), w_flat.get_storage())
+
+    def is_ascii(self, w_str):
+        w_base = self.unerase(w_str.get_storage()).w_base
+        return w_base.get_strategy().is_ascii(w_base)
+
+    # string operations
+
+    def length(self, w_str):
+        slice = self.unerase(w_str.get_storage())
+        return slice.stop - slice.start
+
+    def getitem(self, w_str, index):
+        slice = self.unerase(w_str.get_storage())
+        return slice.w_base.getitem(slice.start + index)
+
+    def getslice(self, w_str, start, stop):
+        slice = self.unerase(w_str.get_storage())
+        start += slice.start
+        stop += slice.start
+        if stop - start >= SLICE_MIN_LENGTH:
+            return W_String.make_slice(slice.w_base, start, stop)
+        return slice.w_base.get_strategy().copy_slice(slice.w_base, start, stop)
+
+
+class StringRope(object):
+    """ The storage of a rope: the concatenation of two strings that are
+    never mutated. It is flattened into a single string the first time its
+    characters are needed, once for all the ropes sharing it. """
+    _attrs_ = ['w_left', 'w_right', 'length', 'ascii', 'w_flat']
+    _immutable_fields_ = ['length', 'ascii']
+
+    def __init__(self, w_left, w_right):
+        self.w_left = w_left
+        self.w_right = w_right
+        self.length = w_left.length() + w_right.length()
+        self.ascii = (w_left.get_strategy().is_ascii(w_left) and
+                      w_right.get_strategy().is_ascii(w_right))
+        self.w_flat = None
+
+    @jit.dont_look_inside
+    def flatten(self):
+        if self.w_flat is not None:
+            return self.w_flat
+        # collect the leaves from left to right, without recursion, since
+        # ropes built by appending in a loop are as deep as they are long
+        pieces_w = []
+        todo = [self.w_right, self.w_left]
+        while todo:
+            w_piece = todo.pop()
+            strategy = w_piece.get_strategy()
+            if isinstance(strategy, RopeStringStrategy):
+                rope = strategy.unerase(w_piece.get_storage())
+                if rope.w_flat is None:
+                    todo.append(rope.w_right)
+                    todo.append(rope.w_left)
+                    continue
+                w_piece = rope.w_flat
+            pieces_w.append(w_piece)
+        if self.ascii:
+            builder = StringBuilder(self.length)
+            for w_piece in pieces_w:
+                builder.append(w_piece.as_str_ascii())
+            w_flat = W_String.fromascii(builder.build(), immutable=True)
+        else:
+            unibuilder = UnicodeBuilder(self.length)
+            for w_piece in pieces_w:
+                unibuilder.append(w_piece.as_unicode())
+            w_flat = W_String.fromunicode(unibuilder.build(), immutable=True)
+        self.w_flat = w_flat
+        self.w_left = None
+        self.w_right = None
+        return w_flat
+
+
+class RopeStringStrategy(FlattenedStringStrategy):
+    erase, unerase = rerased.new_static_erasing_pair("rope-string-strategy")
+
+    def flatten(self, w_str):
+        assert isinstance(w_str, W_MutableString)
+        w_flat = self.unerase(w_str.get_storage()).flatten()
+        w_str.change_strategy(w_flat.get_strategy(), w_flat.get_storage())
+
+    def is_ascii(self, w_str):
+        return self.unerase(w_str.get_storage()).ascii
+
+    # string operations
+
+    def length(self, w_str):
+        return self.unerase(w_str.get_storage()).length
+
+    def getitem(self, w_str, index):
+        self.flatten(w_str)
+        return w_str.getitem(index)
+
+    def getslice(self, w_str, start, stop):
+        self.flatten(w_str)
+        return w_str.getslice(start, stop)
@@ -4,7 +4,7 @@ from pycket import config
 from pycket import values
 from pycket import vector as values_vector
 from pycket.arity import Arity
-from pycket.base import SingleResultMixin, UnhashableType
+from pycket.base import SingletonMeta, SingleResultMixin, UnhashableType
 from pycket.cont import continuation, label
 from pycket.error import SchemeException
 from pycket.prims.expose import default, make_call_method
@@ -12,7 +12,7 @@ from pycket.small_list import inline_small_list
 from pycket.util import strip_immutable_field_name
 from pycket.values_parameter import W_Parameter
 
-from rpython.rlib import jit
+from rpython.rlib import debug, jit, rerased
 from rpython.rlib.objectmodel import import_from_mixin
 from rpython.rlib.unroll import unrolling_iterable
 
@@ -56,7 +56,8 @@ class W_StructType(values.W_Object):
             "init_field_cnt", "auto_field_cnt", "total_field_cnt",
             "total_auto_field_cnt", "total_init_field_cnt",
             "auto_v", "props", "inspector", "immutables[*]",
-            "immutable_fields[*]", "guard", "auto_values[*]", "offsets[*]",
+            "immutable_fields[*]", "field_positions[*]", "mutable_field_cnt",
+            "guard", "auto_values[*]", "offsets[*]",
             "constructor", "predicate", "accessor", "mutator", "prop_procedure",
             "constructor_arity", "procedure_source", "isprefab", "isopaque"]
 
@@ -269,6 +270,21 @@ class W_StructType(values.W_Object):
             struct_type = struct_type.super
         self.offsets = offsets[:]
         self.immutable_fields = immutable_fields[:]
+        # Where each field is stored: immutable fields at their position
+        # in the inline storage, mutable ones, encoded as -position-1, in
+        # the storage of the mutable fields.
+        field_positions = [0] * self.total_field_cnt
+        immutable_cnt = 0
+        mutable_cnt = 0
+        for i in range(self.total_field_cnt):
+            if i in immutable_fields:
+                field_positions[i] = immutable_cnt
+                immutable_cnt += 1
+            else:
+                field_positions[i] = -mutable_cnt - 1
+                mutable_cnt += 1
+        self.field_positions = field_positions
+        self.mutable_field_cnt = mutable_cnt
 
     @jit.elidable
     def get_offset(self, type):
@@ -283,7 +299,10 @@ class W_StructType(values.W_Object):
 
     def all_fields_immutable(self):
         self = jit.promote(self)
-        return self.total_field_cnt == len(self.immutable_fields)
+        return self.mutable_field_cnt == 0
+
+    def field_position(self, i):
+        return jit.promote(self).field_positions[i]
 
     def struct_type_info(self, cont):
         name = self.name
@@ -617,16 +636,7 @@ class W_Struct(W_RootStruct):
     def make_prefab(w_key, w_values):
         w_struct_type = W_StructType.make_prefab(
             W_PrefabKey.from_raw_key(w_key, len(w_values)))
-        constant_false = []
-        for i, value in enumerate(w_values):
-            if not w_struct_type.is_immutable_field_index(i):
-                w_values[i] = values.W_Cell(value)
-            elif value is values.w_false:
-                constant_false.append(i)
-        cls = lookup_struct_class(constant_false)
-        if cls is not W_Struct:
-            w_values = reduce_field_values(w_values, constant_false)
-        return cls.make(w_values, w_struct_type)
+        return make_struct(w_struct_type, w_values)
 
     def __init__(self, type):
         self._type = type
@@ -636,7 +646,7 @@ class W_Struct(W_RootStruct):
 
     @jit.unroll_safe
     def vals(self):
-        size = self._get_size_list()
+        size = self.struct_type().total_field_cnt
         values = [None] * size
         for i in range(size):
             values[i] = self._ref(i)
@@ -652,22 +662,20 @@ class W_Struct(W_RootStruct):
 
     def set_with_extra_info(self, field, val, app, env, cont):
         from pycket.interpreter import return_value
-        w_cell = self._set(field, val)
+        self._set(field, val)
         return return_value(values.w_void, env, cont)
 
     # unsafe versions
     def _ref(self, i):
-        w_res = self._get_list(i)
-        immutable = self.struct_type().is_immutable_field_index(i)
-        if not immutable:
-            assert isinstance(w_res, values.W_Cell)
-            w_res = w_res.get_val()
-        return w_res
+        return self._get_list(i)
 
     def _set(self, k, val):
-        w_cell = self._get_list(k)
-        assert isinstance(w_cell, values.W_Cell)
-        w_cell.set_val(val)
+        raise SchemeException("cannot modify value of immutable field in structure: %s" %
+                              self.tostring())
+
+    def _init_field(self, i, val):
+        """ Sets a field of a struct made by make_blank_struct """
+        self._set_list(i, val)
 
     # We provide a method to get properties from a struct rather than a struct_type,
     # since impersonators can override struct properties.
@@ -737,6 +745,23 @@ class W_Struct(W_RootStruct):
             for i in range(offset, offset + count):
                 fields[i] = self._ref(i).tostring()
 
+    def printed_fields(self, fields, w_type):
+        " like tostring_values, but collects the field values, or None for '...' "
+        assert isinstance(w_type, W_StructType)
+        w_super = w_type.super
+        has_super = isinstance(w_super, W_StructType)
+        if has_super:
+            self.printed_fields(fields, w_super)
+        offset = self.struct_type().get_offset(w_type)
+        count = w_type.total_field_cnt
+        if has_super:
+            count -= w_super.total_field_cnt
+        if w_type.isopaque:
+            fields.append(None)
+        else:
+            for i in range(offset, offset + count):
+                fields.append(self._ref(i))
+
     @jit.unroll_safe
     def _string_from_list(self, l):
         return ' '.join([s for s in l if s is not None])
@@ -753,6 +778,213 @@ class W_Struct(W_RootStruct):
             self.tostring_values(fields=fields, w_type=w_type, is_super=False)
             return "(%s %s)" % (typename, self._string_from_list(fields))
 
+class FieldStrategy(object):
+    """ How the mutable fields of a W_MutableStruct are stored. As long as
+    all of them hold fixnums, or all of them flonums, they are stored
+    unboxed; storing a value of another type switches the struct to the
+    object strategy. """
+    __metaclass__ = SingletonMeta
+
+    def is_correct_type(self, w_val):
+        raise NotImplementedError("abstract base class")
+
+    def ref(self, w_struct, i):
+        raise NotImplementedError("abstract base class")
+
+    def set(self, w_struct, i, w_val):
+        if self.is_correct_type(w_val):
+            self._set(w_struct, i, w_val)
+        else:
+            self.dehomogenize(w_struct)
+            ObjectFieldStrategy.singleton._set(w_struct, i, w_val)
+
+    def _set(self, w_struct, i, w_val):
+        raise NotImplementedError("abstract base class")
+
+    def ref_all(self, w_struct):
+        raise NotImplementedError("abstract base class")
+
+    def create_storage(self, fields_w):
+        raise NotImplementedError("abstract base class")
+
+    def dehomogenize(self, w_struct):
+        strategy = ObjectFieldStrategy.singleton
+        w_struct.mutable_storage = strategy.create_storage(self.ref_all(w_struct))
+        w_struct.mutable_strategy = strategy
+
+class UnwrappedFieldStrategyMixin(object):
+    # the concrete class needs to implement:
+    # erase, unerase, is_correct_type, wrap, unwrap
+
+    def _storage(self, w_struct):
+        l = self.unerase(w_struct.mutable_storage)
+        debug.make_sure_not_resized(l)
+        return l
+
+    def ref(self, w_struct, i):
+        assert i >= 0
+        return self.wrap(self._storage(w_struct)[i])
+
+    def _set(self, w_struct, i, w_val):
+        assert i >= 0
+        self._storage(w_struct)[i] = self.unwrap(w_val)
+
+    @jit.unroll_safe
+    def ref_all(self, w_struct):
+        return [self.wrap(x) for x in self._storage(w_struct)]
+
+    @jit.unroll_safe
+    def create_storage(self, fields_w):
+        return self.erase([self.unwrap(w_field) for w_field in fields_w])
+
+class ObjectFieldStrategy(FieldStrategy):
+    import_from_mixin(UnwrappedFieldStrategyMixin)
+
+    erase, unerase = rerased.new_erasing_pair("object-field-strategy")
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def is_correct_type(self, w_val):
+        return True
+
+    def wrap(self, w_val):
+        return w_val
+
+    def unwrap(self, w_val):
+        return w_val
+
+    def dehomogenize(self, w_struct):
+        assert 0 # unreachable, every value is of the correct type
+
+class FixnumFieldStrategy(FieldStrategy):
+    import_from_mixin(UnwrappedFieldStrategyMixin)
+
+    erase, unerase = rerased.new_erasing_pair("fixnum-field-strategy")
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def is_correct_type(self, w_val):
+        return isinstance(w_val, values.W_Fixnum)
+
+    def wrap(self, val):
+        assert isinstance(val, int)
+        return values.W_Fixnum(val)
+
+    def unwrap(self, w_val):
+        assert isinstance(w_val, values.W_Fixnum)
+        return w_val.value
+
+class FlonumFieldStrategy(FieldStrategy):
+    import_from_mixin(UnwrappedFieldStrategyMixin)
+
+    erase, unerase = rerased.new_erasing_pair("flonum-field-strategy")
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def is_correct_type(self, w_val):
+        return isinstance(w_val, values.W_Flonum)
+
+    def wrap(self, val):
+        assert isinstance(val, float)
+        return values.W_Flonum(val)
+
+    def unwrap(self, w_val):
+        assert isinstance(w_val, values.W_Flonum)
+        return w_val.value
+
+@jit.look_inside_iff(lambda fields_w:
+        jit.loop_unrolling_heuristic(fields_w, len(fields_w),
+                                     values.UNROLLING_CUTOFF))
+def find_field_strategy(fields_w):
+    if not config.strategies or not fields_w:
+        return ObjectFieldStrategy.singleton
+    if isinstance(fields_w[0], values.W_Fixnum):
+        for w_field in fields_w:
+            if not isinstance(w_field, values.W_Fixnum):
+                return ObjectFieldStrategy.singleton
+        return FixnumFieldStrategy.singleton
+    if isinstance(fields_w[0], values.W_Flonum):
+        for w_field in fields_w:
+            if not isinstance(w_field, values.W_Flonum):
+                return ObjectFieldStrategy.singleton
+        return FlonumFieldStrategy.singleton
+    return ObjectFieldStrategy.singleton
+
+@inline_small_list(immutable=True, attrname="storage", unbox_num=True)
+class W_MutableStruct(W_Struct):
+    """ A struct with mutable fields. The immutable fields are stored inline,
+    like those of W_Struct, the mutable ones in a storage of their own that
+    is written in place. """
+    _attrs_ = ["mutable_strategy", "mutable_storage"]
+
+    def __init__(self, type, mutable_strategy, mutable_storage):
+        W_Struct.__init__(self, type)
+        self.mutable_strategy = mutable_strategy
+        self.mutable_storage = mutable_storage
+
+    def get_mutable_strategy(self):
+        return jit.promote(self.mutable_strategy)
+
+    def _ref(self, i):
+        pos = self.struct_type().field_position(i)
+        if pos >= 0:
+            return self._get_list(pos)
+        return self.get_mutable_strategy().ref(self, -pos - 1)
+
+    def _set(self, i, val):
+        pos = self.struct_type().field_position(i)
+        if pos >= 0:
+            W_Struct._set(self, i, val)
+        else:
+            self.get_mutable_strategy().set(self, -pos - 1, val)
+
+    def _init_field(self, i, val):
+        pos = self.struct_type().field_position(i)
+        if pos >= 0:
+            self._set_list(pos, val)
+        else:
+            self.get_mutable_strategy().set(self, -pos - 1, val)
+
+@jit.unroll_safe
+def make_struct(struct_type, field_values):
+    """ Makes an instance of struct_type from the values of all its fields """
+    assert len(field_values) == struct_type.total_field_cnt
+    if not struct_type.all_fields_immutable():
+        immutable_values = [None] * (struct_type.total_field_cnt -
+                                     struct_type.mutable_field_cnt)
+        mutable_values = [None] * struct_type.mutable_field_cnt
+        for i, value in enumerate(field_values):
+            pos = struct_type.field_position(i)
+            if pos >= 0:
+                immutable_values[pos] = value
+            else:
+                mutable_values[-pos - 1] = value
+        strategy = find_field_strategy(mutable_values)
+        return W_MutableStruct.make(immutable_values, struct_type, strategy,
+                                    strategy.create_storage(mutable_values))
+    if CONST_FALSE_SIZE:
+        constant_false = []
+        for i, value in enumerate(field_values):
+            if value is values.w_false:
+                constant_false.append(i)
+    else:
+        constant_false = None
+    cls = lookup_struct_class(constant_false)
+    if cls is not W_Struct:
+        field_values = reduce_field_values(field_values, constant_false)
+    return cls.make(field_values, struct_type)
+
+def make_blank_struct(struct_type):
+    """ An instance of struct_type whose fields are still to be set with
+    _init_field, for building cyclic data """
+    size = struct_type.total_field_cnt
+    if struct_type.all_fields_immutable():
+        return W_Struct.make_n(size, struct_type)
+    mutable_cnt = struct_type.mutable_field_cnt
+    strategy = ObjectFieldStrategy.singleton
+    return W_MutableStruct.make_n(size - mutable_cnt, struct_type, strategy,
+                                  strategy.create_storage([None] * mutable_cnt))
+
 """
 This method generates a new structure class with inline stored immutable #f
 values on positions from constant_false array. If a new structure instance get
@@ -775,27 +1007,10 @@ def generate_struct_class(constant_false):
                 pos -= 1
             elif i == j:
                 return values.w_false
-        # original index
-        immutable = self.struct_type().is_immutable_field_index(i)
-        # altered index
-        w_res = self._get_list(pos)
-        if not immutable:
-            assert isinstance(w_res, values.W_Cell)
-            w_res = w_res.get_val()
-        return w_res
-
-    @jit.unroll_safe
-    def _set(self, i, val):
-        pos = i
-        for j in unrolling_constant_false:
-            if i > j:
-                pos -= 1
         # altered index
-        w_cell = self._get_list(pos)
-        assert isinstance(w_cell, values.W_Cell)
-        w_cell.set_val(val)
+        return self._get_list(pos)
 
-    cls = type(clsname, (W_Struct,), {'_ref':_ref, '_set': _set})
+    cls = type(clsname, (W_Struct,), {'_ref':_ref})
     cls = inline_small_list(sizemax=min(11,CONST_FALSE_SIZE),
                             immutable=True,
                             attrname="storage",
@@ -875,22 +1090,7 @@ def splice_array(array, index, insertion):
 @jit.unroll_safe
 def construct_struct_final(struct_type, field_values, env, cont):
     from pycket.interpreter import return_value
-    assert len(field_values) == struct_type.total_field_cnt
-    if CONST_FALSE_SIZE:
-        constant_false = []
-    else:
-        constant_false = None
-    for i, value in enumerate(field_values):
-        if not struct_type.is_immutable_field_index(i):
-            value = values.W_Cell(value)
-            field_values[i] = value
-        elif CONST_FALSE_SIZE and value is values.w_false:
-            constant_false.append(i)
-    cls = lookup_struct_class(constant_false)
-    if cls is not W_Struct:
-        field_values = reduce_field_values(field_values, constant_false)
-    result = cls.make(field_values, struct_type)
-    return return_value(result, env, cont)
+    return return_value(make_struct(struct_type, field_values), env, cont)
 
 def construct_struct_loop(init_type, struct_type, field_values, env, cont):
     from pycket.interpreter import return_multi_vals
@@ -0,0 +1,401 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Green threads. A thread is the state of the CEK machine, an (ast, env, cont)
+# triple, so switching threads amounts to saving the state of the current
+# thread and handing the state of another one back to the interpreter loop.
+#
+# Threads are switched when the running thread blocks (on a semaphore, a
+# channel, `sync`, `sleep` or another thread) and when it has used up its time
+# slice, which is an interval of the safepoints of the interpreter, see
+# safepoint.py. Only the outermost interpreter loop switches threads; a thread that would block while
+# a nested loop runs, e.g. during the instantiation of a required module,
+# raises an error instead.
+#
+import time
+
+from pycket           import values
+from pycket.cont      import BaseCont, label
+from pycket.error     import SchemeException
+from pycket.safepoint import SafepointHandler, safepoints
+from rpython.rlib     import jit
+
+class W_Thread(values.W_Evt):
+    """ A thread is ready for synchronization when it has terminated """
+    errorname = "thread"
+    _attrs_ = ["ast", "env", "cont", "dead", "waiters"]
+
+    def __init__(self):
+        # the state to resume the thread with, while it does not run
+        self.ast = None
+        self.env = None
+        self.cont = None
+        self.dead = False
+        self.waiters = []
+
+    def save(self, ast, env, cont):
+        self.ast = ast
+        self.env = env
+        self.cont = cont
+
+    def try_sync(self):
+        return self if self.dead else None
+
+    def register(self, waiter, w_result):
+        self.waiters.append(Registration(waiter, w_result))
+
+    def tostring(self):
+        return "#<thread>"
+
+class W_Semaphore(values.W_Evt):
+    errorname = "semaphore"
+    _attrs_ = ["n", "waiters"]
+
+    def __init__(self, n):
+        self.n = n
+        self.waiters = []
+
+    def post(self):
+        while self.waiters:
+            reg = self.waiters.pop(0)
+            if reg.fire(reg.w_result):
+                return
+        self.n += 1
+
+    def try_wait(self):
+        if self.n >= 1:
+            self.n -= 1
+            return True
+        return False
+
+    def try_sync(self):
+        return self if self.try_wait() else None
+
+    def register(self, waiter, w_result):
+        self.waiters.append(Registration(waiter, w_result))
+
+    def tostring(self):
+        return "#<semaphore>"
+
+class W_SemaphorePeekEvt(values.W_Evt):
+    """ Ready when the semaphore is, without decrementing it """
+    errorname = "semaphore-peek-evt"
+    _attrs_ = _immutable_fields_ = ["sema"]
+
+    def __init__(self, sema):
+        self.sema = sema
+
+    def try_sync(self):
+        return self if self.sema.n >= 1 else None
+
+    def register(self, waiter, w_result):
+        self.sema.waiters.append(PeekRegistration(waiter, w_result, self.sema))
+
+    def tostring(self):
+        return "#<semaphore-peek-evt>"
+
+class W_Channel(values.W_Evt):
+    """ A synchronous channel. As an event, it is ready when a value can be
+    received, and the value is the result. """
+    errorname = "channel"
+    _attrs_ = ["getters", "putters"]
+
+    def __init__(self):
+        self.getters = []
+        self.putters = []
+
+    def try_put(self, w_value):
+        while self.getters:
+            reg = self.getters.pop(0)
+            if reg.fire(w_value):
+                return True
+        return False
+
+    def try_get(self):
+        while self.putters:
+            reg = self.putters.pop(0)
+            assert isinstance(reg, PutRegistration)
+            if reg.fire(reg.w_result):
+                return reg.w_value
+        return None
+
+    def try_sync(self):
+        return self.try_get()
+
+    def register(self, waiter, w_result):
+        # the result is the value received
+        self.getters.append(Registration(waiter, None))
+
+    def tostring(self):
+        return "#<channel>"
+
+class W_ChannelPutEvt(values.W_Evt):
+    errorname = "channel-put-evt"
+    _attrs_ = _immutable_fields_ = ["channel", "w_value"]
+
+    def __init__(self, channel, w_value):
+        self.channel = channel
+        self.w_value = w_value
+
+    def try_sync(self):
+        return self if self.channel.try_put(self.w_value) else None
+
+    def register(self, waiter, w_result):
+        self.channel.putters.append(PutRegistration(waiter, w_result, self.w_value))
+
+    def tostring(self):
+        return "#<channel-put-evt>"
+
+class Waiter(object):
+    """ A blocked thread. It can be registered with several events, the
+    first one that becomes ready wakes the thread. """
+    _attrs_ = ["thread", "env", "cont", "done"]
+
+    def __init__(self, thread, env, cont):
+        self.thread = thread
+        self.env = env
+        self.cont = cont
+        self.done = False
+
+    def fire(self, w_result):
+        if self.done or self.thread.dead:
+            return False
+        self.done = True
+        get_scheduler().wake(self, w_result)
+        return True
+
+class Registration(object):
+    """ Registration of a waiter with an event. `w_result` is handed to the
+    waiter when the event fires, if it is not given by the event itself. """
+    _attrs_ = ["waiter", "w_result"]
+
+    def __init__(self, waiter, w_result):
+        self.waiter = waiter
+        self.w_result = w_result
+
+    def fire(self, w_result):
+        return self.waiter.fire(w_result)
+
+class PeekRegistration(Registration):
+    _attrs_ = ["sema"]
+
+    def __init__(self, waiter, w_result, sema):
+        Registration.__init__(self, waiter, w_result)
+        self.sema = sema
+
+    def fire(self, w_result):
+        # peeking leaves the post for the next waiter
+        if self.waiter.fire(w_result):
+            self.sema.post()
+            return True
+        return False
+
+class PutRegistration(Registration):
+    _attrs_ = ["w_value"]
+
+    def __init__(self, waiter, w_result, w_value):
+        Registration.__init__(self, waiter, w_result)
+        self.w_value = w_value
+
+class ThreadDoneCont(BaseCont):
+    """ The bottom of the continuation of a thread other than the main one """
+    _attrs_ = ["thread"]
+
+    def __init__(self, thread):
+        BaseCont.__init__(self)
+        self.thread = thread
+
+    def _clone(self):
+        return ThreadDoneCont(self.thread)
+
+    def plug_reduce(self, vals, env):
+        scheduler = get_scheduler()
+        scheduler.terminate(self.thread)
+        return scheduler.next_state()
+
+@label
+def start_thread(w_thunk, env, cont):
+    return w_thunk.call([], env, cont)
+
+class Scheduler(object):
+    _attrs_ = ["main", "current", "runnable", "sleepers", "depth", "started"]
+    _immutable_fields_ = ["started?"]
+
+    def __init__(self):
+        self.main = W_Thread()
+        self.current = self.main
+        self.runnable = []
+        # waiters with the time they are woken up at
+        self.sleepers = []
+        # nesting of interpreter loops
+        self.depth = 0
+        # whether any thread was created, threads are only switched at
+        # safepoints after that
+        self.started = False
+        # the threads spawned since track_threads, or None. Dead threads are
+        # dropped from it when it has doubled in size.
+        self.spawned = None
+        self.spawned_limit = 0
+
+    def spawn(self, w_thunk, env, cont):
+        if not self.started:
+            self.started = True
+            safepoints.register(thread_switch)
+        thread = W_Thread()
+        base = ThreadDoneCont(thread)
+        # the thread starts out with the current parameterization
+        w_paramz = cont.get_parameterization()
+        if w_paramz is not None:
+            base.update_cm(values.parameterization_key, w_paramz)
+        ast, env, cont = start_thread(w_thunk, env, base)
+        thread.save(ast, env, cont)
+        self.runnable.append(thread)
+        if self.spawned is not None:
+            self._track(thread)
+        return thread
+
+    def _track(self, thread):
+        spawned = self.spawned
+        assert spawned is not None
+        if len(spawned) >= self.spawned_limit:
+            spawned = [t for t in spawned if not t.dead]
+            self.spawned = spawned
+            self.spawned_limit = max(2 * len(spawned), 16)
+        spawned.append(thread)
+
+    def can_switch(self):
+        return self.depth == 1
+
+    @jit.dont_look_inside
+    def preempt(self, ast, env, cont):
+        """ Called at a safepoint, when the time slice is used up """
+        if not self.can_switch():
+            return ast, env, cont
+        self._wake_sleepers()
+        if not self.runnable:
+            return ast, env, cont
+        self.current.save(ast, env, cont)
+        self.runnable.append(self.current)
+        return self.next_state()
+
+    def block(self, who, env, cont):
+        """ Parks the current thread until a registration of the returned
+        waiter fires """
+        if not self.can_switch():
+            raise SchemeException("%s: cannot block here" % who)
+        return Waiter(self.current, env, cont)
+
+    def sleep(self, waiter, seconds):
+        self.sleepers.append((time.time() + seconds, waiter))
+
+    def wake(self, waiter, w_result):
+        from pycket.interpreter import safe_return_multi_vals
+        thread = waiter.thread
+        vals = values.Values.make1(w_result)
+        ast, env, cont = safe_return_multi_vals(vals, waiter.env, waiter.cont)
+        thread.save(ast, env, cont)
+        self.runnable.append(thread)
+
+    def terminate(self, thread):
+        if thread.dead:
+            return
+        thread.dead = True
+        thread.save(None, None, None)
+        if thread in self.runnable:
+            self.runnable.remove(thread)
+        waiters = thread.waiters
+        thread.waiters = []
+        for reg in waiters:
+            reg.fire(thread)
+
+    def track_threads(self):
+        """ Starts recording the threads that are spawned, for reset """
+        self.spawned = []
+        self.spawned_limit = 16
+
+    def reset(self):
+        """ Terminates the threads spawned since track_threads, including the
+        blocked ones, and the threads that are runnable or sleeping, so that
+        they do not run on in a later program """
+        threads = self.runnable[:]
+        for _, waiter in self.sleepers:
+            threads.append(waiter.thread)
+        if self.spawned is not None:
+            threads.extend(self.spawned)
+            self.spawned = None
+        for thread in threads:
+            if thread is not self.main:
+                self.terminate(thread)
+        self.runnable = []
+        self.sleepers = []
+        self.current = self.main
+
+    def _wake_sleepers(self):
+        if not self.sleepers:
+            return
+        now = time.time()
+        sleepers = []
+        for deadline, waiter in self.sleepers:
+            if waiter.done or waiter.thread.dead:
+                continue
+            if deadline <= now:
+                waiter.fire(values.w_false)
+            else:
+                sleepers.append((deadline, waiter))
+        self.sleepers = sleepers
+
+    @jit.dont_look_inside
+    def next_state(self):
+        """ Switches to the next runnable thread and returns its state """
+        while True:
+            self._wake_sleepers()
+            if self.runnable:
+                thread = self.runnable.pop(0)
+                ast, env, cont = thread.ast, thread.env, thread.cont
+                assert ast is not None
+                thread.save(None, None, None)
+                self.current = thread
+                safepoints.refuel()
+                return ast, env, cont
+            if not self.sleepers:
+                break
+            deadline = self.sleepers[0][0]
+            for d, _ in self.sleepers:
+                deadline = min(deadline, d)
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        # every thread waits for something that cannot happen any more
+        self.current = self.main
+        raise SchemeException("all threads are blocked")
+
+    def thread_failed(self, e):
+        """ An uncaught exception ends the current thread, but not the
+        program """
+        from pycket.prims.input_output import stderr_port
+        thread = self.current
+        assert thread is not self.main
+        stderr_port.write("error in thread: %s\n" % e.format_error())
+        self.terminate(thread)
+        return self.next_state()
+
+class SchedulerHolder(object):
+    _attrs_ = ["scheduler"]
+    _immutable_fields_ = ["scheduler"]
+
+    def __init__(self):
+        self.scheduler = Scheduler()
+
+_holder = SchedulerHolder()
+
+def get_scheduler():
+    return _holder.scheduler
+
+class ThreadSwitch(SafepointHandler):
+    """ Preempts the current thread at every safepoint """
+    _attrs_ = []
+
+    def safepoint(self, ast, env, cont):
+        return get_scheduler().preempt(ast, env, cont)
+
+thread_switch = ThreadSwitch()
@@ -128,6 +128,16 @@ class W_Vector(W_MVector):
     def length(self):
         return self.len
 
+    def fixnum_storage(self):
+        """ Switches the vector to unboxed fixnums and returns their list, for
+        overwriting all the elements in place. The old contents are lost. """
+        assert not self.strategy.immutable()
+        strategy = FixnumVectorStrategy.singleton
+        if self.strategy is not strategy:
+            self.set_strategy(strategy)
+            self.storage = strategy.erase([0] * self.len)
+        return strategy._storage(self)
+
     def tostring(self):
         l = self.strategy.ref_all(self)
         return "#(%s)" % " ".join([obj.tostring() for obj in l])
@@ -193,6 +203,10 @@ class W_FlVector(W_VectorSuper):
     def length(self):
         return self.len
 
+    def float_storage(self):
+        """ The unboxed elements, for updating them in place """
+        return FlonumVectorStrategy.singleton._storage(self)
+
     def tostring(self):
         l = self.get_strategy().ref_all(self)
         return "(flvector %s)" % " ".join([obj.tostring() for obj in l])